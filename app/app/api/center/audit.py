@@ -23,11 +23,14 @@ from app.schemas import (
     AuditRecordsSchema
 )
 from app.utils.msg_util import find_records
-from app.utils.common import convert_mongo_document_to_schema, convert_mongo_document_to_data
+from app.utils.common import convert_mongo_documents_to_schema, convert_mongo_document_to_data
+from app.utils.pagination_util import paginate, paginate_after, page_cursor
 
 
 router = APIRouter()
 
+AUDIT_REFERENCES = ['applicant', 'auditor', 'component']
+
 
 @router.get('/audit/enumerate')
 def enumerate_audit_desc(current_user: UserModel = Depends(deps.get_current_user)):
@@ -35,7 +38,7 @@ def enumerate_audit_desc(current_user: UserModel = Depends(deps.get_current_user
     Enumerates the audit type </br>
     """
     _d = AuditEnumerateModel.objects
-    _data = list(map(lambda x: convert_mongo_document_to_schema(x, AuditEnumerateSchema, user=True), _d))
+    _data = convert_mongo_documents_to_schema(_d, AuditEnumerateSchema, user=True)
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content={
@@ -51,12 +54,14 @@ def audit_info(
         skip: int = 0,
         limit: int = 10,
         query_sets: dict = {},
+        cursor: str = None,
         current_user: UserModel = Depends(deps.get_current_user)):
     """
     Current user review information acquisition </br>
     :param query_sets: Information retrieval </br>
     :param skip:
     :param limit:
+    :param cursor: next of the previous response, replaces skip: stable pages while records are submitted </br>
     :param current_user:
     :return:
     """
@@ -75,9 +80,13 @@ def audit_info(
     else:
         _d = AuditRecordsModel.objects(applicant=current_user.id, **query_sets)
     print(query_sets)
-    _d = _d.order_by('-submit_at')
-    _data = list(map(lambda x: convert_mongo_document_to_schema(x, AuditRecordsSchema,
-                                                                revers_map=['applicant', 'auditor', 'component']), _d))
+    if cursor:
+        _page, _next = paginate_after(_d, 'submit_at', cursor, limit)
+        _total = _d.count()
+    else:
+        _page, _total = paginate(_d, skip, limit, '-submit_at', '-id')
+        _next = page_cursor(_page[-1], 'submit_at') if len(_page) == limit and skip + limit < _total else None
+    _data = convert_mongo_documents_to_schema(_page, AuditRecordsSchema, revers_map=AUDIT_REFERENCES)
 
     if query_sets.get('audit_type') is not None:
         query_sets.pop('audit_type')
@@ -87,9 +96,10 @@ def audit_info(
 
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"msg": "Success",
-                                 "data": _data[skip: skip+limit],
+                                 "data": _data,
                                  "counts": _audit_counts,
-                                 "total": len(_data)})
+                                 "total": _total,
+                                 "next": _next})
 
 
 @router.get('/audit/counts')
@@ -128,15 +138,15 @@ def get_msg(page: int = 0,
             # for _ in AuditRecordsModel.objects(applicant=current_user.id, audit_status=False).all():
             #     msg.append(_)
 
-            msg = AuditRecordsModel.objects(audit_type__in=ls, audit_status=False).all()
+            msg = AuditRecordsModel.objects(audit_type__in=ls, audit_status=False)
         else:
-            msg = AuditRecordsModel.objects(applicant=current_user.id, audit_status=False).all()
-        _data = list(map(lambda x: convert_mongo_document_to_schema(x, AuditRecordsSchema,
-                                                                    revers_map=['applicant', 'auditor', 'component']), msg))
+            msg = AuditRecordsModel.objects(applicant=current_user.id, audit_status=False)
+        _page, _total = paginate(msg, skip, limit)
+        _data = convert_mongo_documents_to_schema(_page, AuditRecordsSchema, revers_map=AUDIT_REFERENCES)
         return JSONResponse(status_code=status.HTTP_200_OK,
                             content={"msg": "Success",
-                                     "data": _data[skip: skip+limit],
-                                     "total": len(_data)
+                                     "data": _data,
+                                     "total": _total
                                      }
                             )
     except Exception as e:
@@ -18,7 +18,7 @@ from app.models.mongo import (
 )
 
 from app.utils.msg_util import find_records
-from app.utils.common import convert_mongo_document_to_schema, convert_mongo_document_to_data
+from app.utils.common import convert_mongo_documents_to_schema, convert_mongo_document_to_data
 from app.models.mongo.messages import MessagesModel
 from app.schemas.messages import MessagesSchema
 from app.utils.common import generate_uuid
@@ -99,14 +99,8 @@ def msg_v2( title: str = None,
     if ls:
         audit_msg = MessagesModel.objects(messages_source__in=ls, **query).order_by('-creat_time')
     msg = MessagesModel.objects(user=current_user.id,**query).order_by('-creat_time')
-    _data = []
-    for _ in msg:
-        _item = convert_mongo_document_to_schema(_, MessagesSchema, revers_map=['user', 'from_user'])
-        _data.append(_item)
-    if audit_msg:
-        for _ in audit_msg:
-            _item = convert_mongo_document_to_schema(_, MessagesSchema, revers_map=['user', 'from_user'])
-            _data.append(_item)
+    _data = convert_mongo_documents_to_schema(list(msg) + list(audit_msg), MessagesSchema,
+                                              revers_map=['user', 'from_user'])
 
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"data": _data[skip: skip+limit],
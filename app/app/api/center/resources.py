@@ -20,7 +20,7 @@ from app.api import deps
 from app.utils.msg_util import creat_message
 from app.utils.resource_util import get_cache_cumulative_num
 from app.utils.statement import query_statement, create_statement
-from app.utils.common import convert_mongo_document_to_schema, generate_uuid
+from app.utils.common import convert_mongo_document_to_schema, convert_mongo_documents_to_schema, generate_uuid
 from app.models.mongo import (
     UserModel,
     ToolTaskModel,
@@ -66,19 +66,18 @@ def computing_resources(
     else:
         _d = ComputingResourceModel.objects()
         _allocated = ComputingResourceAllocatedModel.objects(allocated_user=current_user.id)
-    _data = {i['id']: i for i in map(lambda x: convert_mongo_document_to_schema(x, ComputingResourceSchema,
-                                                                                revers_map=['allocated_user',
-                                                                                            "allocated_time",
-                                                                                            "last_update_user"]), _d)}
+    _data = {i['id']: i for i in convert_mongo_documents_to_schema(_d, ComputingResourceSchema,
+                                                                   revers_map=['allocated_user', "allocated_time",
+                                                                               "last_update_user"])}
     print(_data)
     time_now = time.mktime(datetime.utcnow().timetuple())
     ls = list()
     used_resources = set()
-    for _ in _allocated:
+    _allocated = list(_allocated)
+    _items = convert_mongo_documents_to_schema(_allocated, ComputingResourceAllocatedSchema, revers_map=['allocated_user'])
+    for _, _item in zip(_allocated, _items):
         _allocated_time_smtp = time.mktime(_.allocated_time.timetuple())
         consuming = time_now - _allocated_time_smtp
-        _item = convert_mongo_document_to_schema(_, ComputingResourceAllocatedSchema,
-                                                 revers_map=['allocated_user'])
         print(_item['computing_resource_base'])
         base_resource = copy.deepcopy(_data.get(_item['computing_resource_base']))
         used_resources.add(_item['computing_resource_base'])
@@ -6,7 +6,7 @@
 @time:2022/09/29
 """
 import re
-import os
+import mimetypes
 from pathlib import Path
 from fastapi import (
     APIRouter,
@@ -19,26 +19,31 @@ from fastapi import (
 )
 import datetime
 from typing import Optional
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
 from app.api import deps
 from app.models.mongo import UserModel, StorageResourceAllocatedModel
 from app.models.mongo.dataset import DataFileSystem
 from app.schemas.dataset import DatasetV2Schema
-from app.utils.common import convert_mongo_document_to_schema
+from app.utils.common import convert_mongo_documents_to_schema
 from app.utils.common import generate_uuid
+from app.utils.pagination_util import paginate
 from app.utils.resource_util import get_cache_cumulative_num
 from app.utils.file_util import generate_datasets_model, del_datasets, share_util
 from app.models.mongo.public_data import PublicDataFileModel, PublicDatasetModel
 from app.utils.middleware_util import get_s3_client
-from app.utils.file_util import stream_to_b64_stream
+from app.utils.upload_util import merge_chunks, save_chunk, uploaded_chunks
 from app.utils.resource_util import cache_cumulative_sum, cut_user_storage_size
 from app.schemas.public_data import PublicDataFileSchema, PublicDatasetSchema
 from app.core.config import settings
 from app.service.manager.storage import StorageManager
-from app.service.manager.datasets import DatasetsManager
+from app.service.manager.lake import lake_committer
+from app.service.manager.datasets import DatasetsManager, PublicDatasetStats
 # from app.service.response import DataLabResponse
 router = APIRouter()
 
+ICON_MAX_AGE = 3600
+
 
 @router.get('/')
 async def my_data_list(
@@ -53,8 +58,8 @@ async def my_data_list(
 
     skip = skip * limit
     _query = dict()
-    # sum = await get_cache_cumulative_num(current_user.id, request.app.state.use_storage_cumulative)
-    sum = DataFileSystem.objects(user=current_user, is_dir=False, deleted=False, public=None).sum('data_size')
+    # Atomic counter kept in step with DataFileSystem by storage_usage_reconciler
+    sum = await get_cache_cumulative_num(current_user.id, request.app.state.use_storage_cumulative)
     _total_size = StorageResourceAllocatedModel.objects(allocated_user=current_user.id).first().allocated_storage_size
     if dataset_id is not None:
         # Priority processing dataset_id Does it exist
@@ -82,10 +87,7 @@ async def my_data_list(
                                                         task_id=_dfs.task_id,
                                                         lab_id=_dfs.lab_id
                                                     )
-            for _t in task_data_list:
-                _d = convert_mongo_document_to_schema(_t, DatasetV2Schema, user=True, revers_map=['user'])
-                _d['from_source'] = "COMPUTING" if _d['data_type'] == "TaskData" else "UPLOAD"
-                _data.append(_d)
+            _page, _total = paginate(task_data_list, skip, limit)
 
         else:
             _data = list()
@@ -97,19 +99,15 @@ async def my_data_list(
                 return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
                                     content={"msg": f"data_path is not dir: {root_path}"})
             else:
-                path_list = list(root_path.iterdir())
-                for path in path_list:
-                    if name is not None and name not in path.name:
-                        continue
-                    sub_dataFileSystem = DataFileSystem.objects(data_path=path.as_posix()).first()
-                    if sub_dataFileSystem is None:
-                        continue
-                    _d = convert_mongo_document_to_schema(sub_dataFileSystem, DatasetV2Schema, user=True,
-                                                          revers_map=['user'])
-                    _d['from_source'] = "COMPUTING" if _d['data_type'] == "TaskData" else "UPLOAD"
-                    _data.append(_d)
-        _total = len(_data)
-        _data = _data[skip: skip + limit]
+                # Rows directly under the directory: anchored on the data_path index instead of one query per entry
+                _children = DataFileSystem.objects(data_path=re.compile(f"^{re.escape(root_path.as_posix())}/[^/]+$"),
+                                                   user=current_user.id, deleted__in=[False, 0])
+                if name is not None:
+                    _children = _children.filter(name__contains=name)
+                _page, _total = paginate(_children, skip, limit, "-is_dir", "name")
+        for _d in convert_mongo_documents_to_schema(_page, DatasetV2Schema, user=True, revers_map=['user']):
+            _d['from_source'] = "COMPUTING" if _d['data_type'] == "TaskData" else "UPLOAD"
+            _data.append(_d)
 
     else:
         # Not a solicitation
@@ -119,12 +117,10 @@ async def my_data_list(
         else:
             _dfs = DataFileSystem.objects(user=current_user.id, deps=0, deleted=False).order_by("-created_at")
         _data = list()
-        _total = _dfs.count()
-        if _dfs:
-            for _obj in _dfs.skip(skip).limit(limit):
-                _d = convert_mongo_document_to_schema(_obj, DatasetV2Schema, user=True,revers_map=['user'])
-                _d['from_source'] = "COMPUTING" if _d['data_type'] == "TaskData" else "UPLOAD"
-                _data.append(_d)
+        _page, _total = paginate(_dfs, skip, limit)
+        for _d in convert_mongo_documents_to_schema(_page, DatasetV2Schema, user=True, revers_map=['user']):
+            _d['from_source'] = "COMPUTING" if _d['data_type'] == "TaskData" else "UPLOAD"
+            _data.append(_d)
 
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"msg": "Show all datasets",
@@ -176,24 +172,14 @@ async def my_share(
         sum = await get_cache_cumulative_num(current_user.id, request.app.state.use_storage_cumulative)
         _total_size = StorageResourceAllocatedModel.objects(
             allocated_user=current_user.id).first().allocated_storage_size
-        if _dfs:
-            _data = list(map(lambda x: convert_mongo_document_to_schema(x, DatasetV2Schema, user=True,
-                                                                        revers_map=['user']), _dfs))
-        else:
-            return JSONResponse(status_code=status.HTTP_200_OK,
-                                content={"msg": "Show all datasets",
-                                         "data": [],
-                                         "size": sum,
-                                         'total_size': _total_size,
-                                         'total': 0})
-        _total_size = StorageResourceAllocatedModel.objects(
-            allocated_user=current_user.id).first().allocated_storage_size
+        _page, _total = paginate(_dfs, skip, limit)
+        _data = convert_mongo_documents_to_schema(_page, DatasetV2Schema, user=True, revers_map=['user'])
         return JSONResponse(status_code=status.HTTP_200_OK,
                             content={"msg": "Show all datasets",
-                                     "data": _data[skip: skip + limit],
+                                     "data": _data,
                                      "size": sum,
                                      'total_size': _total_size,
-                                     'total': len(_data)})
+                                     'total': _total})
 
 
 @router.get('/from_share', summary='Data retrieval from shared')
@@ -219,23 +205,14 @@ async def my_share(
         #                     content={"msg": "No storage resources available"}
         #                              )
         _total_size = user_size.allocated_storage_size
-        if _dfs:
-            _data = list(map(lambda x: convert_mongo_document_to_schema(x, DatasetV2Schema, user=True,
-                                                                        revers_map=['user', 'from_user']), _dfs))
-        else:
-            return JSONResponse(status_code=status.HTTP_200_OK,
-                                content={"msg": "Show all datasets",
-                                         "data": [],
-                                         "size": sum,
-                                         'total_size': _total_size,
-                                         'total': 0})
-
+        _page, _total = paginate(_dfs, skip, limit)
+        _data = convert_mongo_documents_to_schema(_page, DatasetV2Schema, user=True, revers_map=['user', 'from_user'])
         return JSONResponse(status_code=status.HTTP_200_OK,
                             content={"msg": "Show all datasets",
-                                     "data": _data[skip: skip + limit],
+                                     "data": _data,
                                      "size": sum,
                                      'total_size': _total_size,
-                                     'total': len(_data)})
+                                     'total': _total})
 
 
 @router.post('/share', summary="Share my data with other users")
@@ -270,9 +247,7 @@ async def undo_data_share(
         return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
                             content={"msg": "Resource does not exist！"})
     ids = generate_datasets_model(_d.id, _d.user.id)
-    _dfs = DataFileSystem.objects(id__in=ids)
-    for i in _dfs:
-        i.delete()
+    DataFileSystem.objects(id__in=ids).delete()
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"msg": "Success"})
 
@@ -287,30 +262,55 @@ async def get_public_data(name: str = None,
                             content={"data": [],
                                      "total": 0,
                                      "msg": "Successful!"})
-    client = get_s3_client()
     if name:
         _dfs = PublicDatasetModel.objects(name__contains=name, access="PUBLIC")
     else:
         _dfs = PublicDatasetModel.objects(access="PUBLIC")
-    data = list()
-    if not _dfs:
-        return JSONResponse(status_code=status.HTTP_200_OK,
-                            content={"data": list(),
-                                     "total": 0,
-                                     "msg": "Successful!"})
-    for _ in _dfs:
-        _d = convert_mongo_document_to_schema(_, PublicDatasetSchema, user=True)
-        _d['icon'] = stream_to_b64_stream(client.get_object(_.id, _.icon).read())
-        inner_files = PublicDataFileModel.objects(datasets=_.id).order_by("created_at").first()
-        _d['create_at'] = inner_files.created_at.strftime('%Y/%m/%d %H:%M:%S') if inner_files else None
-        data.append(_d)
-    skip = page * limit
+    rows, total = await run_in_threadpool(PublicDatasetStats.page, _dfs, page * limit, limit)
+    data = convert_mongo_documents_to_schema([_ for _, _stats in rows], PublicDatasetSchema, user=True)
+    for _d, (_, _stats) in zip(data, rows):
+        _d['icon'] = f"{settings.API_STR}/data_center/public/{_.id}/icon"
+        _d['files'] = _stats['files']
+        _d['data_size'] = _stats['data_size']
+        _d['create_at'] = _stats['created_at'].strftime('%Y/%m/%d %H:%M:%S') if _stats.get('created_at') else None
     return JSONResponse(status_code=status.HTTP_200_OK,
-                        content={"data": data[skip: skip+limit],
-                                 "total": len(data),
+                        content={"data": data,
+                                 "total": total,
                                  "msg": "Successful!"})
 
 
+@router.get('/public/{dataset_id}/icon', summary="Icon of open data")
+async def get_public_data_icon(dataset_id: str, request: Request):
+    """
+    Served apart from the listings so browsers cache it: revalidated with the ETag of the MinIO object
+    """
+    _d = PublicDatasetModel.objects(id=dataset_id).only("icon").first()
+    if _d is None or not _d.icon:
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
+                            content={"msg": "Resource does not exist！"})
+    client = get_s3_client()
+    try:
+        _stat = await run_in_threadpool(client.stat_object, dataset_id, _d.icon)
+    except Exception as e:
+        print(f"Public data icon {dataset_id}: {e}")
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
+                            content={"msg": "Resource does not exist！"})
+    _etag = f'"{_stat.etag}"'
+    headers = {"ETag": _etag, "Cache-Control": f"public, max-age={ICON_MAX_AGE}"}
+    if _etag in [_.strip().removeprefix("W/") for _ in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    def _read() -> bytes:
+        _response = client.get_object(dataset_id, _d.icon)
+        try:
+            return _response.read()
+        finally:
+            _response.close()
+            _response.release_conn()
+    return Response(content=await run_in_threadpool(_read), headers=headers,
+                    media_type=mimetypes.guess_type(_d.icon)[0] or "application/octet-stream")
+
+
 @router.get('/public/data', summary="Access to open data")
 async def get_public_file(
         dataset_id: str,
@@ -322,14 +322,11 @@ async def get_public_file(
     query_map = {k: v for k, v in {"name__contains": name, "file_extension": file_extension}.items() if v is not None}
     query_map['datasets'] = dataset_id
     _dfs = PublicDataFileModel.objects(**query_map)
-    data = list()
-    for _ in _dfs:
-        _d = convert_mongo_document_to_schema(_, PublicDataFileSchema)
-        data.append(_d)
-    skip = page * limit
+    _page, _total = paginate(_dfs, page * limit, limit)
+    data = convert_mongo_documents_to_schema(_page, PublicDataFileSchema)
     return JSONResponse(status_code=status.HTTP_200_OK,
-                        content={"data": data[skip: skip+limit],
-                                 "total": len(data),
+                        content={"data": data,
+                                 "total": _total,
                                  "msg": "Successful!"})
 
 
@@ -377,14 +374,11 @@ async def get_datasets_file(
     query_map = {k: v for k,v in {"name__contains": name, "file_extension": file_extension}.items() if v is not None}
     query_map['datasets'] = dataset_id
     _dfs = PublicDataFileModel.objects(**query_map).order_by("-updated_at")
-    data = list()
-    for _ in _dfs:
-        _d = convert_mongo_document_to_schema(_, PublicDataFileSchema)
-        data.append(_d)
-    skip = page * limit
+    _page, _total = paginate(_dfs, page * limit, limit)
+    data = convert_mongo_documents_to_schema(_page, PublicDataFileSchema)
     return JSONResponse(status_code=status.HTTP_200_OK,
-                        content={"data": data[skip: skip+limit],
-                                 "total": len(data),
+                        content={"data": data,
+                                 "total": _total,
                                  "msg": "Successful!"})
 
 
@@ -407,22 +401,27 @@ async def upload_big_file(request: Request,
     if len(chunk_number) == 0 or len(identifier) == 0:
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
                             content={"msg": "Missing identifier"})
-    filename = f'{relative_path}{identifier}{chunk_number}'  # ShardingUnique identification
-    contents = await file.read()  # Read a file asynchronously
     storage_path = Path(settings.BASE_DIR, settings.DATA_PATH, current_user.id)
-    _path = Path(filename)
-    if _path.parent != "." and _path.parent != "/":
-        mks_name = f"{storage_path}/uploads/{_path.parent}"
-        try:
-            os.makedirs(mks_name)
-        except FileExistsError:
-            pass
-    with open(f"{storage_path}/uploads/{filename}", "wb") as f:
-        f.write(contents)
+    # ShardingUnique identification: <relative_path><identifier><chunk_number>, copied outside the event loop
+    await run_in_threadpool(save_chunk, file, f"{storage_path}/uploads", relative_path, identifier, chunk_number,
+                            total_chunks=total_chunks, total_size=total_size)
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"msg": f"Received{relative_path}Sharding{chunk_number}"})
 
 
+@router.get("/upload/chunks")
+async def get_uploaded_chunks(identifier: str,
+                              relative_path: str,
+                              current_user: UserModel = Depends(deps.get_current_user)):
+    """
+    Chunks already received for a resumable upload，Only the missing ones have to be sent again
+    """
+    storage_path = Path(settings.BASE_DIR, settings.DATA_PATH, current_user.id)
+    data = await run_in_threadpool(uploaded_chunks, f"{storage_path}/uploads", relative_path, identifier)
+    return JSONResponse(status_code=status.HTTP_200_OK,
+                        content={"data": data, "msg": "Successful!"})
+
+
 @router.post("/upload/merge_file")
 async def merge_file(request: Request,
                      identifier: str = Form(...),
@@ -433,25 +432,7 @@ async def merge_file(request: Request,
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
                             content={"msg": "Missing identifier"})
     storage_path = Path(settings.BASE_DIR, settings.DATA_PATH, current_user.id)
-    _mode_base = f"{file_name}{identifier}*"
-    _mode_path = f"{storage_path}/uploads"
-    if len(file_name.split('/')) > 1:
-        _mode_base = f"{file_name.rsplit('/', maxsplit=1)[-1]}{identifier}*"
-        _mode_path = f"{storage_path}/uploads/{file_name.rsplit('/', maxsplit=1)[0]}"
-    _path = Path(_mode_path)
-    merge_task = dict()
-    for i in _path.rglob(_mode_base):
-        _relative_path, _suffix = i.__fspath__().rsplit(identifier, maxsplit=1)
-        if merge_task.get(_relative_path) is None:
-            merge_task[_relative_path] = list()
-        merge_task[_relative_path].append(i.__fspath__())
-    for k, v in merge_task.items():
-        v.sort()
-        with open(k, 'wb') as f:
-            for _file_name in v:
-                with open(_file_name, 'rb') as reader:
-                    f.write(reader.read())
-                os.remove(_file_name)
+    await run_in_threadpool(merge_chunks, f"{storage_path}/uploads", file_name, identifier)
     absolute_path = f"{storage_path}/uploads/{file_name}"
     # StorageManager.from_dir(absolute_path, current_user)
     # request.app.state.use_storage_cumulative
@@ -466,12 +447,20 @@ async def merge_file(request: Request,
                         content={"file": file_name, "msg": "Successful!"})
 
 
+
+@router.post("/upload/finish")
+async def finish_upload(current_user: UserModel = Depends(deps.get_current_user)):
+    """
+    End of a folder upload，The files pushed to lakeFS are committed together once their uploads are done
+    """
+    await run_in_threadpool(lake_committer.finish, current_user.id)
+    return JSONResponse(status_code=status.HTTP_200_OK,
+                        content={"msg": "Successful!"})
+
 @router.get('/geoserver/datasets')
 async def search_geoserver_datasets(current_user: UserModel = Depends(deps.get_current_user)):
     dfs = DataFileSystem.objects(file_extension__in=["shp", "shape", "tif", "tiff"])
-    data = list(
-        map(lambda x: convert_mongo_document_to_schema(x, DatasetV2Schema, user=True, revers_map=['user']), dfs
-            ))
+    data = convert_mongo_documents_to_schema(dfs, DatasetV2Schema, user=True, revers_map=['user'])
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"data": data})
 
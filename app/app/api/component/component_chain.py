@@ -6,7 +6,6 @@
 @time:2022/11/12
 """
 import json
-import pickle
 import asyncio
 from fastapi.responses import JSONResponse
 from minio import S3Error
@@ -29,12 +28,15 @@ from app.models.mongo import (
 )
 # from app.core.flow.steps import LabStep
 from app.core.config import settings
-from app.utils.common import convert_mongo_document_to_schema
+from app.utils.common import convert_mongo_documents_to_schema
 from app.schemas.dataset import DatasetV2Schema
 from app.utils.resource_util import quota_full, check_storage_resource
-from app.utils.middleware_util import get_s3_client
-from app.core.serialize.ptype import frontend_map
+from app.core.serialize.result import async_result_previews, async_result_page
 from app.core.flow.flow import DAG, Flow
+from app.service.manager.dag import DAGCacheManager
+from app.service.manager.tasklog import task_log_hub
+from app.utils.sse import sse_response, progress_events, decode_event_id
+from app.utils.websocket_util import run_until_disconnect
 router = APIRouter()
 
 
@@ -207,13 +209,11 @@ router = APIRouter()
 
 
 @router.get('/dag/{experiments_id}')
-async def components_dataset(experiments_id: str
+def components_dataset(experiments_id: str
 
                        ):
-    _dag = DAG(experiments_id)
-    _dag.from_experiments()
     return JSONResponse(status_code=status.HTTP_200_OK,
-                        content={"data": _dag.front_graph()})
+                        content={"data": DAGCacheManager.graph(experiments_id)})
 
 
 @router.post('/{analysis_id}')
@@ -248,48 +248,83 @@ async def component_start(
 @router.websocket("/ws/{analysis_id}")
 async def socket_analysis(websocket: WebSocket, analysis_id: str):
     await websocket.accept()
-    while 1:
-        _status = await websocket.app.state.task_publisher.get(analysis_id)
-        _all_task = json.loads(await websocket.app.state.task_publisher.get(analysis_id + '-stage'))
-        _msg = list()
-        for _task in _all_task:
-            _msg.extend(await websocket.app.state.task_publisher.lrange(_task, 0, -1))
-        if _status == settings.COMPUTING_SUCCESS:
-            await websocket.send_json({"status": settings.COMPUTING_SUCCESS, "msg": _msg})
-            break
-        elif _status == settings.COMPUTING_PENDING:
-            await websocket.send_json({"status": settings.COMPUTING_PENDING, "msg": _msg})
-        elif _status == settings.COMPUTING_FAILED:
-            await websocket.send_json({"status": settings.COMPUTING_FAILED, "msg": _msg})
-        await asyncio.sleep(1)
-    await websocket.close(1000)
+    _stage = await websocket.app.state.task_publisher.get(analysis_id + '-stage')
+
+    # Tasks added to the stage later are followed by the subscription, msg only holds the new lines
+    async def _send():
+        async with task_log_hub.subscription(json.loads(_stage) if _stage else [], analysis_id,
+                                             members_key=analysis_id + '-stage') as subscription:
+            _msg = list()
+            while 1:
+                update = await subscription.get()
+                # Lines read under another status wait for the next message
+                _msg.extend(update.lines)
+                if update.status in (settings.COMPUTING_SUCCESS, settings.COMPUTING_PENDING, settings.COMPUTING_FAILED):
+                    await websocket.send_json({"status": update.status, "msg": _msg})
+                    _msg = list()
+                if update.status == settings.COMPUTING_SUCCESS:
+                    break
+
+    if not await run_until_disconnect(websocket, _send()):
+        await websocket.close(1000)
 
 
 @router.get('/results/{analysis_id}')
 async def get_analysis_result(
         analysis_id: str,
         current_user: UserModel = Depends(deps.get_current_user)):
-    client = get_s3_client()
     _d = DataFileSystem.objects(lab_id=analysis_id,deps=0)
-    _files = list(map(lambda x: convert_mongo_document_to_schema(x, DatasetV2Schema, user=True, revers_map=['user']), _d))
-    _structure = list()
+    _files = convert_mongo_documents_to_schema(_d, DatasetV2Schema, user=True, revers_map=['user'])
     try:
-        for _ in client.list_objects(analysis_id):
-            try:
-                _io = client.get_object(analysis_id, _.object_name + "labVenvData.pkl")
-            except S3Error:
-                pass
-            try:
-                _object = pickle.load(_io)
-            except Exception as e:
-                print(f"Serialization exception {e}: {analysis_id}/{_.object_name}")
-                _object = None
-            _virtual = frontend_map(_object, f"{analysis_id}_{_.object_name.replace('/', '')}")
+        # Only the stored previews are read, the data of a result by pages from /results/{analysis_id}/{task_id}/data
+        for _virtual in await async_result_previews(analysis_id):
             _virtual['is_memory'] = True
             _files.append(_virtual)
-
     except S3Error:
         pass
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"data": _files,
                                  "msg": "Successful!"})
+
+
+@router.get('/results/{analysis_id}/{task_id}/data')
+async def get_analysis_result_data(
+        analysis_id: str,
+        task_id: str,
+        page: int = 0,
+        current_user: UserModel = Depends(deps.get_current_user)):
+    try:
+        _result = await async_result_page(analysis_id, task_id + '/', page)
+    except S3Error:
+        _result = None
+    except IndexError as e:
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
+                            content={"msg": str(e)})
+    if _result is None:
+        return JSONResponse(status_code=status.HTTP_200_OK,
+                            content={"msg": "The data has been released！"})
+    _meta, _data = _result
+    return JSONResponse(status_code=status.HTTP_200_OK,
+                        content={"data": _data,
+                                 "page": page,
+                                 "pages": _meta["pages"],
+                                 "total": _meta["total"],
+                                 "msg": "Successful!"})
+
+
+@router.get("/events/{analysis_id}")
+async def analysis_events(request: Request, analysis_id: str,
+                          current_user: UserModel = Depends(deps.get_current_user)):
+    """
+    Server-Sent Events of an analysis: log and status, stage when tasks join the analysis,
+    task and resource for each of them, then end once the analysis is over.
+    Reconnecting with the Last-Event-ID header resumes the log after the last event received.
+    """
+    _stage = await request.app.state.task_publisher.get(analysis_id + '-stage')
+    subscription = task_log_hub.subscription(json.loads(_stage) if _stage else [], analysis_id,
+                                             members_key=analysis_id + '-stage',
+                                             positions=decode_event_id(request.headers.get("last-event-id")),
+                                             details=True)
+    return sse_response(progress_events(subscription, terminal=(settings.COMPUTING_SUCCESS,
+                                                                settings.COMPUTING_FAILED),
+                                        status_map={"Error": settings.COMPUTING_FAILED}))
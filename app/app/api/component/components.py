@@ -5,12 +5,11 @@
 @module:components
 @time:2022/08/23
 """
-import pickle
-import asyncio
 import requests
 from minio.deleteobjects import DeleteObject
 from fastapi.responses import JSONResponse
 from fastapi.websockets import WebSocket
+from fastapi.concurrency import run_in_threadpool
 from fastapi import (
     APIRouter,
     status,
@@ -24,9 +23,13 @@ import pandas
 from minio.error import S3Error
 from app.api import deps
 from app.core.gate import PublishTask
+from app.service.manager.tasklog import task_log_hub
+from app.utils.sse import sse_response, progress_events, decode_event_id
+from app.utils.websocket_util import run_until_disconnect
 from app.core.gate import runtime_exec, post_function, FunctionEvent
-from app.utils.common import convert_mongo_document_to_schema
+from app.utils.common import convert_mongo_documents_to_schema
 from app.utils.middleware_util import get_s3_client, s32dir_tree
+from app.utils.minio_util import ensure_bucket
 from app.service.manager.event import EventManager
 from app.models.mongo import (
     UserModel,
@@ -42,9 +45,10 @@ from app.storage.object_storage import object_storage_stream
 from app.storage.file_system import file_storage_stream
 from app.schemas.dataset import DatasetV2Schema
 from app.schemas.visualization import VisualizationDataInCrate, VisualizationComponentsResponse
-from app.core.serialize.ptype import frontend_map
+from app.core.serialize.result import result_response, async_result_preview, async_result_previews, async_result_page
 from app.service.manager.visualization import VisualizationManager
 from app.service.manager.task import ComputeTaskManager
+from app.service.manager.dag import DAGCacheManager
 from app.core.config import settings
 router = APIRouter()
 
@@ -63,7 +67,7 @@ def delete_component(component_id: str,
 
 
 @router.post('/component/{function_name}')
-def component_start(function_name: str = 'plasmabubble', data: dict = {}):
+async def component_start(request: Request, function_name: str = 'plasmabubble', data: dict = {}):
     try:
         if function_name == 'plasmabubble':
             data['data_dir'] = 'Test_plasma_bubble'
@@ -83,7 +87,7 @@ def component_start(function_name: str = 'plasmabubble', data: dict = {}):
                            "file_name": "/home/app/function/handler.py",
                            "function_name": "handle"}
 
-        task_id = post_function(function_name, data)
+        task_id = await post_function(function_name, data, request.app.state.task_publisher)
         return task_id
     except Exception as e:
         print(e)
@@ -123,19 +127,32 @@ def component_start(task_id: str,
 
 @router.websocket("/ws/{lab_task_id}")
 async def websocket(websocket: WebSocket, lab_task_id: str):
-    print(lab_task_id)
-    publisher = PublishTask(lab_task_id)
-    _index = 0
     await websocket.accept()
-    while 1:
-        _status = None
-        _data = None
-        _msg = [_ for _ in publisher.publisher(start_index=_index)]
-        _index += len(_msg)
-        _status = "Failed" if publisher.status == "Error" else publisher.status
-        await websocket.send_json({"status": _status, "data": _msg})
-        await asyncio.sleep(1)
-    await websocket.close(1000)
+
+    # The log written so far first, then only the new lines read by the worker's task log reader
+    async def _send():
+        async with task_log_hub.subscription([lab_task_id], f"{lab_task_id}-task") as subscription:
+            while 1:
+                update = await subscription.get()
+                _status = "Failed" if update.status == "Error" else update.status
+                await websocket.send_json({"status": _status, "data": update.lines})
+
+    if not await run_until_disconnect(websocket, _send()):
+        await websocket.close(1000)
+
+
+@router.get('/events/{lab_task_id}')
+async def task_events(request: Request, lab_task_id: str,
+                      current_user: UserModel = Depends(deps.get_current_user)):
+    """
+    Server-Sent Events of a task: log, status, task and resource, then end once the task is over.
+    Reconnecting with the Last-Event-ID header resumes the log after the last event received.
+    """
+    subscription = task_log_hub.subscription([lab_task_id], f"{lab_task_id}-task",
+                                             positions=decode_event_id(request.headers.get("last-event-id")),
+                                             details=True)
+    return sse_response(progress_events(subscription, terminal=("Success", "Failed"),
+                                        status_map={"Error": "Failed"}))
 
 
 @router.get('/visualization/{data_id}',
@@ -245,8 +262,7 @@ def vis(function_name: str = 'csvis',
                 data['bucket'] = source_data.user.id
                 data['object_name'] = source_data.data_path
                 client = get_s3_client()
-                if not client.bucket_exists(data['bucket']):
-                    client.make_bucket(data['bucket'])
+                ensure_bucket(data['bucket'], client)
                 try:
                     client.stat_object(data['bucket'], data['object_name'])
                 except S3Error:
@@ -297,48 +313,51 @@ def vis(function_name: str = 'csvis',
 async def structure_view(lab_id: str,
                          task_id: str = None,
                          current_user: UserModel = Depends(deps.get_current_user)):
-    client = get_s3_client()
     if task_id:
         try:
-            _io = client.get_object(lab_id, task_id + '/' + "labVenvData.pkl")
-            try:
-                _object = pickle.load(_io)
-            except Exception as e:
-                _object = ""
-            # Can beJsonTransfer format validation, coercionstr __str__
-            _structure = frontend_map(_object, f"{lab_id}_{task_id}")
+            # Typed preview and schema of the result, the data itself is read by pages from /structure/.../data
+            _meta = await async_result_preview(lab_id, task_id + '/')
         except S3Error:
+            _meta = None
+        if _meta is None:
             return JSONResponse(status_code=status.HTTP_200_OK,
                                 content={"msg": "The data has been released！"})
-
+        _structure = result_response(_meta, f"{lab_id}_{task_id}")
     else:
-        _structure = list()
         try:
-            for _ in client.list_objects(lab_id):
-                try:
-                    _io = client.get_object(lab_id, _.object_name + "labVenvData.pkl")
-                except S3Error:
-                    pass
-                try:
-                    _object = pickle.load(_io)
-                except Exception as e:
-                    # Can be
-                    print(f"Serialization exception {e}: {lab_id}/{_.object_name}")
-                    _object = None
-                _structure.append(
-                    frontend_map(_object, f"{lab_id}_{_.object_name.replace('/', '')}")
-                )
+            _structure = await async_result_previews(lab_id)
         except S3Error:
-            pass
-        return JSONResponse(status_code=status.HTTP_200_OK,
-                            content={"data": _structure,
-                                     "msg": "Successful!"}
-                            )
+            _structure = list()
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"data": _structure,
                                  "msg": "Successful!"}
                         )
 
+
+@router.get('/structure/{lab_id}/{task_id}/data')
+async def structure_data(lab_id: str,
+                         task_id: str,
+                         page: int = 0,
+                         current_user: UserModel = Depends(deps.get_current_user)):
+    try:
+        _result = await async_result_page(lab_id, task_id + '/', page)
+    except S3Error:
+        _result = None
+    except IndexError as e:
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
+                            content={"msg": str(e)})
+    if _result is None:
+        return JSONResponse(status_code=status.HTTP_200_OK,
+                            content={"msg": "The data has been released！"})
+    _meta, _data = _result
+    return JSONResponse(status_code=status.HTTP_200_OK,
+                        content={"data": _data,
+                                 "page": page,
+                                 "pages": _meta["pages"],
+                                 "total": _meta["total"],
+                                 "msg": "Successful!"}
+                        )
+
     # data = await request.app.state.objects_storage.hgetall(f"{lab_id}-{task_id}")
     # _structure_data = dict()
     # # The data entity is not shown yet - Can be
@@ -433,12 +452,7 @@ def components_dataset(lab_id: str,
     dataset_files = list()
     query_ = {k: v for k, v in query_.items() if v is not None}
     _dfs = DataFileSystem.objects(**query_, deps=deps)
-    dataset_files.extend(
-        map(
-            lambda x: convert_mongo_document_to_schema(x, DatasetV2Schema, user=True, revers_map=['user']),
-            _dfs
-        )
-    )
+    dataset_files.extend(convert_mongo_documents_to_schema(_dfs, DatasetV2Schema, user=True, revers_map=['user']))
     parent = None
     if dataset_files:
         parent = dataset_files[0]['parent']
@@ -500,8 +514,7 @@ async def download_lab_data(flag: str = None,
 
 @router.get('/function')
 def get_all_components_isinstance(current_user: UserModel = Depends(deps.get_current_user)):
-    component_list = list(map(lambda x: convert_mongo_document_to_schema(x, ComponentInstanceSchema),
-                              ComponentInstance.objects))
+    component_list = convert_mongo_documents_to_schema(ComponentInstance.objects, ComponentInstanceSchema)
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"msg": 'Success', "data": component_list})
 
@@ -524,6 +537,8 @@ async def component_start(
 
 @router.post('/callback/{task_id}')
 async def task_callback_signal(request: Request, task_id: str):
-    await ComputeTaskManager.success(task_id, request.app.state.task_publisher)
+    _model = await ComputeTaskManager.success(task_id, request.app.state.task_publisher)
+    # The status of the experiment task changed, its node of the experiment graph as well
+    await run_in_threadpool(DAGCacheManager.refresh_task, _model.task_id)
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"msg": "Successful!"})
@@ -20,12 +20,11 @@ from fastapi import (
     BackgroundTasks
 )
 from app.standalone.components.builder import StandaloneFunctionDeployer
-from app.utils.middleware_util import get_redis_con
 from fastapi.websockets import WebSocket
 from fastapi.responses import JSONResponse
 from app.api import deps
 from app.core.config import settings
-from app.core.gate import PublishTask
+from app.db.redis_util import redis_registry
 from app.models.mongo import UserModel
 from app.models.mongo.tool_source import XmlToolSourceModel
 from app.models.mongo.fair import FairMarketComponentsModel
@@ -40,7 +39,7 @@ from app.schemas.fair import FairMarketComponentSchema, \
     FairMarketComponentsTreeSchema,\
     MarketComponentsInstallTaskSchema
 
-from app.utils.common import convert_mongo_document_to_schema
+from app.utils.common import convert_mongo_document_to_schema, convert_mongo_documents_to_schema
 router = APIRouter()
 
 
@@ -156,10 +155,9 @@ async def deploy_function(component_id: str,
     # publisher.close()
     fd = FunctionDeployer(component_id, current_user.id)
     background_task.add_task(fd.create_temporary)
-    publisher = get_redis_con(1)
-    publisher.rpush(component_id, "start")
-    publisher.set(f"{component_id}-task", "start")
-    publisher.close()
+    publisher = redis_registry.connection(settings.FUNCTION_BUILD_DB)
+    await publisher.rpush(component_id, "start")
+    await publisher.set(f"{component_id}-task", "start")
     return JSONResponse(status_code=status.HTTP_200_OK, content={"msg": "Success", "id": component_id})
 
     # return JSONResponse(status_code=status.HTTP_200_OK, content={"msg": "Success", "id": component_id})
@@ -168,16 +166,14 @@ async def deploy_function(component_id: str,
 @router.websocket("/ws/{tool_id}")
 async def websocket(websocket: WebSocket,
                     tool_id: str):
-    publisher = PublishTask(tool_id, 1)
-    _index = 0
+    publisher = redis_registry.connection(settings.FUNCTION_BUILD_DB)
     await websocket.accept()
     while 1:
         try:
-            _status = None
-            _data = None
-            _msg = [_ for _ in publisher.publisher(start_index=_index)]
-            _index += len(_msg)
-            await websocket.send_json({"status": publisher.status, "data": [publisher.status]})
+            _status = await publisher.get(f"{tool_id}-task")
+            if _status is None:
+                raise KeyError(f"{tool_id}-task")
+            await websocket.send_json({"status": _status, "data": [_status]})
             await asyncio.sleep(1)
         except Exception as e:
             await websocket.send_json({"status": "FAILED", "data": [f"Build exception"]})
@@ -302,8 +298,7 @@ async def fair_market_components_list(
             order_by = f"-{order_by}"
         _d = FairMarketComponentsModel.objects(**_query).order_by(order_by)
         _data = list()
-        for i in map(lambda x: convert_mongo_document_to_schema(x, FairMarketComponentSchema),
-                         _d):
+        for i in convert_mongo_documents_to_schema(_d, FairMarketComponentSchema):
             # print(i['parameters'])
             try:
                 i['parameters'] = {_p['key']: _p['value'] for _p in  i['parameters']}
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Tuple
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt
 from mongoengine import Document
@@ -13,6 +13,7 @@ from app.core.config import settings
 from app.core.jwt import ALGORITHM
 from app.models.mongo import UserModel
 from app.schemas import TokenPayLoadSchema, RegisterEmailVerifyTokenPayLoadSchema, PasswordResetTokenPayLoadSchema
+from app.service.manager.principal import principal_cache
 
 reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f'{settings.API_STR}/login'
@@ -31,13 +32,17 @@ def verify_logged_in(token: str = Depends(reusable_oauth2)) -> bool:
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials"
         )
-    user = crud_user.get_user_by_email(email=token_data.email)
+    user = principal_cache.get(token_data.email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return True
 
 
-def get_current_user(token: str = Depends(reusable_oauth2)) -> Document:
+def get_current_user(request: Request, token: str = Depends(reusable_oauth2)) -> Document:
+    # Already resolved from the same token by BearerTokenAuthBackend
+    user = getattr(request.state, "user", None)
+    if user is not None:
+        return user
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[ALGORITHM]
@@ -52,7 +57,7 @@ def get_current_user(token: str = Depends(reusable_oauth2)) -> Document:
             detail="Could not validate credentials"
         )
     # user = crud_user.get_user_by_email(email=token_data.email)
-    user = UserModel.objects(email=token_data.email).first()
+    user = principal_cache.get(token_data.email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -92,6 +97,7 @@ def verify_register_email_token_validity(token: str) -> Tuple[int, str]:
         user.is_email_verified = True
         user.updated_at = datetime.utcnow()
         user.save()
+        principal_cache.invalidate(user_id=user.id)
         #
         code = status.HTTP_200_OK
         msg = f'email is valid: {token_data.email}'
@@ -127,6 +133,7 @@ def reset_password_with_verify_token_validity(token: str, password: str) -> Tupl
         user.hashed_password = get_password_hash(password)
         user.updated_at = datetime.utcnow()
         user.save()
+        principal_cache.invalidate(user_id=user.id)
         #
         code = status.HTTP_200_OK
         msg = f'successful password reset for: {token_data.email}'
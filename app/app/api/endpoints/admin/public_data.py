@@ -12,6 +12,7 @@ from fastapi import (
     status,
     Request, BackgroundTasks, WebSocket
 )
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from pathlib import Path
 from app.api import deps
@@ -19,12 +20,16 @@ from app.core.config import settings
 from app.utils.common import generate_uuid
 from app.fair_stack.instdb import InstDBFair
 from app.utils.middleware_util import get_s3_client
+from app.utils.minio_util import async_ensure_bucket, run_in_minio_pool
 from app.utils.common import convert_mongo_document_to_schema
 from app.models.mongo import UserModel, StorageResourceAllocatedModel
 from app.schemas.public_data import PublicDatasetSchema, PublicDataFileSchema
 from app.utils.file_util import generate_datasets_model, stream_to_b64_stream, file_upload_task
 from app.models.mongo.public_data import PublicDatasetModel, PublicDataFileModel, DatasetsAuthorModel,PublicDatasetOptionModel
+from app.models.mongo.public_data import PublicDatasetStatsModel
 from app.service.manager.storage import StorageManager
+from app.service.manager.datasets import PublicDatasetStats
+from app.utils.upload_util import merge_chunks, save_chunk, uploaded_chunks
 router = APIRouter()
 
 
@@ -51,9 +56,9 @@ async def create_public_data(name: str,
                                 content={"msg": "Expose duplicate data source names！"})
     dataset_id = generate_uuid()
     client = get_s3_client()
-    if not client.bucket_exists(dataset_id):
-        client.make_bucket(dataset_id)
-    result = client.put_object(
+    await async_ensure_bucket(dataset_id)
+    result = await run_in_minio_pool(
+        client.put_object,
         bucket_name=dataset_id,
         object_name=f'/icon/{icon.filename}',
         data=icon.file,
@@ -79,34 +84,22 @@ async def get_public_data(name: str = None,
                           page: int = 0,
                           limit: int = 10,
                           current_user: UserModel = Depends(deps.get_current_user)):
-    client = get_s3_client()
     if name:
         _dfs = PublicDatasetModel.objects(name__contains=name)
     else:
-        _dfs = PublicDatasetModel.objects
+        _dfs = PublicDatasetModel.objects()
+    # Counted and paginated by Mongo, icons are fetched by the client from the cacheable icon endpoint
+    rows, total = await run_in_threadpool(PublicDatasetStats.page, _dfs, page * limit, limit)
     data = list()
-    for _ in _dfs.order_by("-updated_at"):
+    for _, _stats in rows:
         _d = convert_mongo_document_to_schema(_, PublicDatasetSchema)
-        _d['icon'] = stream_to_b64_stream(client.get_object(_.id, _.icon).read())
-        _files = PublicDataFileModel.objects(datasets=_)
-        _files_count = 0
-        _files_size = 0
-        for _f in _files:
-            if _f.file_extension == "datasets":
-                _datasets_files = PublicDataFileModel.objects(datasets=_f)
-                _files_size += _datasets_files.sum('data_size')
-                _files_count += _datasets_files.count()
-            else:
-                _files_count += 1
-                _files_size += _f.data_size
-        _d['files'] = _files_count
-        print([_f.data_size for _f in _files])
-        _d['data_size'] = _files_size
+        _d['icon'] = f"{settings.API_STR}/data_center/public/{_.id}/icon"
+        _d['files'] = _stats['files']
+        _d['data_size'] = _stats['data_size']
         data.append(_d)
-    skip = page * limit
     return JSONResponse(status_code=status.HTTP_200_OK,
-                        content={"data": data[skip: skip+limit],
-                                 "total": len(data),
+                        content={"data": data,
+                                 "total": total,
                                  "msg": "Successful!"})
 
 
@@ -119,6 +112,7 @@ async def delete_public_data(
         return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
                             content={"msg": "Dataset not found!"})
     _d.delete()
+    PublicDatasetStatsModel.objects(id=dataset_id).delete()
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"msg": "Successful!"})
 
@@ -144,9 +138,9 @@ async def update_public_data_metadata(dataset_id: str,
     object_name = None
     if icon:
         client = get_s3_client()
-        if not client.bucket_exists(dataset_id):
-            client.make_bucket(dataset_id)
-        result = client.put_object(
+        await async_ensure_bucket(dataset_id)
+        result = await run_in_minio_pool(
+            client.put_object,
             bucket_name=dataset_id,
             object_name=f'/icon/{icon.filename}',
             data=icon.file,
@@ -282,22 +276,26 @@ async def upload_big_file(
     if len(chunk_number) == 0 or len(identifier) == 0:
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
                             content={"msg": "Missing identifier"})
-    filename = f'{relative_path}{identifier}{chunk_number}'  # ShardingUnique identification
-    contents = await file.read()  # Read a file asynchronously
     storage_path = Path(settings.BASE_DIR, settings.DATA_PATH)
-    _path = Path(filename)
-    if _path.parent != "." and _path.parent != "/":
-        mks_name = f"{storage_path}/uploads_datasets_cache/{datasets_id}/{_path.parent}"
-        try:
-            os.makedirs(mks_name)
-        except FileExistsError:
-            pass
-    with open(f"{storage_path}/uploads_datasets_cache/{datasets_id}/{filename}", "wb") as f:
-        f.write(contents)
+    await run_in_threadpool(save_chunk, file, f"{storage_path}/uploads_datasets_cache/{datasets_id}", relative_path,
+                            identifier, chunk_number, total_chunks=total_chunks, total_size=total_size)
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"msg": f"Received{relative_path}Sharding{chunk_number}"})
 
 
+@router.get("/datasets/upload_chunks", summary="Chunks already received for a resumable upload")
+async def get_uploaded_chunks(
+        datasets_id: str,
+        identifier: str,
+        relative_path: str,
+        current_user: UserModel = Depends(deps.get_current_user)):
+    storage_path = Path(settings.BASE_DIR, settings.DATA_PATH)
+    data = await run_in_threadpool(uploaded_chunks, f"{storage_path}/uploads_datasets_cache/{datasets_id}",
+                                   relative_path, identifier)
+    return JSONResponse(status_code=status.HTTP_200_OK,
+                        content={"data": data, "msg": "Successful!"})
+
+
 @router.post("/datasets/merge_file")
 async def merge_file(
         request: Request,
@@ -311,26 +309,7 @@ async def merge_file(
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
                             content={"msg": "Missing identifier"})
     storage_path = Path(settings.BASE_DIR, settings.DATA_PATH)
-    _mode_base = f"{file_name}{identifier}*"
-    _mode_path = f"{storage_path}/uploads_datasets_cache/{datasets_id}"
-    if len(file_name.split('/')) > 1:
-        _mode_base = f"{file_name.rsplit('/', maxsplit=1)[-1]}{identifier}*"
-        _mode_path = f"{storage_path}/uploads_datasets_cache/{datasets_id}/{file_name.rsplit('/', maxsplit=1)[0]}"
-        print("intercept", _mode_path)
-    _path = Path(_mode_path)
-    merge_task = dict()
-    for i in _path.rglob(_mode_base):
-        _relative_path, _suffix = i.__fspath__().rsplit(identifier, maxsplit=1)
-        if merge_task.get(_relative_path) is None:
-            merge_task[_relative_path] = list()
-        merge_task[_relative_path].append(i.__fspath__())
-    for k, v in merge_task.items():
-        v.sort()
-        with open(k, 'wb') as f:
-            for _file_name in v:
-                with open(_file_name, 'rb') as reader:
-                    f.write(reader.read())
-                os.remove(_file_name)
+    await run_in_threadpool(merge_chunks, f"{storage_path}/uploads_datasets_cache/{datasets_id}", file_name, identifier)
     absolute_path = f"{storage_path}/uploads_datasets_cache/{datasets_id}/{file_name}"
     client = get_s3_client()
     StorageManager.save_datasets_file(absolute_path, file_name, datasets_id, current_user, client)
@@ -431,8 +410,7 @@ async def instdb_link(
         if _datasets:
             for _, _file in _datasets:
                 dataset_id = _['id']
-                if not client.bucket_exists(dataset_id):
-                    client.make_bucket(dataset_id)
+                await async_ensure_bucket(dataset_id)
                 result = client.put_object(
                     bucket_name=dataset_id,
                     object_name=f'/icon/{_["icon"].split("/")[-1]}',
@@ -468,6 +446,7 @@ async def instdb_link(
                                 file_extension=_f['name'].rsplit('.', maxsplit=1)[-1],
                                 deps=len(_f['data_path'].split('/')) - 2
                             ).save()
+                PublicDatasetStats.refresh([dataset_id])
                 _.pop('author')
                 lis.append(_)
         return JSONResponse(status_code=status.HTTP_200_OK,
@@ -499,6 +478,7 @@ async def delete_source_datasets(dataset_id: str,
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
                             content={"msg": "The dataset does not exist！"})
     _dfs.delete()
+    PublicDatasetStats.removed(_dfs)
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"msg": "Successful！"})
 
@@ -511,5 +491,6 @@ async def delete_source_datasets_file(datasets_id: str, file_id: str,
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
                             content={"msg": "Data file does not exist！"})
     _dfs.delete()
+    PublicDatasetStats.removed(_dfs)
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"msg": "Successful！"})
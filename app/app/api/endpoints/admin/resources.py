@@ -19,6 +19,7 @@ from fastapi.responses import JSONResponse
 from typing import Optional
 from app.api import deps
 from app.core.config import settings
+from app.service.manager.quota import quota_rules
 from app.models.mongo import (
     ComputingResourceAllocatedModel,
     StorageResourceAllocatedModel,
@@ -263,6 +264,7 @@ async def update_computing_quota(cpu_quota: Optional[float] = None,
     if _update:
         _update['update_at'] = datetime.datetime.utcnow()
         ComputingQuotaRuleModel.objects.first().update(**_update)
+        quota_rules.invalidate()
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={
                             "msg": "Successful!"}
@@ -292,6 +294,7 @@ async def update_storage_quota(quota: Optional[int] = None,
     if _update:
         _update['update_at'] = datetime.datetime.utcnow()
         StorageQuotaRuleModel.objects.first().update(**_update)
+        quota_rules.invalidate()
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={
                                  "msg": "Successful!"}
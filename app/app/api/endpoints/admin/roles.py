@@ -11,6 +11,8 @@ from fastapi.responses import JSONResponse
 
 from app.api import deps
 from app.models.mongo import RoleModel, UserModel
+from app.service.manager.permission import permission_index
+from app.service.manager.principal import principal_cache
 from app.schemas import (
     RoleBaseSchema,
     RoleCreateSchema,
@@ -143,6 +145,8 @@ def update_role(
             # Must reload to get updated attribute
         role.save()
         role.reload()
+        principal_cache.invalidate_role(role_id)
+        permission_index.invalidate(role_id)
     except Exception as e:
         print(e)
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -177,6 +181,9 @@ def delete_role(
 
     try:
         role.delete()
+        # The role of its users was nullified
+        principal_cache.invalidate_role(role_id)
+        permission_index.invalidate(role_id)
     except Exception as e:
         print(e)
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
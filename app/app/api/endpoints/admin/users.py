@@ -9,6 +9,7 @@ from mongoengine import Q
 from app.api import deps
 from app.forms import UserCreateForm, AdminUserUpdateForm
 from app.models.mongo import RoleModel, UserModel
+from app.service.manager.principal import principal_cache
 from app.usecases import users_usecase
 from app.utils.common import convert_mongo_document_to_data
 from app.utils.constants import ROLES_INNATE_MAP
@@ -157,6 +158,7 @@ async def update_user(
     user.updated_at = datetime.utcnow()
     user.save()
     user.reload()
+    principal_cache.invalidate(user_id=user.id)
 
     data = convert_mongo_document_to_data(user)
     # if data.get("avatar") is not None:
@@ -193,6 +195,7 @@ def delete_user(
     try:
         # Illogical deletion
         user.delete()
+        principal_cache.invalidate(user_id=user_id)
     except Exception as e:
         print(e)
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1,6 +1,5 @@
 from datetime import timedelta
 
-import aioredis
 from fastapi import APIRouter, BackgroundTasks, Depends, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse, RedirectResponse
@@ -8,6 +7,7 @@ from fastapi.security import OAuth2PasswordRequestForm
 
 from app.api import deps
 from app.core.config import settings
+from app.db.redis_util import redis_registry
 from app.core.jwt import create_access_token
 from app.crud import crud_user
 from app.forms import PasswordForgetForm, PasswordResetForm
@@ -59,11 +59,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
         # Try limits： Continuous misinput 5 time，You are allowed to try again after an hour
         try:
-            redis_conn = await aioredis.StrictRedis(host=settings.REDIS_HOST,
-                                                    port=settings.REDIS_PORT,
-                                                    db=settings.AUTH_CACHE_DB,
-                                                    encoding="utf-8",
-                                                    decode_responses=True)  # Set to True，Is guaranteed to return dict is str，is bytes
+            redis_conn = redis_registry.connection(settings.AUTH_CACHE_DB)
 
             if redis_conn:
                 # Return the value at key ``name``, or None if the key doesn't exist
@@ -93,9 +89,6 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
                 # cache existence： Creating a cache
                 else:
                     await redis_conn.set(name=cache_key, value=1)   # Initial value 1
-
-                # Close the link
-                await redis_conn.close()
             else:
                 #
                 print(f'login_for_access_token: no cache connection')
@@ -108,18 +101,12 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     else:
         # Role update: Role to flush the cache
         try:
-            redis_conn = await aioredis.StrictRedis(host=settings.REDIS_HOST,
-                                                    port=settings.REDIS_PORT,
-                                                    db=settings.AUTH_CACHE_DB,
-                                                    encoding="utf-8",
-                                                    decode_responses=True)  # Set to True，Is guaranteed to return dict is str，is bytes
+            redis_conn = redis_registry.connection(settings.AUTH_CACHE_DB)
             if redis_conn:
                 cache_key = f'{CACHE_PREFIX_BearerTokenAuthBackend}_{email}'
                 await redis_conn.hset(name=cache_key,
                                       key="role",
                                       value=user.role)
-                # Close the link
-                await redis_conn.close()
             else:
                 print(f"login_for_access_token: no cache connection")
         except Exception as e:
@@ -170,11 +157,7 @@ async def forget_password(background_tasks: BackgroundTasks,
 
     # Check the email delivery interval：30s Duplicate email is prohibited
     try:
-        redis_conn = await aioredis.StrictRedis(host=settings.REDIS_HOST,
-                                                port=settings.REDIS_PORT,
-                                                db=settings.AUTH_CACHE_DB,
-                                                encoding="utf-8",
-                                                decode_responses=True)  # Set to True，Is guaranteed to return dict is str，is bytes
+        redis_conn = redis_registry.connection(settings.AUTH_CACHE_DB)
 
         # Return the value at key ``name``, or None if the key doesn't exist
         cache_key = f'{CACHE_PREFIX_PASSWORD_FORGET}_{email}'
@@ -196,7 +179,6 @@ async def forget_password(background_tasks: BackgroundTasks,
     try:
         expire = settings.RESET_PASSWORD_EMAIL_SENT_FREQUENCY_SECONDS  # seconds
         await redis_conn.set(name=cache_key, value=email, ex=expire)
-        await redis_conn.close()
     except Exception as e:
         print(f'e: {e}')
 
@@ -214,11 +196,7 @@ async def reset_password(password_reset_form: PasswordResetForm = Depends()):
 
     token = password_reset_form.token
     try:
-        redis_conn = await aioredis.StrictRedis(host=settings.REDIS_HOST,
-                                                port=settings.REDIS_PORT,
-                                                db=settings.AUTH_CACHE_DB,
-                                                encoding="utf-8",
-                                                decode_responses=True)  # Set to True，Is guaranteed to return dict is str，is bytes
+        redis_conn = redis_registry.connection(settings.AUTH_CACHE_DB)
 
         # Return the value at key ``name``, or None if the key doesn't exist
         cache_key = f"{CACHE_PREFIX_PASSWORD_RESET}_{token}"
@@ -251,7 +229,6 @@ async def reset_password(password_reset_form: PasswordResetForm = Depends()):
     try:
         expire = settings.RESET_PASSWORD_TOKEN_EXPIRE_MINUTES * 60  # seconds
         await redis_conn.set(name=cache_key, value=token, ex=expire)
-        await redis_conn.close()
     except Exception as e:
         print(f'e: {e}')
 
@@ -26,6 +26,8 @@ from app.models.mongo import (
 from app.schemas import (
     DatasetUpdateSchema,
 )
+from app.storage.compress_file import compress_files2zip
+from app.storage.file_system import dir_file_streams
 from app.usecases import datasets_usecase
 from app.utils.common import generate_uuid, convert_mongo_document_to_data
 from app.utils.file_util import chunked_copy, generate_dir, del_datasets
@@ -404,10 +406,6 @@ def download_dataset(
     :return:
     """
 
-    storage_temp_path = Path(settings.BASE_DIR, settings.DATA_TEMP_PATH, current_user.id)
-    if not (storage_temp_path.exists() and storage_temp_path.is_dir()):
-        storage_temp_path.mkdir(parents=True)
-
     dataFileSystem = DataFileSystem.objects(id=dataset_id).first()
     if dataFileSystem is None:
         return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
@@ -430,22 +428,8 @@ def download_dataset(
         return FileResponse(path=data_path, filename=filename, media_type="application/octet-stream")
 
     else:
-        # Iffile: compression （Pathfor）  -> Download
-
-        # TODO: Cleaning up temporary directories （storage_data_temp）the data？
-
-        archive_name = dataFileSystem.name
-        archive_format = "zip"
-        archive_fullname = f"{archive_name}.{archive_format}"
-        archive_path = storage_temp_path.joinpath(archive_fullname)
-
-        # compression
-        shutil.make_archive(base_name=str(storage_temp_path.joinpath(archive_name)),
-                            format=archive_format,
-                            root_dir=data_path)
-
-        # send
-        return FileResponse(path=archive_path, filename=archive_fullname, media_type="application/octet-stream")
+        # Iffile: compression while sending, nothing is written to storage_data_temp
+        return compress_files2zip(dataFileSystem.name, dir_file_streams(str(data_path)))
 
 
 @router.get("/",
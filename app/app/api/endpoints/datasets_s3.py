@@ -22,6 +22,7 @@ from app.usecases import datasets_usecase
 from app.utils.common import generate_uuid, convert_mongo_document_to_schema
 from app.utils.file_util import chunked_copy, generate_dir
 from app.utils.middleware_util import get_s3_client
+from app.utils.minio_util import async_ensure_bucket, async_list_objects
 from app.utils.resource_util import check_storage_resource, cache_cumulative_sum
 
 router = APIRouter()
@@ -49,8 +50,7 @@ async def upload_dataset_file(
 
     # Usersthe bucket Does it exist
     bucket_name = current_user.id
-    if not client.bucket_exists(bucket_name):
-        client.make_bucket(bucket_name)
+    await async_ensure_bucket(bucket_name)
 
     print(f'uploading <{len(files)}> files: {[file.filename for file in files]}')
     for file in files:
@@ -62,10 +62,7 @@ async def upload_dataset_file(
         # Allows uploading files of the same name： It overwrites old data
         #   - After the file with the same name is uploaded successfully，You need the corresponding DataFileSystem.deleted = True  (same user Within the name Unique)
         has_duplicate = False
-        objects = list(client.list_objects(
-            bucket_name=bucket_name,
-            recursive=False
-        ))  # Traversal only bucketWithin the，Therefore, recursive=False
+        objects = await async_list_objects(bucket_name, recursive=False)  # Traversal only bucketWithin the，Therefore, recursive=False
         for obj in objects:
             # Simultaneous limitation： Name + Types  (Because bucket)
             if (obj.object_name == filename) and (obj.is_dir is False):
@@ -183,8 +180,7 @@ async def upload_dataset_folder(
     client = get_s3_client()
 
     bucket_name = current_user.id
-    if not client.bucket_exists(bucket_name):
-        client.make_bucket(bucket_name)
+    await async_ensure_bucket(bucket_name)
 
     # UserstheDoes it exist
     storage_path = Path(settings.BASE_DIR, settings.DATA_PATH, current_user.id)
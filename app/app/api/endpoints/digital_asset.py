@@ -5,7 +5,6 @@
 @module:digital_asset
 @time:2023/06/07
 """
-import os
 from pathlib import Path
 from typing import Optional
 from app.crud import crud_da
@@ -24,6 +23,7 @@ from app.models.mongo import (
     ExperimentModel,
     StorageResourceAllocatedModel
 )
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
 from app.service.response import DataLabResponse
 from app.service.manager.lake import DataLakeManager
@@ -33,6 +33,7 @@ from app.models.mongo.digital import MultilingualGenericsModel
 from app.models.mongo.digital import FileDigital
 from app.schemas.digital_asset import ExperimentsDigitalAssetsSchema
 from app.core.config import settings
+from app.utils.upload_util import merge_chunks, save_chunk, uploaded_chunks
 router = APIRouter()
 
 
@@ -210,6 +211,7 @@ async def upload_file_digital(file: UploadFile = File(...),
                               identifier: str = Form(...),  # logo
                               total_size: int = Form(...),  # Current total file size
                               relative_path: str = Form(...),  # Absolute path
+                              total_chunks: Optional[int] = Form(None),  # Total number of slices in the current file
                               current_user: UserModel = Depends(deps.get_current_user)
                               ):
     _allocated_storage_size = StorageResourceAllocatedModel.objects(allocated_user=current_user.id).\
@@ -219,21 +221,22 @@ async def upload_file_digital(file: UploadFile = File(...),
         return DataLabResponse.failed("Insufficient storage space")
     if len(chunk_number) == 0 or len(identifier) == 0:
         return DataLabResponse.failed("logo")
-    filename = f'{relative_path}{identifier}{chunk_number}'  # Shardinglogo
-    contents = await file.read()  # Read a file asynchronously
     storage_path = Path(settings.BASE_DIR, settings.DATA_PATH, current_user.id)
-    _path = Path(filename)
-    if _path.parent != "." and _path.parent != "/":
-        mks_name = f"{storage_path}/uploads/{_path.parent}"
-        try:
-            os.makedirs(mks_name)
-        except FileExistsError:
-            pass
-    with open(f"{storage_path}/uploads/{filename}", "wb") as f:
-        f.write(contents)
+    # Shardinglogo: <relative_path><identifier><chunk_number>
+    await run_in_threadpool(save_chunk, file, f"{storage_path}/uploads", relative_path, identifier, chunk_number,
+                            total_chunks=total_chunks, total_size=total_size)
     return DataLabResponse.successful(msg=f"Received{relative_path}Sharding{chunk_number}")
 
 
+@router.get("/users/upload/chunks")
+async def get_uploaded_chunks(identifier: str,
+                              relative_path: str,
+                              current_user: UserModel = Depends(deps.get_current_user)):
+    storage_path = Path(settings.BASE_DIR, settings.DATA_PATH, current_user.id)
+    data = await run_in_threadpool(uploaded_chunks, f"{storage_path}/uploads", relative_path, identifier)
+    return DataLabResponse.successful(data=data)
+
+
 @router.post("/users/upload/merge")
 async def merge_file(identifier: str = Form(...),
                      file_name: str = Form(...),
@@ -241,25 +244,7 @@ async def merge_file(identifier: str = Form(...),
     if len(file_name) == 0 or len(identifier) == 0:
         return DataLabResponse.failed("logo")
     storage_path = Path(settings.BASE_DIR, settings.DATA_PATH, current_user.id)
-    _mode_base = f"{file_name}{identifier}*"
-    _mode_path = f"{storage_path}/uploads"
-    if len(file_name.split('/')) > 1:
-        _mode_base = f"{file_name.rsplit('/', maxsplit=1)[-1]}{identifier}*"
-        _mode_path = f"{storage_path}/uploads/{file_name.rsplit('/', maxsplit=1)[0]}"
-    _path = Path(_mode_path)
-    merge_task = dict()
-    for i in _path.rglob(_mode_base):
-        _relative_path, _suffix = i.__fspath__().rsplit(identifier, maxsplit=1)
-        if merge_task.get(_relative_path) is None:
-            merge_task[_relative_path] = list()
-        merge_task[_relative_path].append(i.__fspath__())
-    for k, v in merge_task.items():
-        v.sort()
-        with open(k, 'wb') as f:
-            for _file_name in v:
-                with open(_file_name, 'rb') as reader:
-                    f.write(reader.read())
-                os.remove(_file_name)
+    await run_in_threadpool(merge_chunks, f"{storage_path}/uploads", file_name, identifier)
     #  Push to lake file system
     #  absolute_path = f"{storage_path}/uploads/{file_name}"
     # _model = StorageManager.save_file(absolute_path, file_name, current_user)
@@ -23,6 +23,7 @@ from app.schemas import (
     ToolTaskUpdateSchema,
 )
 from app.usecases import experiments_usecase
+from app.service.manager.dag import DAGCacheManager
 from app.utils.common import generate_uuid, convert_mongo_document_to_data
 from app.utils.constants import INVALID_UPDATE_VALUE_TYPES
 
@@ -74,6 +75,7 @@ def create_task(
                             content={
                                 "msg": f"failed to add tool task [{toolTaskSchema.id}] to experiment [{experiment_id}]"})
     else:
+        DAGCacheManager.refresh_task(toolTaskSchema.id)
         # packing
         toolTaskCreatedSchema = ToolTaskCreatedSchema(
             experiment_id=experiment_id,
@@ -208,6 +210,7 @@ def update_task(
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             content={"msg": f"failed to update tool task: [{task_id}]"})
     else:
+        DAGCacheManager.refresh_task(task_id)
         # task Information
         task_data = convert_mongo_document_to_data(tool_task)
         # task Corresponding to tool Information
@@ -283,5 +286,6 @@ def delete_task(
             return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                                 content={"msg": f"failed to delete task: [{task_id}]"})
         else:
+            DAGCacheManager.refresh_task(task_id, experiments_id=experiment.id)
             return JSONResponse(status_code=status.HTTP_200_OK,
                                 content={"msg": "success"})
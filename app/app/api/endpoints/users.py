@@ -8,6 +8,7 @@ from app.api import deps
 from app.core.security import get_password_hash
 from app.forms import UserCreateForm, UserUpdateForm
 from app.models.mongo import UserModel
+from app.service.manager.principal import principal_cache
 from app.usecases import users_usecase
 from app.utils.common import convert_mongo_document_to_data
 from app.utils.constants import INVALID_UPDATE_VALUE_TYPES
@@ -144,6 +145,7 @@ async def update_user(
     user.updated_at = datetime.utcnow()
     user.save()
     user.reload()
+    principal_cache.invalidate(user_id=user.id)
 
     # userInDBSchema = UserInDBSchema(**convert_mongo_document_to_data(user))
     # data = userInDBSchema.dict()
@@ -99,22 +99,60 @@ class Settings(BaseSettings):
     BUILD_DIR: str
     TEMPLATE_DIR: str
     STANDALONE_FUNCTION_DOMAIN: str
+    FAAS_HTTP_MAX_CONNECTIONS: int = 100
+    FAAS_HTTP_TIMEOUT: float = 30
+    FAAS_HTTP_CONNECT_TIMEOUT: float = 5
+    FAAS_HTTP_RETRIES: int = 3
+    FAAS_HTTP_BACKOFF: float = 0.5
     # Minio
     MINIO_URL: str
     MINIO__ACCESS_KEY: str
     MINIO_SECRET_KEY: str
     MINIO_SECURE: bool
+    # One MinIO client per process: pooled connections, threads running its blocking calls for the event loop,
+    # seconds an existing bucket is not checked again
+    MINIO_CONNECTION_POOL_SIZE: int = 32
+    MINIO_TIMEOUT: int = 300
+    MINIO_THREAD_POOL_SIZE: int = 16
+    MINIO_BUCKET_CACHE_TTL: int = 600
+
+    # Task results: items or rows in a listing preview and in a page of data, characters of a text preview
+    RESULT_PREVIEW_ROWS: int = 20
+    RESULT_PAGE_ROWS: int = 1000
+    RESULT_PREVIEW_CHARS: int = 2000
 
     # Redis
     REDIS_HOST: str
     REDIS_PORT: int
     VER_DATA_DB: int = 2
     TASK_PUBLISHER_DB: int = 5
+    # Build logs and statuses of the deployed functions
+    FUNCTION_BUILD_DB: int = 1
     PLANT_CONFIG_DB: int = 6
     FILE_CACHE_DB: int = 9
     USED_STORAGE_CUMULATIVE_DB: int = 11
     SKELETON_DATA_CACHE_DB: int = 12
     AUTH_CACHE_DB: int = 13
+    DAG_CACHE_DB: int = 14
+    # Users resolved from a token are kept in the worker for this many seconds
+    PRINCIPAL_CACHE_TTL: int = 30
+    PRINCIPAL_CACHE_SIZE: int = 4096
+    # Seconds before the permission index of a role checks the role version again
+    PERMISSION_INDEX_TTL: int = 60
+    FILE_UPLOAD_PROGRESS_DB: int = 7
+    # Seconds between two recounts of the user storage counters from DataFileSystem
+    STORAGE_USAGE_RECONCILE_INTERVAL: int = 300
+    # Seconds a worker bills with the quota conversion rules it read, the admin updates drop them at once
+    QUOTA_RULE_CACHE_TTL: int = 60
+    # Task log streams: approximate length cap, longest wait of the shared reader for new lines,
+    # entries read per stream and round, rounds a slow socket may lag behind
+    TASK_LOG_MAXLEN: int = 100000
+    TASK_LOG_BLOCK_MS: int = 1000
+    TASK_LOG_BATCH: int = 1000
+    TASK_LOG_SUBSCRIBER_QUEUE: int = 32
+    # Server-Sent Events: seconds without an event before a heartbeat frame, reconnection delay of the clients
+    SSE_HEARTBEAT_INTERVAL: int = 15
+    SSE_RETRY_MS: int = 3000
 
     # components audit field allow
     AUDIT_ALLOW: set = {"Approved by review", "Pending review", "Failed to pass the audit"}
@@ -124,6 +162,11 @@ class Settings(BaseSettings):
     COMPUTING_PENDING: str = "Pending"
     COMPUTING_FAILED: str = "Failed"
     COMPUTING_SUCCESS: str = "Success"
+    # Maximum number of tasks of one analysis / one user computing at the same time
+    FLOW_ANALYSIS_CONCURRENCY: int = 4
+    FLOW_USER_CONCURRENCY: int = 8
+    # Seconds between two status reads when a task completion event is lost
+    FLOW_POLLING_FALLBACK: int = 30
     KUBERNETES_CONFIG = os.path.join(pathlib.Path(__file__).parent.parent.__fspath__(), 'utils/k8s_util/config')
     HARBOR_URL: str
     HARBOR_PROJECTS: str
@@ -147,6 +190,21 @@ class Settings(BaseSettings):
     LAKE_ADMIN_USERNAME: str
     LAKE_ADMIN_TOKEN: str
     STANDALONE_MODEL: bool
+    # host:port of the lakeFS S3 gateway, uploads are streamed through it when set
+    LAKE_S3_GATEWAY: Optional[str] = None
+    # Files pushed to MinIO and lakeFS at the same time, parts of one file uploaded in parallel
+    UPLOAD_WORKERS: int = 4
+    UPLOAD_PART_SIZE: int = 16 * 1024 * 1024
+    UPLOAD_PARALLEL_PARTS: int = 4
+    UPLOAD_PROGRESS_INTERVAL: float = 1
+    # lakeFS: one pooled client, uploads committed together per repository and branch
+    LAKE_CONNECTION_POOL_SIZE: int = 16
+    LAKE_REPOSITORY_CACHE_TTL: int = 600
+    LAKE_COMMIT_BATCH_FILES: int = 500
+    LAKE_COMMIT_BATCH_BYTES: int = 1024 * 1024 * 1024
+    # Seconds without a new upload, and at most since the first staged one, before the batch is committed
+    LAKE_COMMIT_IDLE: float = 10
+    LAKE_COMMIT_MAX_DELAY: float = 60
 
     class ComputeEvent(Enum):
         task = "TASK"
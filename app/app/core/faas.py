@@ -12,7 +12,7 @@ from fastapi import status
 from fastapi.responses import JSONResponse
 from app.utils.middleware_util import get_s3_client
 from app.core.config import settings
-from app.utils.middleware_util import get_redis_con
+from app.db.redis_util import redis_registry
 from app.utils.middleware_util import get_s3_client
 from app.schemas.event_parameters import S3Data, PythonLaunchParameters, FaaSEventRequestBody
 from app.models.mongo import ToolTaskModel, XmlToolSourceModel, ComponentInstance, DataFileSystem
@@ -45,7 +45,7 @@ class FaaSEventGenerator:
         self.parameters.pop('lab_id')
         self.parameters.pop('task_id')
         self.load_type = {'file', 'dir'}
-        self.con = get_redis_con(5)
+        self.con = redis_registry.sync(settings.TASK_PUBLISHER_DB)
         self.oss_client = get_s3_client()
         self._memory_output = None
 
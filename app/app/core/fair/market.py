@@ -10,7 +10,7 @@ import zipfile
 import pathlib
 import requests
 from typing import Optional
-from app.utils.middleware_util import get_redis_con
+from app.db.redis_util import redis_registry
 from app.core.deploy_functions import FunctionDeployer
 from datetime import datetime
 from app.core.config import settings
@@ -170,10 +170,9 @@ class FairMarketComponent:
                     install_task.update(status="DEPLOY")
                     fd = FunctionDeployer(tool_ins_id)
                     fd.create_temporary()
-                    publisher = get_redis_con(1)
+                    publisher = redis_registry.sync(settings.FUNCTION_BUILD_DB)
                     publisher.rpush(tool_ins_id, "start")
                     publisher.set(f"{tool_ins_id}-task", "start")
-                    publisher.close()
                     print("Component deployment is complete")
                 else:
                     install_task.update(status="FAILED")
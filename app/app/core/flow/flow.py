@@ -20,10 +20,12 @@ from app.models.mongo.public_data import PublicDataFileModel
 import uuid
 import json
 import asyncio
+import logging
+import contextlib
 import toposort
 import networkx as nx
 from enum import Enum
-from typing import Optional
+from typing import Dict, Optional
 from pydantic import BaseModel
 from app.core.config import settings
 from app.core.gate import FunctionEvent
@@ -31,12 +33,15 @@ from app.utils.common import generate_uuid
 from app.utils.statement import create_statement
 from app.schemas.tool_source import OutputDataTypes
 from app.service.manager.event import EventManager
+from app.service.manager.task import task_notifier
+from app.core.flow.loader import DAGLoader
 DEPENDS_FILE = "DEPENDS_FILE"
 DATA_FILE = "DATA_FILE"
 DEPENDS_MEMORY = "DEPENDS_MEMORY"
 DATA_MEMORY = "DATA_MEMORY"
 FRONT_DATA = "FRONT_DATA"
 DEPENDS_LIST = {DEPENDS_FILE, DEPENDS_MEMORY}
+_FINAL_STATUS = {settings.COMPUTING_SUCCESS, settings.COMPUTING_FAILED, "Error"}
 
 
 class NodeType(str, Enum):
@@ -71,15 +76,29 @@ class TaskNode(BaseModel):
 
 
 class DAG:
-    def __init__(self, experiments_id):
+    def __init__(self, experiments_id, loader: Optional[DAGLoader] = None):
         self.experiments_id = experiments_id
         self.graph = nx.DiGraph()
         self.task_nodes = {}
         self.data_map = {}
+        self.loader = loader or DAGLoader()
 
-    def from_experiments(self):
-        for i in ToolTaskModel.objects(experiment=self.experiments_id, status="Success"):
-            task_node = TaskNode(id=i.id,  name=i.name, toolName=i.tool.name, checked=True)
+    def _load(self, tasks: list) -> list:
+        self.loader.add_tasks(tasks)
+        for i in tasks:
+            self.loader.add_inputs(i.inputs)
+        self.loader.load()
+        return tasks
+
+    def from_experiments(self, tasks: Optional[list] = None):
+        """
+        :param tasks: the succeeded tasks of the experiment with their metadata already in the loader,
+                      queried when not given
+        """
+        if tasks is None:
+            tasks = self._load(list(ToolTaskModel.objects(experiment=self.experiments_id, status="Success")))
+        for i in tasks:
+            task_node = TaskNode(id=i.id,  name=i.name, toolName=self.loader.tool(i).name, checked=True)
             if i.status == 'Success':
                 self.graph.add_node(task_node.id)
                 '1e033eaec9d24b7a917ed2af3b'
@@ -89,7 +108,7 @@ class DAG:
                     if isinstance(data, dict):
                         if data.get('is_file') or _i.get('type') == 'dir':
 
-                            _file = DataFileSystem.objects(id=data['id']).first()
+                            _file = self.loader.file(data['id'])
                             if _file and _file.lab_id == self.experiments_id:
                                 data['DAG_TYPE'] = DEPENDS_FILE
                                 _map_result = self.data_map.get(_file.id)
@@ -103,7 +122,7 @@ class DAG:
                             else:
                                 print(data["id"], data, data.get('file_extension') == 'datasets')
                                 if data.get('file_extension') == 'datasets':
-                                    _file = PublicDataFileModel.objects(id=data["id"]).first()
+                                    _file = self.loader.public_file(data["id"])
                                 data['DAG_TYPE'] = DATA_FILE
                                 if _file is None:
                                     _file_id = data['id']
@@ -172,8 +191,8 @@ class DAG:
 
     def from_experiments2(self):
         self.all_inputs = list()
-        for i in ToolTaskModel.objects(experiment=self.experiments_id):
-            task_node = TaskNode(id=i.id,  name=i.name, toolName=i.tool.name, checked=True)
+        for i in self._load(list(ToolTaskModel.objects(experiment=self.experiments_id))):
+            task_node = TaskNode(id=i.id,  name=i.name, toolName=self.loader.tool(i).name, checked=True)
             if i.status == 'Success':
                 self.graph.add_node(task_node.id)
                 self.task_nodes[task_node.id] = task_node
@@ -181,7 +200,7 @@ class DAG:
                     data = _i['data']
                     if isinstance(data, dict):
                         if data.get('is_file'):
-                            _file = DataFileSystem.objects(id=data['id']).first()
+                            _file = self.loader.file(data['id'])
                             if _file and _file.lab_id == self.experiments_id:
                                 data['DAG_TYPE'] = DEPENDS_FILE
                                 _map_result = self.data_map.get(_file.id)
@@ -270,14 +289,18 @@ class DAG:
 
 
 class REDAG:
-    def __init__(self, experiments_id, analysis):
+    def __init__(self, experiments_id, analysis, loader: Optional[DAGLoader] = None):
         self.all_inputs = list()
         self.experiments_id = experiments_id
         self.graph = nx.DiGraph()
         self.analysis = analysis
         self.nodes = list()
+        self.loader = loader or DAGLoader()
 
     def from_experiments(self):
+        for i in self.analysis.skeleton.experiment_tasks:
+            self.loader.add_inputs(i['inputs'])
+        self.loader.load()
         for i in self.analysis.skeleton.experiment_tasks:
             print("ITER NODES", i)
             task_node = TaskNode(id=i['task_id'], name=i['task_name'], toolName=i['tool'], checked=True)
@@ -286,7 +309,7 @@ class REDAG:
                 data = _i['data']
                 if isinstance(data, dict):
                     if data.get('is_file'):
-                        _file = DataFileSystem.objects(id=data['id']).first()
+                        _file = self.loader.file(data['id'])
                         if _file and _file.lab_id == self.experiments_id:
                             data['DAG_TYPE'] = DEPENDS_FILE
                             output_node = OutputNode(id=_file.id, name=_file.name, to=[{task_node.id: _i['name']}],
@@ -324,6 +347,7 @@ class REDAG:
                     self.all_inputs.append(input_node)
 
     def from_experiments2(self):
+        self.loader.add_inputs(self.analysis.skeleton.inputs).load()
         for i in self.analysis.skeleton.inputs:
             task_node = TaskNode(id=i['task_id'], name=i['task_name'], toolName="", checked=True)
             self.nodes.append(task_node)
@@ -332,7 +356,7 @@ class REDAG:
             data = _i['data']
             if isinstance(data, dict):
                 if data.get('is_file'):
-                    _file = DataFileSystem.objects(id=data['id']).first()
+                    _file = self.loader.file(data['id'])
                     if _file and _file.lab_id == self.experiments_id:
                         data['DAG_TYPE'] = DEPENDS_FILE
                         output_node = OutputNode(id=i['id'], name=_file.name, to=[{task_node.id: _i['name']}],
@@ -371,9 +395,32 @@ class REDAG:
                 self.all_inputs.append(input_node)
 
 
+# user id -> [semaphore, tasks holding or waiting for it], dropped with the last of them
+_USER_FLOW_SEMAPHORES: Dict[str, list] = dict()
+
+
+@contextlib.asynccontextmanager
+async def user_flow_slot(user_id: str):
+    """
+    Process wide limit of the tasks of one user computing at the same time across all the user's analyses
+    """
+    _entry = _USER_FLOW_SEMAPHORES.get(user_id)
+    if _entry is None:
+        _entry = _USER_FLOW_SEMAPHORES[user_id] = [asyncio.Semaphore(settings.FLOW_USER_CONCURRENCY), 0]
+    _entry[1] += 1
+    try:
+        async with _entry[0]:
+            yield
+    finally:
+        _entry[1] -= 1
+        if _entry[1] == 0:
+            _USER_FLOW_SEMAPHORES.pop(user_id, None)
+
+
 class Flow:
 
-    def __init__(self, analysis: AnalysisModel2, outer_input: dict, user, publisher):
+    def __init__(self, analysis: AnalysisModel2, outer_input: dict, user, publisher,
+                 concurrency: Optional[int] = None):
         self.analysis = analysis
         self.dag = analysis.dag
         self.graph = nx.DiGraph()
@@ -384,11 +431,20 @@ class Flow:
         self.user_id = user.id
         self.publisher = publisher
         self.outputs_point = outer_input.get('outputs_path')
+        self.concurrency = concurrency or settings.FLOW_ANALYSIS_CONCURRENCY
         _map = {}
         self.source_tasks = analysis.skeleton.experiment_tasks
+        self._old_id = dict()
+        self._all_task_id = list()
+        self._failed = set()
+        # Files, tasks and tools of the whole analysis are resolved at once
+        self.loader = DAGLoader()
+        for i in self.source_tasks:
+            self.loader.add_inputs(i['inputs'])
+        self.loader.add_tasks([i['task_id'] for i in self.source_tasks])
 
     def tasks(self):
-        s = REDAG(self.source_tasks[0]['experiment'], self.analysis)
+        s = REDAG(self.source_tasks[0]['experiment'], self.analysis, loader=self.loader)
         s.from_experiments()
         functions = dict()
         unable_functions = set()
@@ -397,7 +453,7 @@ class Flow:
                 unable_functions.add(i['id'])
         print("Nodes", s.nodes)
         for i in s.nodes:
-            _xml = ToolTaskModel.objects(id=i.id).first().tool
+            _xml = self.loader.tool(i.id)
             functions[i.id] = dict()
             functions[i.id]['tool'] = i.toolName
             functions[i.id]['inputs'] = {i['name']: None for i in _xml.inputs}
@@ -410,6 +466,83 @@ class Flow:
                             map_function['inputs'][_input] = i.id
         return functions, unable_functions
 
+    async def wait(self, task_id: str) -> str:
+        """
+        Block until the computing task reaches a final state, woken up by the completion event of the callback
+        """
+        while True:
+            # Subscribe before reading the status so that a completion between the two is not missed
+            _waiter = task_notifier.subscribe(task_id, self.publisher)
+            try:
+                status_set = await self.publisher.get(task_id + '-task')
+                if status_set not in _FINAL_STATUS:
+                    status_set = await asyncio.wait_for(_waiter, settings.FLOW_POLLING_FALLBACK)
+            except asyncio.TimeoutError:
+                # Fall back to reading the status in case the callback was lost
+                continue
+            finally:
+                task_notifier.unsubscribe(task_id, _waiter)
+            if status_set == settings.COMPUTING_SUCCESS:
+                return settings.COMPUTING_SUCCESS
+            elif status_set in (settings.COMPUTING_FAILED, "Error"):
+                return settings.COMPUTING_FAILED
+
+    async def dispatch(self, task: str, functions: dict) -> str:
+        """
+        Trigger a single task of the analysis and wait for its final state
+        """
+        _task_id = generate_uuid()
+        _params = {"task_id": _task_id,
+                   "lab_id": self.lab_id,
+                   }
+        self._all_task_id.append(_task_id)
+        await self.publisher.set(self.analysis.id + "-stage", json.dumps(self._all_task_id, ensure_ascii=False))
+        self._old_id[self.old_lab_id + "_" + task] = self.lab_id + "_" + _task_id
+        logging.debug(f"OLD_ID {self._old_id}")
+        if functions.get(task) is not None:
+            for _k, _v in functions[task]['inputs'].items():
+                _values = self.outer_input.get(_v)
+                print(_k, _v, _values)
+                if _values is not None:
+                    _params[_k] = _values
+                else:
+                    _params[_k] = {'id': self._old_id.get(_v)}
+        function_name = self.loader.tool(task).name
+        print("PARAMS", _params)
+
+        em = EventManager(function_name, _params, self.user)
+        _result = await em.trigger(self.publisher)
+        print(_result)
+        if _result.get("code") != 200:
+            return settings.COMPUTING_FAILED
+        # FunctionEvent(self.user_id, function_name, self.outputs_point, **_params).reaction("analysis")
+        await self.publisher.set(self.lab_id, "Pending")
+        return await self.wait(_task_id)
+
+    async def schedule(self, task: str, upstream: set, done: dict, functions: dict, unable_functions: set,
+                       semaphore: asyncio.Semaphore):
+        """
+        Start the task as soon as all of its own upstream tasks are finished
+        """
+        try:
+            for _upstream_task in upstream:
+                await done[_upstream_task].wait()
+            if upstream & self._failed:
+                # The inputs of the task will never be produced
+                self._failed.add(task)
+                return
+            if task in unable_functions:
+                return
+            async with semaphore, user_flow_slot(self.user_id):
+                _status = await self.dispatch(task, functions)
+            if _status != settings.COMPUTING_SUCCESS:
+                self._failed.add(task)
+        except Exception as e:
+            logging.exception(f"Flow task {task} exception: {e}")
+            self._failed.add(task)
+        finally:
+            done[task].set()
+
     async def run(self):
         functions, unable_functions = self.tasks()
         input_map = {}
@@ -432,7 +565,7 @@ class Flow:
                 for _input in i['inputs']:
                     _input_type = _input['type']
                     if _input_type == "file":
-                        _file = DataFileSystem.objects(id=_input['data']['id']).first()
+                        _file = self.loader.file(_input['data']['id'])
                         if _file and _file.lab_id == i['experiment']:
                             if _map.get(_file.task_id) is None:
                                 _map[_file.task_id] = set()
@@ -452,54 +585,26 @@ class Flow:
                 if _map.get(i['task_id']) is None:
                     _map[i['task_id']] = set()
 
+        # _map: task -> the tasks consuming its outputs, the levels are reversed to start from the sources
         _steps = list(toposort.toposort(_map))
-        _old_id = dict()
         _steps.reverse()
-        _all_task_id = list()
-        await self.publisher.set(self.analysis.id + "-stage", json.dumps(_all_task_id, ensure_ascii=False))
-        # try:
-        for i in _steps:
-            for task in i:
-                if task not in unable_functions:
-                    _task_id = generate_uuid()
-                    _params = {"task_id": _task_id,
-                               "lab_id": self.lab_id,
-                               }
-                    _all_task_id.append(_task_id)
-                    _old_id[self.old_lab_id + "_" + task] = self.lab_id + "_" + _task_id
-                    print("OLD_ID", _old_id)
-                    if functions.get(task) is not None:
-                        for _k, _v in functions[task]['inputs'].items():
-                            _values = self.outer_input.get(_v)
-                            print(_k, _v, _values)
-                            if _values is not None:
-                                _params[_k] = _values
-                            else:
-                                _params[_k] = {'id': _old_id.get(_v)}
-                    function_name = ToolTaskModel.objects(id=task).first().tool.name
-                    print("PARAMS", _params)
-
-                    em = EventManager(function_name, _params, UserModel.objects(id=self.user_id).first())
-                    _result = await em.trigger(self.publisher)
-                    print(_result)
-                    # FunctionEvent(self.user_id, function_name, self.outputs_point, **_params).reaction("analysis")
-                    await self.publisher.set(self.lab_id, "Pending")
-                    while True:
-                        print(f"TASK ID---> {_task_id}")
-                        status_set = await self.publisher.get(_task_id+'-task')
-                        if status_set == settings.COMPUTING_SUCCESS:
-                            break
-                        elif settings.COMPUTING_FAILED == status_set:
-                            _status = settings.COMPUTING_FAILED
-                            break
-                        await asyncio.sleep(1.5)
+        _upstream = {task: set() for step in _steps for task in step}
+        for _task, _consumers in _map.items():
+            for _consumer in _consumers:
+                _upstream[_consumer].add(_task)
+        await self.publisher.set(self.analysis.id + "-stage", json.dumps(self._all_task_id, ensure_ascii=False))
+        # Every ready task is dispatched at once, bounded by the analysis and user concurrency
+        _done = {task: asyncio.Event() for task in _upstream}
+        _semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*[self.schedule(task, _upstream[task], _done, functions, unable_functions, _semaphore)
+                               for step in _steps for task in step])
         original_balance = UserQuotaModel.objects(user=self.user_id).first().balance
         balance = 0
         cpu_nums = 0
         mermory_nums = 0
         computing_quota = ComputingQuotaRuleModel.objects.first()
         # DAG TOP SORT
-        for _ in _all_task_id:
+        for _ in self._all_task_id:
             print(f"TASK ID ----> {_}")
             result_use_resource = await self.publisher.get(f"{_}-resource")
             if result_use_resource is None:
@@ -529,6 +634,10 @@ class Flow:
         await create_statement(original_balance-balance, original_balance, self.user, self.user,
                                QuotaStatementEnum.analysis, event=self.analysis)
         UserQuotaModel.objects(user=self.user).first().update(balance=original_balance-balance)
+        if self._failed:
+            logging.warning(f"FLOW Failed {self.lab_id}: {self._failed}")
+            await self.publisher.set(self.lab_id, settings.COMPUTING_FAILED)
+            return
         print(f"FLOW Success {self.lab_id}")
         self.analysis.update(state="COMPLETED")
         await self.publisher.set(self.lab_id, "Success")
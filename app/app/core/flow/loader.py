@@ -0,0 +1,110 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:loader
+@time:2023/06/05
+"""
+from typing import Iterable, Optional, Tuple, Union
+from mongoengine import Document
+from app.models.mongo import DataFileSystem, ToolTaskModel, XmlToolSourceModel
+from app.models.mongo.public_data import PublicDataFileModel
+
+
+def reference_id(document: Document, field: str):
+    """
+    Id of a ReferenceField without dereferencing it
+    """
+    _value = document._data.get(field)
+    return getattr(_value, 'id', _value)
+
+
+class DAGLoader:
+    """
+    Collect every file, public file, task and tool referenced while building a graph,
+    then resolve them with a single id__in query per collection.
+    Ids that were not collected beforehand fall back to a single query and are cached.
+    """
+
+    def __init__(self):
+        self.files = dict()
+        self.public_files = dict()
+        self.tasks = dict()
+        self.tools = dict()
+        self._file_ids = set()
+        self._public_file_ids = set()
+        self._task_ids = set()
+
+    @staticmethod
+    def input_ids(inputs: Iterable[dict]) -> Tuple[set, set]:
+        """
+        Ids of the files and of the public files an input list may reference
+        """
+        file_ids = set()
+        public_file_ids = set()
+        for _i in inputs:
+            data = _i.get('data')
+            if isinstance(data, dict) and isinstance(data.get('id'), str):
+                file_ids.add(data['id'])
+                if data.get('file_extension') == 'datasets':
+                    public_file_ids.add(data['id'])
+        return file_ids, public_file_ids
+
+    def add_inputs(self, inputs: Iterable[dict]) -> "DAGLoader":
+        file_ids, public_file_ids = self.input_ids(inputs)
+        self._file_ids.update(file_ids)
+        self._public_file_ids.update(public_file_ids)
+        return self
+
+    def add_tasks(self, tasks: Iterable[Union[ToolTaskModel, str]]) -> "DAGLoader":
+        for _task in tasks:
+            if isinstance(_task, ToolTaskModel):
+                self.tasks[_task.id] = _task
+            else:
+                self._task_ids.add(_task)
+        return self
+
+    @staticmethod
+    def _resolve(cache: dict, model, ids: set):
+        # Missing documents are cached as None as well, they are not queried again one by one
+        ids = ids.difference(cache)
+        if ids:
+            cache.update(dict.fromkeys(ids))
+            cache.update({_.id: _ for _ in model.objects(id__in=list(ids))})
+
+    def load(self) -> "DAGLoader":
+        self._resolve(self.files, DataFileSystem, self._file_ids)
+        self._resolve(self.public_files, PublicDataFileModel, self._public_file_ids)
+        self._resolve(self.tasks, ToolTaskModel, self._task_ids)
+        _tool_ids = {reference_id(_, 'tool') for _ in self.tasks.values() if _ is not None}
+        _tool_ids.discard(None)
+        self._resolve(self.tools, XmlToolSourceModel, _tool_ids)
+        self._file_ids.clear()
+        self._public_file_ids.clear()
+        self._task_ids.clear()
+        return self
+
+    def file(self, file_id: str) -> Optional[DataFileSystem]:
+        if file_id not in self.files:
+            self.files[file_id] = DataFileSystem.objects(id=file_id).first()
+        return self.files[file_id]
+
+    def public_file(self, file_id: str) -> Optional[PublicDataFileModel]:
+        if file_id not in self.public_files:
+            self.public_files[file_id] = PublicDataFileModel.objects(id=file_id).first()
+        return self.public_files[file_id]
+
+    def task(self, task_id: str) -> Optional[ToolTaskModel]:
+        if task_id not in self.tasks:
+            self.tasks[task_id] = ToolTaskModel.objects(id=task_id).first()
+        return self.tasks[task_id]
+
+    def tool(self, task: Union[ToolTaskModel, str]) -> Optional[XmlToolSourceModel]:
+        if not isinstance(task, ToolTaskModel):
+            task = self.task(task)
+            if task is None:
+                return None
+        tool_id = reference_id(task, 'tool')
+        if tool_id not in self.tools:
+            self.tools[tool_id] = XmlToolSourceModel.objects(id=tool_id).first()
+        return self.tools[tool_id]
@@ -459,7 +459,7 @@ class Flow:
                             else:
                                 _params[_k] = {'id': _old_id.get(_v)}
                         function_name = ToolTaskModel.objects(id=task).first().tool.name
-                        FunctionEvent(self.user_id, function_name, self.outputs_point, **_params).reaction("analysis")
+                        await FunctionEvent(self.user_id, function_name, self.outputs_point, **_params).reaction("analysis")
                         await self.publisher.set(self.lab_id, "Pending")
                         while True:
                             status_set = await self.publisher.get(_task_id+'-task')
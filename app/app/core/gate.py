@@ -7,34 +7,39 @@
 """
 import os
 import requests
+from aioredis import Redis
 from fastapi import status
 from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from app.core.config import settings
-from app.utils.middleware_util import get_redis_con
+from app.db.redis_util import redis_registry
 from app.utils.middleware_util import get_s3_client
+from app.utils.minio_util import ensure_bucket
+from app.utils.http_util import async_post
 from app.schemas.event_parameters import EventParameters, LaunchSchema, GatewayTaskData, S3Data, S3LoadData
 from app.models.mongo import ToolTaskModel, XmlToolSourceModel, ComponentInstance,  DataFileSystem
 from app.models.mongo.public_data import PublicDataFileModel
 from app.service.manager.task import ComputeTaskManager
+from app.service.manager.tasklog import append_log, append_log_sync, log_stream, read_log_sync, LINE_FIELD
 
 Memory_OUTPUT_LANGUAGE = ['python']
 
 
-def post_function(function_name: str, data: dict):
+async def post_function(function_name: str, data: dict, conn: Redis):
     """
     :param function_name:  Faas Function Service Name http:cloud-gateway/async-function/{function_name}
     :param data: Function service-->Component running parameters
+    :param conn: task publisher redis connection
     :return:
     """
-    con = get_redis_con(5)
     task_id = data.get('task_id')
     lab_id = data.get('lab_id')
-    con[task_id+'-task'] = "Start"
-    con.lpush(task_id, "")
     assert task_id and lab_id, f"This schedule failed.，Metadata information is lost: {'Operator taskIdlost' if lab_id else 'ExperimentIdlost'}"
+    await conn.set(task_id+'-task', "Start")
+    await append_log(conn, task_id, "")
     url = f'{settings.ASYNC_FUNCTION_DOMAIN}{function_name}'
-    res = requests.post(url, json=data,
-                        headers={"X-Callback-Url": f"http://{settings.SERVER_HOST}/callback/{task_id}"})
+    res = await async_post(url, json=data,
+                           headers={"X-Callback-Url": f"http://{settings.SERVER_HOST}/callback/{task_id}"})
     if res.status_code != 202:
         raise ModuleNotFoundError(f"|{function_name}| is not found")
     return JSONResponse(status_code=status.HTTP_200_OK,
@@ -70,21 +75,28 @@ def runtime_exec(function_name,
 
 
 class PublishTask:
-    def __init__(self, task_id, db=5):
-        self.con = get_redis_con(db)
+    """
+    Blocking reads of a task log, for the code running in worker threads
+    """
+    def __init__(self, task_id, db=settings.TASK_PUBLISHER_DB):
+        self.con = redis_registry.sync(db)
         self.task_id = task_id
 
     def write(self, _strings):
-        self.con.rpush(self.task_id, _strings)
+        append_log_sync(self.con, self.task_id, _strings)
 
-    def publisher(self, start_index: int):
-        for _ in self.con.lrange(self.task_id, start_index, -1):
-            yield _.decode()
+    def publisher(self, start_index: int = 0):
+        for _ in read_log_sync(self.con, self.task_id, start_index):
+            yield _
 
     def pending(self):
+        # The list lines of the runtime come after the stream lines
         _data = self.con.lindex(self.task_id, -1)
         if _data is not None:
-            return self.con.lindex(self.task_id, -1).decode()
+            return _data.decode()
+        _entries = self.con.xrevrange(log_stream(self.task_id), count=1)
+        if _entries:
+            return _entries[0][1].get(LINE_FIELD.encode(), b"").decode()
         return ""
 
     @property
@@ -103,19 +115,15 @@ def check_object_exits(bucket_name: str, object_name: str, dst_name: str, client
     if client is None:
         client = get_s3_client()
     _split_object_name = object_name.split('/')
-    if not client.bucket_exists(bucket_name):
-        client.make_bucket(bucket_name)
+    ensure_bucket(bucket_name, client)
+    if redis_client is None:
+        redis_client = redis_registry.sync(settings.TASK_PUBLISHER_DB)
     if len(_split_object_name) > 1:
-        try:
-            redis_client[_split_object_name[0] + '-task'].decode()
-        except KeyError:
-            ...
-        else:
+        if redis_client.exists(_split_object_name[0] + '-task'):
             tool_task_object = ToolTaskModel.objects(id=_split_object_name[0]).first()
             if tool_task_object is not None:
                 bucket_name = tool_task_object.experiment.id
-                if not client.bucket_exists(bucket_name):
-                    client.make_bucket(bucket_name)
+                ensure_bucket(bucket_name, client)
             # else:
             #     ase = AnalysisStepElementModel.objects(id=_split_object_name[0]).first()
             #     bucket_name = ase.analysis.id
@@ -127,8 +135,7 @@ def check_object_exits(bucket_name: str, object_name: str, dst_name: str, client
         _dfs = DataFileSystem.objects(lab_id=lab_id, name=object_name).first()
         if _dfs:
             bucket_name = lab_id
-            if not client.bucket_exists(bucket_name):
-                client.make_bucket(bucket_name)
+            ensure_bucket(bucket_name, client)
             object_name = _dfs.task_id + '/' + object_name
         else:
 
@@ -166,7 +173,7 @@ class FunctionEvent:
         self.parameters.pop('lab_id')
         self.parameters.pop('task_id')
         self.load_type = {'file', 'dir'}
-        self.con = get_redis_con(5)
+        self.con = redis_registry.connection(settings.TASK_PUBLISHER_DB)
         self.oss_client = get_s3_client()
         self._memory_output = None
 
@@ -196,7 +203,7 @@ class FunctionEvent:
             value = self.parameters.get(_['name'])
             if type_check:
                 if _['type'] == "datasets":
-                    print("DEBUG-----"", value, _,)
+                    print("DEBUG-----", value, _,)
                     s3_data_list.append(S3LoadData(
                         bucket=value['id'],
                         object_name=f'home/data_storage/storage_data/uploads_datasets_cache/{value["id"]}',
@@ -218,8 +225,7 @@ class FunctionEvent:
                 elif _['type'] in self.load_type and _['name'] not in self.outputs_keys:
                     dst_name, value = split_object_name(value)
                     self.parameters[_['name']] = value
-                    bucket, value = check_object_exits(self.user_id, value, dst_name, redis_client=self.con,
-                                                       lab_id=self.lab_id)
+                    bucket, value = check_object_exits(self.user_id, value, dst_name, lab_id=self.lab_id)
                     self.parameters[_['name']] = value
                     s3_data_list.append(
                         S3LoadData(
@@ -260,20 +266,21 @@ class FunctionEvent:
             _parameters['memory_output'] = self._memory_output
         return _parameters
 
-    def start(self):
-        self.con[self.task_id + '-task'] = "Start"
-        self.con.lpush(self.task_id, "==== DataLab Start Function ====")
+    async def start(self):
+        await self.con.set(self.task_id + '-task', "Start")
+        await append_log(self.con, self.task_id, "==== DataLab Start Function ====")
 
-    def failed(self):
-        self.con[self.task_id + '-task'] = "Failed"
-        self.con.lpush(self.task_id, "==== DataLab Function Failed ====")
+    async def failed(self):
+        await self.con.set(self.task_id + '-task', "Failed")
+        await append_log(self.con, self.task_id, "==== DataLab Function Failed ====")
 
-    def reaction(self, task_type: str):
+    async def reaction(self, task_type: str):
         _task_queue_id = None
         if task_type == 'task':
             _task_queue_id = ComputeTaskManager.add_task(ToolTaskModel.objects(id=self.task_id).first(), self.user_id)
-        self.start()
-        _data = self.package_parameters
+        await self.start()
+        # Checks and creates the buckets of the inputs: MinIO and Mongo calls, kept off the event loop
+        _data = await run_in_threadpool(lambda: self.package_parameters)
         datalab_env = dict()
         datalab_env['REDIS_HOST'] = settings.REDIS_HOST
         datalab_env['MONGO_HOST'] = settings.MONGODB_SERVER
@@ -282,13 +289,12 @@ class FunctionEvent:
         datalab_env['MINIO_SECRET_KEY'] = settings.MINIO_SECRET_KEY
         datalab_env['OUTPUTS_POINT'] = self.outputs_point
         _data['datalab_env'] = datalab_env
-        res = requests.post(self.component_instance.asynchronous_uri,
-                            json=_data,
-                            headers={
-                                "X-Callback-Url":
-                                    f"http://{settings.SERVER_HOST}/api/components/callback/{_task_queue_id}"}
-                            )
-        self.con.close()
+        res = await async_post(self.component_instance.asynchronous_uri,
+                               json=_data,
+                               headers={
+                                   "X-Callback-Url":
+                                       f"http://{settings.SERVER_HOST}/api/components/callback/{_task_queue_id}"}
+                               )
         if res.status_code != 202:
             raise ModuleNotFoundError(f"|{self.function_name}| is not found")
         return JSONResponse(status_code=status.HTTP_200_OK,
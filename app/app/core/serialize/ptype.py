@@ -8,7 +8,7 @@
 import pandas as pd
 import numpy as np
 from pydantic import BaseModel
-from typing import Any
+from typing import Any, Optional
 
 
 USED = [str, int, float, set, list, tuple, dict, bool, pd.DataFrame, np.ndarray]
@@ -20,6 +20,11 @@ class PythonSerializeResultResponse(BaseModel):
     frontend: str
     data: Any
     serialize: str
+    # Results stored by app.core.serialize.result: data is a preview, the rest is read by pages
+    data_schema: Optional[dict] = None
+    total: Optional[int] = None
+    pages: int = 0
+    page_size: int = 0
 
 
 class PythonObjectSerialize:
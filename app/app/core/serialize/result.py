@@ -0,0 +1,399 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:result
+@time:2023/06/23
+
+In-memory results of the tasks, labVenvData.pkl under the task prefix of the experiment bucket.
+Each type has its codec: JSON for the primitives, JSON pages of rows for DataFrames and sequences,
+.npy for numeric ndarrays read back by byte range. The codec writes next to the result:
+    labVenvData.meta.json    type, schema, a small preview and the page layout, written last
+    labVenvData.pages/<n>.json or labVenvData.npy    the full data, read one page at a time
+Listings only read the metadata, the pickle is loaded once per version of the result.
+"""
+import io
+import json
+import math
+import pickle
+import asyncio
+import reprlib
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from minio.error import S3Error
+from app.core.config import settings
+from app.core.serialize.ptype import PythonSerializeResultResponse
+from app.utils.minio_util import minio_client, read_object, run_in_minio_pool, async_list_objects
+
+RESULT_OBJECT = "labVenvData.pkl"
+META_OBJECT = "labVenvData.meta.json"
+PAGES_PREFIX = "labVenvData.pages/"
+NPY_OBJECT = "labVenvData.npy"
+# 2: non-finite floats stored as null
+META_VERSION = 2
+
+# read(object name relative to the result prefix, offset, length) -> bytes
+Reader = Callable[..., bytes]
+
+
+def _json_default(value: Any):
+    # numpy values, sets and non-finite floats are converted by _finite beforehand
+    return str(value)
+
+
+def _finite(value: Any) -> Any:
+    """
+    value with NaN and infinities replaced by None: JSONResponse refuses them
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, np.ndarray):
+        return _finite(value.tolist()) if value.dtype.kind == "O" else _finite_list(value)
+    if isinstance(value, dict):
+        return {_key(k): _finite(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [_finite(_) for _ in value]
+    return value
+
+
+def _key(key: Any) -> Any:
+    """
+    Dict key JSON can encode: tuples, numpy values or NaN keys are turned into their text
+    """
+    if isinstance(key, np.generic):
+        key = key.item()
+    if key is None or isinstance(key, (str, int, bool)) or isinstance(key, float) and math.isfinite(key):
+        return key
+    return str(key)
+
+
+def _finite_list(data: np.ndarray) -> Any:
+    """
+    ndarray.tolist() with NaN and infinities as None
+    """
+    if data.dtype.kind == "f":
+        _missing = ~np.isfinite(data)
+        if _missing.any():
+            data = data.astype(object)
+            data[_missing] = None
+    return data.tolist()
+
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(_finite(value), ensure_ascii=False, default=_json_default, allow_nan=False).encode()
+
+
+def _short_repr(data: Any) -> str:
+    _repr = reprlib.Repr()
+    _repr.maxstring = _repr.maxother = settings.RESULT_PREVIEW_CHARS
+    _repr.maxlist = _repr.maxtuple = _repr.maxset = _repr.maxdict = settings.RESULT_PREVIEW_ROWS
+    return _repr.repr(data)[:settings.RESULT_PREVIEW_CHARS]
+
+
+def _pages(total: int) -> int:
+    return max(1, math.ceil(total / settings.RESULT_PAGE_ROWS))
+
+
+def _page_bounds(meta: dict, page: int):
+    if not 0 <= page < meta["pages"]:
+        raise IndexError(f"page {page} out of range, {meta['pages']} pages")
+    start = page * meta["page_size"]
+    return start, min(start + meta["page_size"], meta["total"])
+
+
+class ResultCodec:
+    """
+    meta() describes data, objects() yields the (relative name, bytes) to store, page() reads one page back
+    """
+    name: str = ""
+
+    def accepts(self, data: Any) -> bool:
+        raise NotImplementedError
+
+    def meta(self, data: Any) -> dict:
+        raise NotImplementedError
+
+    def objects(self, data: Any, meta: dict):
+        return iter(())
+
+    def page(self, read: Reader, meta: dict, page: int) -> Any:
+        raise IndexError("no data stored for this result")
+
+
+class JSONCodec(ResultCodec):
+    """
+    Scalars, strings and dicts: one JSON page
+    """
+    name = "json"
+    FRONTEND = {int: "number", float: "number", bool: "boolean", str: "text", dict: "object"}
+
+    def accepts(self, data: Any) -> bool:
+        return isinstance(data, (int, float, bool, str, dict, np.bool_, np.integer, np.floating))
+
+    def meta(self, data: Any) -> dict:
+        if isinstance(data, np.generic):
+            data = data.item()
+        _type = type(data).__name__
+        if isinstance(data, dict):
+            preview = dict(list(data.items())[:settings.RESULT_PREVIEW_ROWS]) \
+                if len(data) > settings.RESULT_PREVIEW_ROWS else data
+            preview = json.loads(_dumps(preview))
+            schema = {"keys": len(data)}
+        else:
+            # Kept as the text the number, text and boolean views already display
+            preview = str(data)[:settings.RESULT_PREVIEW_CHARS]
+            schema = {"length": len(data)} if isinstance(data, str) else {}
+        return {"type": _type, "frontend": self.FRONTEND.get(type(data), "object"), "schema": schema,
+                "preview": preview, "serialize": _short_repr(data), "total": 1, "page_size": 1, "pages": 1}
+
+    def objects(self, data: Any, meta: dict):
+        yield f"{PAGES_PREFIX}0.json", _dumps(data)
+
+    def page(self, read: Reader, meta: dict, page: int) -> Any:
+        _page_bounds(meta, page)
+        return json.loads(read(f"{PAGES_PREFIX}0.json"))
+
+
+class SequenceCodec(ResultCodec):
+    """
+    list, tuple and set: JSON pages of RESULT_PAGE_ROWS items
+    """
+    name = "json-pages"
+
+    def accepts(self, data: Any) -> bool:
+        return isinstance(data, (list, tuple, set, frozenset))
+
+    @staticmethod
+    def _items(data) -> list:
+        return list(data)
+
+    def meta(self, data: Any) -> dict:
+        items = self._items(data)
+        return {"type": type(data).__name__, "frontend": "object", "schema": {"length": len(items)},
+                "preview": json.loads(_dumps(items[:settings.RESULT_PREVIEW_ROWS])), "serialize": _short_repr(data),
+                "total": len(items), "page_size": settings.RESULT_PAGE_ROWS, "pages": _pages(len(items))}
+
+    def objects(self, data: Any, meta: dict):
+        items = self._items(data)
+        for i in range(meta["pages"]):
+            yield f"{PAGES_PREFIX}{i}.json", _dumps(items[i * meta["page_size"]:(i + 1) * meta["page_size"]])
+
+    def page(self, read: Reader, meta: dict, page: int) -> Any:
+        _page_bounds(meta, page)
+        return json.loads(read(f"{PAGES_PREFIX}{page}.json"))
+
+
+class DataFrameCodec(SequenceCodec):
+    """
+    DataFrame: JSON pages of rows in the pandas "split" layout, {"columns": [], "index": [], "data": [[]]}
+    """
+
+    def accepts(self, data: Any) -> bool:
+        return isinstance(data, pd.DataFrame)
+
+    @staticmethod
+    def _split(frame: pd.DataFrame) -> dict:
+        return json.loads(frame.to_json(orient="split", date_format="iso", default_handler=str))
+
+    def meta(self, data: pd.DataFrame) -> dict:
+        schema = {"columns": [{"name": str(k), "dtype": str(v)} for k, v in data.dtypes.items()],
+                  "index": str(data.index.dtype), "rows": len(data)}
+        return {"type": "pandas.DataFrame", "frontend": "object", "schema": schema,
+                "preview": self._split(data.head(settings.RESULT_PREVIEW_ROWS)),
+                "serialize": f"DataFrame {data.shape[0]} rows x {data.shape[1]} columns",
+                "total": len(data), "page_size": settings.RESULT_PAGE_ROWS, "pages": _pages(len(data))}
+
+    def objects(self, data: pd.DataFrame, meta: dict):
+        for i in range(meta["pages"]):
+            _rows = data.iloc[i * meta["page_size"]:(i + 1) * meta["page_size"]]
+            yield f"{PAGES_PREFIX}{i}.json", _dumps(self._split(_rows))
+
+
+class NdarrayCodec(ResultCodec):
+    """
+    Numeric ndarray: one .npy, a page is RESULT_PAGE_ROWS entries of the first axis read by byte range
+    """
+    name = "npy"
+    KINDS = "biuf"
+
+    def accepts(self, data: Any) -> bool:
+        return isinstance(data, np.ndarray) and data.dtype.kind in self.KINDS
+
+    def meta(self, data: np.ndarray) -> dict:
+        rows = data.shape[0] if data.ndim else 1
+        preview = _finite_list(data[:settings.RESULT_PREVIEW_ROWS]) if data.ndim else _finite(data.item())
+        return {"type": "numpy.ndarray", "frontend": "object",
+                "schema": {"shape": list(data.shape), "dtype": str(data.dtype)},
+                "preview": preview, "serialize": f"ndarray {data.dtype} {tuple(data.shape)}",
+                "total": rows, "page_size": settings.RESULT_PAGE_ROWS, "pages": _pages(rows)}
+
+    def objects(self, data: np.ndarray, meta: dict):
+        data = np.ascontiguousarray(data)
+        buffer = io.BytesIO()
+        np.lib.format.write_array(buffer, data, allow_pickle=False)
+        payload = buffer.getvalue()
+        # Offset of the first entry and layout of the entries, for the range reads
+        meta["header_length"] = len(payload) - data.nbytes
+        meta["descr"] = np.lib.format.dtype_to_descr(data.dtype)
+        yield NPY_OBJECT, payload
+
+    def page(self, read: Reader, meta: dict, page: int) -> Any:
+        start, stop = _page_bounds(meta, page)
+        shape = meta["schema"]["shape"]
+        dtype = np.lib.format.descr_to_dtype(meta["descr"])
+        if not shape:
+            return _finite(np.frombuffer(read(NPY_OBJECT, meta["header_length"], dtype.itemsize), dtype)[0].item())
+        row_size = dtype.itemsize * int(np.prod(shape[1:], dtype=np.int64))
+        if stop <= start or row_size == 0:
+            return np.empty([max(stop - start, 0)] + shape[1:], dtype).tolist()
+        _bytes = read(NPY_OBJECT, meta["header_length"] + start * row_size, (stop - start) * row_size)
+        return _finite_list(np.frombuffer(_bytes, dtype).reshape([stop - start] + shape[1:]))
+
+
+class ObjectCodec(ResultCodec):
+    """
+    Anything else: a bounded repr, no data to page through
+    """
+    name = "repr"
+
+    def accepts(self, data: Any) -> bool:
+        return True
+
+    def meta(self, data: Any) -> dict:
+        _repr = _short_repr(data)
+        return {"type": type(data).__name__, "frontend": "object", "schema": {}, "preview": _repr,
+                "serialize": _repr, "total": 0, "page_size": 0, "pages": 0}
+
+
+# First codec accepting the data wins: bool is an int and DataFrame is not a sequence, order matters
+CODECS: List[ResultCodec] = [NdarrayCodec(), DataFrameCodec(), JSONCodec(), SequenceCodec(), ObjectCodec()]
+CODECS_BY_NAME: Dict[str, ResultCodec] = {_.name: _ for _ in CODECS}
+
+
+def codec_for(data: Any) -> ResultCodec:
+    return next(_ for _ in CODECS if _.accepts(data))
+
+
+def _encode(data: Any, objects: bool = True) -> tuple:
+    """
+    (codec, metadata, objects) of data, the bounded repr when its codec can't encode it
+    """
+    codec = codec_for(data)
+    try:
+        meta = codec.meta(data)
+        return codec, meta, list(codec.objects(data, meta)) if objects else []
+    except Exception as e:
+        print(f"Serialization exception {e}: {type(data).__name__} stored as its repr")
+        codec = CODECS_BY_NAME[ObjectCodec.name]
+        meta = codec.meta(data)
+        return codec, meta, list(codec.objects(data, meta)) if objects else []
+
+
+def describe(data: Any) -> dict:
+    """
+    Metadata of data without storing anything
+    """
+    codec, meta, _ = _encode(data, objects=False)
+    meta.update(version=META_VERSION, codec=codec.name)
+    return meta
+
+
+class ResultStore:
+    """
+    Blocking access to the results in MinIO, run it through the async_* helpers from the event loop
+    """
+
+    @staticmethod
+    def _reader(bucket: str, prefix: str) -> Reader:
+        def read(name: str, offset: int = 0, length: int = 0) -> bytes:
+            return read_object(bucket, prefix + name, offset=offset, length=length)
+        return read
+
+    def write(self, bucket: str, prefix: str, data: Any, source_etag: Optional[str] = None) -> dict:
+        """
+        Store the data objects then the metadata of data under prefix
+        """
+        client = minio_client()
+        codec, meta, objects = _encode(data)
+        meta.update(version=META_VERSION, codec=codec.name, source_etag=source_etag)
+        for _name, _payload in objects:
+            client.put_object(bucket, prefix + _name, io.BytesIO(_payload), len(_payload),
+                              content_type="application/octet-stream")
+        _meta = _dumps(meta)
+        client.put_object(bucket, prefix + META_OBJECT, io.BytesIO(_meta), len(_meta),
+                          content_type="application/json")
+        return meta
+
+    def preview(self, bucket: str, prefix: str) -> Optional[dict]:
+        """
+        Metadata of the result under prefix, built from the pickle once per version of the result
+        :return: None when there is no result under prefix
+        """
+        client = minio_client()
+        try:
+            _stat = client.stat_object(bucket, prefix + RESULT_OBJECT)
+        except S3Error:
+            return None
+        try:
+            meta = json.loads(read_object(bucket, prefix + META_OBJECT))
+            if meta.get("version") == META_VERSION and meta.get("source_etag") == _stat.etag:
+                return meta
+        except S3Error:
+            pass
+        try:
+            data = pickle.loads(read_object(bucket, prefix + RESULT_OBJECT))
+        except Exception as e:
+            print(f"Serialization exception {e}: {bucket}/{prefix}")
+            data = None
+        return self.write(bucket, prefix, data, _stat.etag)
+
+    def page(self, bucket: str, prefix: str, page: int = 0) -> Optional[tuple]:
+        """
+        :return: (metadata, data of the page), None when there is no result under prefix
+        """
+        meta = self.preview(bucket, prefix)
+        if meta is None:
+            return None
+        return meta, CODECS_BY_NAME[meta["codec"]].page(self._reader(bucket, prefix), meta, page)
+
+
+result_store = ResultStore()
+
+
+def result_response(meta: dict, data_id: str) -> dict:
+    """
+    Listing entry of a result
+    """
+    _response = PythonSerializeResultResponse(type=meta["type"], frontend=meta["frontend"], data=meta["preview"],
+                                              serialize=meta["serialize"], data_schema=meta["schema"],
+                                              total=meta["total"], pages=meta["pages"],
+                                              page_size=meta["page_size"]).dict()
+    _response['id'] = data_id
+    return _response
+
+
+async def async_result_preview(bucket: str, prefix: str) -> Optional[dict]:
+    return await run_in_minio_pool(result_store.preview, bucket, prefix)
+
+
+async def async_result_page(bucket: str, prefix: str, page: int = 0) -> Optional[tuple]:
+    return await run_in_minio_pool(result_store.page, bucket, prefix, page)
+
+
+async def async_result_previews(bucket: str) -> List[dict]:
+    """
+    Listing entries of every task result of bucket, previews read concurrently
+    """
+    _prefixes = [_.object_name for _ in await async_list_objects(bucket) if _.is_dir]
+    # One result failing must not fail the listing of the others
+    _metas = await asyncio.gather(*(async_result_preview(bucket, _) for _ in _prefixes), return_exceptions=True)
+    previews = list()
+    for _prefix, _meta in zip(_prefixes, _metas):
+        if isinstance(_meta, Exception):
+            print(f"Result preview failed {_meta}: {bucket}/{_prefix}")
+        elif _meta is not None:
+            previews.append(result_response(_meta, f"{bucket}_{_prefix.replace('/', '')}"))
+    return previews
@@ -21,6 +21,7 @@ from enum import Enum
 from typing import Optional, List, Dict
 from app.schemas.dataset import DatasetV2Schema
 from app.utils.common import convert_mongo_document_to_schema
+from app.service.manager.hierarchy import delete_subtree, subtree_ids
 
 
 class FromSource(Enum):
@@ -58,21 +59,12 @@ def delete(pk: str, user: UserModel):
     _model = get_model(pk, user)
     if _model is None:
         return DataLabResponse.failed("File does not exist")
-    sons = get_sons(_model)
-    if sons:
-        # DataFileSystem.objects(id__in=sons).update(deleted=True)
-        DataFileSystem.objects(id__in=sons).delete()
+    delete_subtree(_model.id, soft=False)
     return DataLabResponse.successful()
 
 
-def get_sons(model: DataFileSystem, sons: list = []):
-    sons.append(model.id)
-    if model.is_dir:
-        son = DataFileSystem.objects(parent=model.id)
-        for i in son:
-            sons.append(i.id)
-            get_sons(i, sons)
-    return sons
+def get_sons(model: DataFileSystem):
+    return subtree_ids(model.id)
 
 
 def update(pk: str, user: UserModel, **kwargs):
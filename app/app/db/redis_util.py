@@ -0,0 +1,61 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:redis_util
+@time:2023/06/21
+
+Redis clients of the worker: one async client per logical DB and response decoding, opened at startup
+with the app.state clients, and a sync facade for the code running in worker threads.
+Every client keeps one connection pool for the life of the worker, none is built per call.
+"""
+import threading
+from typing import Dict, Tuple
+import redis
+import aioredis
+from app.core.config import settings
+
+
+class RedisRegistry:
+
+    def __init__(self):
+        self._async: Dict[Tuple[int, bool], aioredis.Redis] = dict()
+        self._sync: Dict[Tuple[int, bool], redis.Redis] = dict()
+        self._lock = threading.Lock()
+
+    def connection(self, db: int, decode_responses: bool = True) -> aioredis.Redis:
+        """
+        Async client of db, for the event loop only
+        """
+        key = (db, decode_responses)
+        client = self._async.get(key)
+        if client is None:
+            client = aioredis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=db,
+                                    encoding="utf-8", decode_responses=decode_responses)
+            self._async[key] = client
+        return client
+
+    def sync(self, db: int, decode_responses: bool = False) -> redis.Redis:
+        """
+        Blocking client of db, for the code running in worker threads, never on the event loop
+        """
+        key = (db, decode_responses)
+        with self._lock:
+            client = self._sync.get(key)
+            if client is None:
+                client = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=db,
+                                     decode_responses=decode_responses)
+                self._sync[key] = client
+        return client
+
+    async def close(self):
+        for client in self._async.values():
+            await client.connection_pool.disconnect()
+        self._async.clear()
+        with self._lock:
+            for client in self._sync.values():
+                client.connection_pool.disconnect()
+            self._sync.clear()
+
+
+redis_registry = RedisRegistry()
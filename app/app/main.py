@@ -6,7 +6,6 @@
 @time:2022/06/27
 """
 import sys
-import aioredis
 sys.path.append('..')
 
 
@@ -20,6 +19,13 @@ from app.middlewares import BearerTokenAuthBackend, on_token_auth_error, Permiss
 from app.api.api import api_router
 from app.core.config import settings
 from app.db.mongo_util import connect_mongodb, disconnect_mongodb
+from app.db.redis_util import redis_registry
+from app.utils.http_util import close_async_http_client
+from app.service.manager.lake import lake_committer
+from app.service.manager.upload import upload_pipeline
+from app.service.manager.usage import storage_usage_reconciler
+from app.service.manager.tasklog import task_log_hub
+from starlette.concurrency import run_in_threadpool
 
 
 app = FastAPI(title=settings.PROJECT_NAME)
@@ -43,29 +49,29 @@ if settings.BACKEND_CORS_ORIGINS:
 @app.on_event("startup")
 async def startup():
     connect_mongodb()
-    app.state.use_storage_cumulative = await aioredis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT,
-                                                            db=settings.USED_STORAGE_CUMULATIVE_DB,
-                                                            encoding="utf-8")
-    app.state.file_cache = await aioredis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT,
-                                                db=settings.FILE_CACHE_DB,
-                                                encoding="utf-8", decode_responses=True)
-    app.state.task_publisher = await aioredis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT,
-                                                    db=settings.TASK_PUBLISHER_DB,
-                                                    encoding="utf-8", decode_responses=True)
-    app.state.file_upload = await aioredis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT,
-                                                    db=7,
-                                                    encoding="utf-8", decode_responses=True)
-    app.state.objects_storage = await aioredis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT,
-                                                 db=2 )
+    # Every client comes from the registry: one pool per DB for the whole worker
+    app.state.use_storage_cumulative = redis_registry.connection(settings.USED_STORAGE_CUMULATIVE_DB,
+                                                                 decode_responses=False)
+    app.state.file_cache = redis_registry.connection(settings.FILE_CACHE_DB)
+    app.state.task_publisher = redis_registry.connection(settings.TASK_PUBLISHER_DB)
+    app.state.file_upload = redis_registry.connection(settings.FILE_UPLOAD_PROGRESS_DB)
+    app.state.objects_storage = redis_registry.connection(settings.VER_DATA_DB, decode_responses=False)
+    # Set to True，Is guaranteed to return dict is str，is bytes
+    app.state.auth_cache = redis_registry.connection(settings.AUTH_CACHE_DB)
+    storage_usage_reconciler.start(app.state.use_storage_cumulative)
+    task_log_hub.start(app.state.task_publisher)
 
 
 @app.on_event('shutdown')
 async def shutdown():
+    # Nothing pushed to lakeFS stays uncommitted: the running uploads are staged first, then committed
+    await run_in_threadpool(upload_pipeline.shutdown)
+    await run_in_threadpool(lake_committer.flush)
+    await storage_usage_reconciler.stop()
+    await task_log_hub.stop()
     disconnect_mongodb()
-    await app.state.use_storage_cumulative.wait_closed()
-    await app.state.file_cache.wait_closed()
-    await app.state.task_publisher.wait_closed()
-    await app.state.objects_storage.wait_closed()
+    await redis_registry.close()
+    await close_async_http_client()
 
 
 # permit middleware
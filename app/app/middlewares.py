@@ -5,8 +5,9 @@
 @module:main
 @time:2022/06/27
 """
-import aioredis
+import asyncio
 from fastapi import status
+from fastapi.concurrency import run_in_threadpool
 from jose import jwt
 from pydantic import ValidationError
 from starlette.authentication import AuthenticationBackend, AuthenticationError
@@ -16,14 +17,13 @@ from starlette.responses import JSONResponse, Response
 
 from app.core.config import settings
 from app.core.jwt import ALGORITHM
-from app.crud import crud_user
-from app.models.mongo import RoleModel
-from app.schemas import TokenPayLoadSchema
-from app.usecases.roles_usecase import flatten_role_permissions
+from app.schemas import TokenPayLoadSchema, UserInDBSchema
+from app.service.manager.permission import LIMITED_PATHS, permission_index
+from app.service.manager.principal import principal_cache
+from app.utils.common import convert_mongo_document_to_data
 from app.utils.constants import (
     CACHE_PREFIX_BearerTokenAuthBackend,
     ENDPOINTS_FOR_UNAUTHORIZED,
-    PERMISSION_MAP,
 )
 
 
@@ -64,7 +64,21 @@ class BearerTokenAuthBackend(AuthenticationBackend):
         # email
         email = token_data.email
 
-        user = crud_user.get_user_by_email(email=email)     # UserInDBSchema
+        # The user lookup and the role cache read are independent: run them together，
+        # the cache uses the connection pool created at startup
+        cache_key = f'{CACHE_PREFIX_BearerTokenAuthBackend}_{email}'
+        auth_cache = request.app.state.auth_cache
+        document, cache_role = await asyncio.gather(
+            run_in_threadpool(principal_cache.get, email),     # UserModel, shared with deps.get_current_user
+            auth_cache.hget(name=cache_key, key="role"),    # for role_id
+            return_exceptions=True
+        )
+        if isinstance(document, Exception):
+            raise document
+        user = None
+        if document is not None:
+            request.state.user = document
+            user = UserInDBSchema(**convert_mongo_document_to_data(document))
         if not user:
             raise AuthenticationError('Invalid JWT Token: user not found')
         else:
@@ -75,33 +89,20 @@ class BearerTokenAuthBackend(AuthenticationBackend):
             if not user.is_active:
                 raise AuthenticationError('The user has been logged off，Disable login')
             # Is the role updated?: Compare the current role with the cached role，If you don't agree，Force a re-login
-            try:
-                redis_conn = await aioredis.StrictRedis(host=settings.REDIS_HOST,
-                                                        port=settings.REDIS_PORT,
-                                                        db=settings.AUTH_CACHE_DB,
-                                                        encoding="utf-8",
-                                                        decode_responses=True)  # Set to True，Is guaranteed to return dict is str，is bytes
-            except Exception as e:
-                print(f"BearerTokenAuthBackend: {e}")
-
-            if redis_conn:
-                cache_key = f'{CACHE_PREFIX_BearerTokenAuthBackend}_{email}'
-                cache_role = await redis_conn.hget(name=cache_key, key="role")  # for role_id
+            if isinstance(cache_role, Exception):
+                print(f"BearerTokenAuthBackend: {cache_role}")
 
-                # cache existence
-                if cache_role:
-                    # comparison
-                    if cache_role != user.role:
-                        raise AuthenticationError('User roles have changed，Must log in again')
+            # cache existence
+            elif cache_role:
+                # comparison
+                if cache_role != user.role:
+                    raise AuthenticationError('User roles have changed，Must log in again')
 
-                # cache existence： Creating a cache
-                else:
-                    await redis_conn.hset(name=cache_key,
-                                          key="role",
-                                          value=user.role)
-
-                # Close the link
-                await redis_conn.close()
+            # cache existence： Creating a cache
+            else:
+                await auth_cache.hset(name=cache_key,
+                                      key="role",
+                                      value=user.role)
 
         #
         return authorization, user
@@ -114,108 +115,42 @@ def on_token_auth_error(request: Request, exc: Exception):
 
 # FIXME: to be registered
 class PermissionAuthMiddleware(BaseHTTPMiddleware):
+    """
+    Restricted paths (PERMISSION_MAP uris) are only let through when checked in the permissions of the user role,
+    roles without permissions restrict nothing. Checks are set lookups in the compiled RolePermissionIndex.
+    """
     async def dispatch(
         self, request: Request, call_next: RequestResponseEndpoint
     ) -> Response:
-
-        print('---------------------------------------')
-        print(f'PermissionAuthMiddleware')
-        print(f'request_path: {request.url.path}')
-
-        # login Path ignoring
-        response = await call_next(request)
-        print(f"request_path in ENDPOINTS_FOR_UNAUTHORIZED: {request.url.path in ENDPOINTS_FOR_UNAUTHORIZED}")
-        if request.url.path in ENDPOINTS_FOR_UNAUTHORIZED:
-            return response
+        # path_params are not resolved before routing, the request path is compared as is
+        request_path = request.url.path
+        # login Path ignoring, The request path is not in the restricted list，Then let it go
+        if request_path in ENDPOINTS_FOR_UNAUTHORIZED or request_path not in LIMITED_PATHS:
+            return await call_next(request)
 
         # Getting the logged-in user
-        user = request.user
-        # print(f'user: {user}')
+        user = request.scope.get("user")
+        if not getattr(user, "is_authenticated", True):
+            user = None
         if not user:
-            response = JSONResponse(status_code=status.HTTP_401_UNAUTHORIZED,
-                                    content={"msg": "failed to auth perm: no relevant user"})
-            return response
-        try:
-            # get role
-            role = user.role
-            if not role:
-                print(f'role invalid: {role}')
-                return response
-            # print(f'role type: {type(role)}')
-            # print(f'role: {role}')
-            roleModel = RoleModel.objects(id=role).first()
-            if not roleModel:
-                print(f'roleModel not exist: {role}')
-                return response
-        except Exception as e:
-            print(f"exception about role")
-            print(f"e: {e}")
-            return response
-
-        try:
-            # get permissions = flatten_role_permissions(role.permissions)
-            # get role model
-            permissions = roleModel.permissions
-            flat_permissions = flatten_role_permissions(permissions)
-            # print(f'permissions: {permissions}')
-            # print(f'flat_permissions: {flat_permissions}')
-
-            if flat_permissions is None:
-                return response
-        except Exception as e:
-            print(f"exception about permissions")
-            print(f'e: {e}')
-            return response
-
-        try:
-            # get path = request.url.path
-            request_path = request.url.path  # for /a/b/{c}?d=xx when， path Will include path_params, But not including query_params
-            # existence path_params，You strip it off
-            if request.path_params not in [None, {}]:
-                for k, v in request.path_params.items():
-                    # request_path = request_path.strip(v)
-                    request_path = request_path.replace(v, "")
-
-            print(f'request_path: {request_path}')
-
-            # Judgment path isno path_list： is，Move on to the next step； no，Return response
-            Paths_Limited = [v.get("uri") for k, v in PERMISSION_MAP.items() if v.get("uri") not in ["", None]]
-            # Flip over，Make sure the submenu is in the front； for uri long，when，Compare submenus first，The parent menu is then compared up
-            Paths_Limited.reverse()
-
-            # Judgment： isno
-            contain_path_limit = False
-            if request_path in Paths_Limited:
-                contain_path_limit = True
-            # for path_limit in Paths_Limited:
-            #     if path_limit in request_path:
-            #         contain_path_limit = True
-            #         break
-            # The request path is not in the restricted list，Then let it go
-            if contain_path_limit is False:
-                response = await call_next(request)
-                return response
-            else:
-                # The request path is in the restricted list
-                # Flip over permissions，Same reason as above（Flip over Paths_Limited）
-                flat_permissions.reverse()
-                # Filtering，Only keep checked=True
-                flat_permissions = [p for p in flat_permissions if p.get("checked") is True]
-                # traversal permissions，Judgment path existence，Release of；no，Release of
-                valid = False
-                for perm in flat_permissions:
-                    if perm.get("uri") == request_path:
-                        print(f'uri: {request_path}')
-                        valid = True
-                        break
-                print(f'permitted: {valid}')
-                if valid is True:
-                    response = await call_next(request)
-                else:
-                    response = JSONResponse(status_code=status.HTTP_403_FORBIDDEN,
-                                            content={
-                                                "msg": f"forbidden to access this request path: {request.method} {request_path}"})
-                return response
-        except Exception as e:
-            print(f"e: {e}")
-            return response
+            return JSONResponse(status_code=status.HTTP_401_UNAUTHORIZED,
+                                content={"msg": "failed to auth perm: no relevant user"})
+        # get role
+        role = getattr(user, "role", None)
+        if not role:
+            print(f'role invalid: {role}')
+            return await call_next(request)
+
+        found, permitted_paths = permission_index.cached(role)
+        if not found:
+            try:
+                permitted_paths = await run_in_threadpool(permission_index.load, role)
+            except Exception as e:
+                print(f"exception about permissions")
+                print(f'e: {e}')
+                return await call_next(request)
+        if permitted_paths is None or request_path in permitted_paths:
+            return await call_next(request)
+        return JSONResponse(status_code=status.HTTP_403_FORBIDDEN,
+                            content={
+                                "msg": f"forbidden to access this request path: {request.method} {request_path}"})
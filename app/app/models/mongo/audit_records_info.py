@@ -40,6 +40,14 @@ class AuditRecordsModel(Document):
     audit_type = StringField(required=True, default="Components")
     audit_status = BooleanField(required=True, default=False)
     apply_nums = IntField()
+    meta = {
+        "index_background": True,
+        "indexes": [
+            ("applicant", "audit_type", "audit_status"),
+            ("audit_type", "audit_status"),
+            "audit_result",
+        ]
+    }
 
 
 class AuditMessageModel(Document):
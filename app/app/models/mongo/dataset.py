@@ -70,3 +70,25 @@ class DataFileSystem(Document):
     task_id = StringField()
     public = StringField()
     public_at = DateTimeField()
+    # Ids of every directory above the row, outermost first: a subtree is {"ancestors": id} whatever its depth
+    ancestors = ListField(StringField())
+    # Built in the background by scripts/create_indexes.py, query shapes of api/center/storage.py and components.py
+    meta = {
+        "index_background": True,
+        "indexes": [
+            ("user", "deps", "deleted", "-created_at"),
+            ("parent", "user", "deleted"),
+            ("data_path", "-updated_at"),
+            ("lab_id", "task_id", "deps"),
+            ("from_user", "deps"),
+            "ancestors",
+        ]
+    }
+
+    def clean(self):
+        # Keep ancestors in step with parent for every save(), bulk writers set both themselves
+        if self.parent in (None, "root"):
+            self.ancestors = []
+        elif not self.ancestors or self.ancestors[-1] != self.parent:
+            _parent = DataFileSystem.objects(id=self.parent).only("ancestors").as_pymongo().first()
+            self.ancestors = [] if _parent is None else _parent.get("ancestors", []) + [self.parent]
@@ -66,3 +66,21 @@ class PublicDataFileModel(Document):
     uploading = BooleanField(default=False)
     parent = StringField(default="root")
     deps = IntField(required=True)
+    meta = {
+        "index_background": True,
+        "indexes": [
+            ("datasets", "deps", "name"),
+            ("data_path", "-updated_at"),
+        ]
+    }
+
+
+class PublicDatasetStatsModel(Document):
+    # Counts of the files of a public dataset, files of its nested datasets included,
+    # kept up to date on file add and remove by service/manager/datasets.PublicDatasetStats
+    id = StringField(required=True, primary_key=True)
+    files = IntField(default=0)
+    data_size = IntField(default=0)
+    # Creation time of the oldest file
+    created_at = DateTimeField()
+    updated_at = DateTimeField(default=datetime.utcnow)
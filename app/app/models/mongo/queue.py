@@ -43,6 +43,8 @@ class TaskQueueModel(Document):
     end_at = DateTimeField(default=datetime.utcnow())
     event = GenericReferenceField(choices=[ToolTaskModel, ExperimentModel, AnalysisModel2])
     task_id = StringField(required=True)
+    # Identity of the computation in redis, differs from task_id for the steps of an analysis
+    compute_task_id = StringField()
     user = ReferenceField(UserModel)
     resources = ReferenceField(TaskResourceModel)
     component = ReferenceField(XmlToolSourceModel)
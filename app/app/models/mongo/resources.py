@@ -137,6 +137,16 @@ class UserQuotaStatementModel(Document):
                                   )
     remark = StringField()
     serial_number = StringField()
+    # utils/statement.py filters by type or user and always sorts by occurrence_time
+    meta = {
+        "index_background": True,
+        "indexes": [
+            ("statement_type", "-occurrence_time"),
+            ("user", "-occurrence_time"),
+            "-occurrence_time",
+            "serial_number",
+        ]
+    }
 
 
 class PlatformResourceModel(Document):
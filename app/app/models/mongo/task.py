@@ -31,3 +31,10 @@ class ToolTaskModel(Document):
     status = StringField()  # Success, Error, Pending
     created_at = DateTimeField(default=datetime.utcnow)
     updated_at = DateTimeField(default=datetime.utcnow)
+    meta = {
+        "index_background": True,
+        "indexes": [
+            ("experiment", "status"),
+            ("user", "-created_at"),
+        ]
+    }
@@ -0,0 +1,150 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:dag
+@time:2023/06/06
+"""
+import json
+from typing import Optional
+import redis
+from app.core.config import settings
+from app.db.redis_util import redis_registry
+from app.core.flow.flow import DAG
+from app.core.flow.loader import DAGLoader, reference_id
+from app.models.mongo import DataFileSystem, ToolTaskModel, XmlToolSourceModel
+from app.models.mongo.public_data import PublicDataFileModel
+
+# Marks a fragments hash built from the whole experiment, a hash without it only holds incremental writes
+FRAGMENTS_BUILT = "__built__"
+
+
+def _redis_con() -> redis.Redis:
+    return redis_registry.sync(settings.DAG_CACHE_DB, decode_responses=True)
+
+
+class DAGCacheManager:
+    """
+    Experiment graph cached in redis:
+        {experiments_id}-dag-version     version counter, increased on every task change
+        {experiments_id}-dag-fragments   task id -> the task and the metadata it references, no mongo is needed to
+                                         assemble the graph from them
+        {experiments_id}-dag             the assembled front graph and the version it was assembled at
+    A task change only rewrites the fragment of that task, the graph is assembled again on the next read.
+    """
+
+    @staticmethod
+    def _keys(experiments_id: str):
+        return f"{experiments_id}-dag-version", f"{experiments_id}-dag-fragments", f"{experiments_id}-dag"
+
+    @staticmethod
+    def fragment(task: ToolTaskModel, loader: DAGLoader) -> str:
+        file_ids, public_file_ids = DAGLoader.input_ids(task.inputs)
+        tool = loader.tool(task)
+        files = dict()
+        for _id in file_ids:
+            _file = loader.file(_id)
+            files[_id] = None if _file is None else {"_id": _file.id, "name": _file.name, "lab_id": _file.lab_id}
+        public_files = dict()
+        for _id in public_file_ids:
+            _file = loader.public_file(_id)
+            public_files[_id] = None if _file is None else {"_id": _file.id}
+        return json.dumps({
+            "task": {"_id": task.id, "name": task.name, "tool": reference_id(task, 'tool'), "status": task.status,
+                     "inputs": task.inputs, "outputs": task.outputs},
+            "tool": None if tool is None else {"_id": tool.id, "name": tool.name},
+            "files": files,
+            "public_files": public_files,
+            "created_at": task.created_at.timestamp() if task.created_at else 0
+        }, ensure_ascii=False, default=str)
+
+    @staticmethod
+    def restore(fragments: list) -> (list, DAGLoader):
+        """
+        Rebuild the tasks and a filled loader from the fragments, in creation order
+        """
+        loader = DAGLoader()
+        tasks = list()
+        for _fragment in sorted(fragments, key=lambda x: x['created_at']):
+            _task = ToolTaskModel._from_son(_fragment['task'])
+            tasks.append(_task)
+            loader.tasks[_task.id] = _task
+            _tool = _fragment['tool']
+            loader.tools[reference_id(_task, 'tool')] = None if _tool is None else XmlToolSourceModel._from_son(_tool)
+            for _id, _file in _fragment['files'].items():
+                loader.files[_id] = None if _file is None else DataFileSystem._from_son(_file)
+            for _id, _file in _fragment['public_files'].items():
+                loader.public_files[_id] = None if _file is None else PublicDataFileModel._from_son(_file)
+        return tasks, loader
+
+    @staticmethod
+    def _build(experiments_id: str, con: redis.Redis) -> dict:
+        """
+        Fragments of every succeeded task of the experiment, written unless a task changed meanwhile
+        """
+        version_key, fragments_key, _ = DAGCacheManager._keys(experiments_id)
+        with con.pipeline() as pipe:
+            pipe.watch(version_key, fragments_key)
+            tasks = list(ToolTaskModel.objects(experiment=experiments_id, status="Success"))
+            loader = DAGLoader().add_tasks(tasks)
+            for _task in tasks:
+                loader.add_inputs(_task.inputs)
+            loader.load()
+            fragments = {_task.id: DAGCacheManager.fragment(_task, loader) for _task in tasks}
+            fragments[FRAGMENTS_BUILT] = "1"
+            pipe.multi()
+            pipe.delete(fragments_key)
+            pipe.hset(fragments_key, mapping=fragments)
+            try:
+                pipe.execute()
+            except redis.WatchError:
+                pass
+        return fragments
+
+    @staticmethod
+    def graph(experiments_id: str) -> list:
+        """
+        Front graph of the experiment, only assembled again when a task changed since the last read
+        """
+        con = _redis_con()
+        version_key, fragments_key, dag_key = DAGCacheManager._keys(experiments_id)
+        with con.pipeline(transaction=False) as pipe:
+            pipe.get(version_key)
+            pipe.hmget(dag_key, "version", "graph")
+            version, (cached_version, cached_graph) = pipe.execute()
+        version = version or "0"
+        if cached_graph is not None and cached_version == version:
+            return json.loads(cached_graph)
+        fragments = con.hgetall(fragments_key)
+        if FRAGMENTS_BUILT not in fragments:
+            fragments = DAGCacheManager._build(experiments_id, con)
+        fragments.pop(FRAGMENTS_BUILT, None)
+        tasks, loader = DAGCacheManager.restore([json.loads(_) for _ in fragments.values()])
+        _dag = DAG(experiments_id, loader=loader)
+        _dag.from_experiments(tasks)
+        graph = _dag.front_graph()
+        con.hset(dag_key, mapping={"version": version, "graph": json.dumps(graph, ensure_ascii=False)})
+        return graph
+
+    @staticmethod
+    def refresh_task(task_id: str, experiments_id: Optional[str] = None):
+        """
+        Rewrite the fragment of a created, updated or deleted task and invalidate the assembled graph
+        :param task_id: ToolTaskModel id
+        :param experiments_id: required when the task was deleted
+        """
+        task = ToolTaskModel.objects(id=task_id).first()
+        if task is not None:
+            experiments_id = reference_id(task, 'experiment')
+        if experiments_id is None:
+            return
+        version_key, fragments_key, _ = DAGCacheManager._keys(experiments_id)
+        con = _redis_con()
+        with con.pipeline() as pipe:
+            if task is not None and task.status == "Success":
+                loader = DAGLoader().add_tasks([task]).add_inputs(task.inputs).load()
+                pipe.hset(fragments_key, task_id, DAGCacheManager.fragment(task, loader))
+            else:
+                pipe.hdel(fragments_key, task_id)
+            pipe.incr(version_key)
+            pipe.execute()
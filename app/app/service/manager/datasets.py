@@ -13,9 +13,10 @@ from app.utils.middleware_util import get_s3_client
 from app.models.mongo.public_data import \
     PublicDatasetModel,\
     PublicDataFileModel,\
-    PublicDatasetOptionModel
+    PublicDatasetOptionModel,\
+    PublicDatasetStatsModel
 from app.schemas.dataset import DatasetsListResponseSchema
-from typing import List, Dict, AnyStr
+from typing import List, Dict, AnyStr, Iterable, Optional, Tuple
 
 
 class DatasetsManager:
@@ -76,3 +77,103 @@ class DatasetsManager:
                                   oss_client.list_objects(_datasets_model.id, recursive=True)]
             for _ in object_delete_list:
                 pass
+
+
+class PublicDatasetStats:
+    """
+    Per dataset file counts and sizes, moved on every file add and remove instead of being recounted
+    on every listing. A dataset without stats yet is recounted by the database once.
+    Files of a nested dataset (a PublicDataFileModel with file_extension "datasets") count for its dataset.
+    """
+
+    @staticmethod
+    def recount(datasets_id: Iterable[str]) -> Dict[str, dict]:
+        datasets_id = list(datasets_id)
+        stats = {_: {"files": 0, "data_size": 0, "created_at": None} for _ in datasets_id}
+        collection = PublicDataFileModel._get_collection()
+        nested = dict()
+        for _ in collection.find({"datasets": {"$in": datasets_id}, "file_extension": "datasets"},
+                                 {"datasets": 1, "created_at": 1}):
+            nested[_["_id"]] = _["datasets"]
+            _min = stats[_["datasets"]]["created_at"]
+            if _.get("created_at") and (_min is None or _["created_at"] < _min):
+                stats[_["datasets"]]["created_at"] = _["created_at"]
+        _counts = collection.aggregate([
+            {"$match": {"datasets": {"$in": datasets_id + list(nested)}, "file_extension": {"$ne": "datasets"}}},
+            {"$group": {"_id": "$datasets", "files": {"$sum": 1}, "data_size": {"$sum": "$data_size"},
+                        "created_at": {"$min": "$created_at"}}},
+        ])
+        for _ in _counts:
+            _stats = stats[nested.get(_["_id"], _["_id"])]
+            _stats["files"] += _["files"]
+            _stats["data_size"] += _["data_size"] or 0
+            if _["created_at"] and (_stats["created_at"] is None or _["created_at"] < _stats["created_at"]):
+                _stats["created_at"] = _["created_at"]
+        return stats
+
+    @classmethod
+    def refresh(cls, datasets_id: Iterable[str]) -> Dict[str, dict]:
+        stats = cls.recount(datasets_id)
+        now = datetime.datetime.utcnow()
+        for _id, _stats in stats.items():
+            PublicDatasetStatsModel._get_collection().update_one(
+                {"_id": _id}, {"$set": {**_stats, "updated_at": now}}, upsert=True)
+        return stats
+
+    @staticmethod
+    def owner(datasets_id: str) -> str:
+        """
+        Public dataset counting the files of datasets_id
+        """
+        _nested = PublicDataFileModel.objects(id=datasets_id, file_extension="datasets").only("datasets") \
+            .as_pymongo().first()
+        return datasets_id if _nested is None else _nested["datasets"]
+
+    @classmethod
+    def record(cls, datasets_id: str, files: int, data_size: int, created_at: Optional[datetime.datetime] = None):
+        """
+        Call after the file rows were written or removed
+        :param datasets_id: public dataset or nested dataset of the files
+        """
+        _owner = cls.owner(datasets_id)
+        _update = {"$inc": {"files": files, "data_size": data_size or 0},
+                   "$set": {"updated_at": datetime.datetime.utcnow()}}
+        if created_at is not None:
+            _update["$min"] = {"created_at": created_at}
+        if PublicDatasetStatsModel._get_collection().update_one({"_id": _owner}, _update).matched_count == 0:
+            # First change since the stats exist: the recount already sees the written rows
+            cls.refresh([_owner])
+
+    @classmethod
+    def removed(cls, model: PublicDataFileModel):
+        _datasets = model.to_mongo().get("datasets")
+        if model.file_extension == "datasets":
+            # Its files no longer count for the dataset
+            cls.refresh([_datasets])
+        else:
+            cls.record(_datasets, -1, -(model.data_size or 0))
+
+    @classmethod
+    def page(cls, queryset, skip: int, limit: int) -> Tuple[List[Tuple[PublicDatasetModel, dict]], int]:
+        """
+        One page of public datasets, newest first, with their stats: paginated and joined by the database
+        :return: [(dataset, stats)], total
+        """
+        _result = next(PublicDatasetModel._get_collection().aggregate([
+            {"$match": queryset._query},
+            {"$sort": {"updated_at": -1, "_id": 1}},
+            {"$facet": {
+                "total": [{"$count": "count"}],
+                "data": [{"$skip": skip}, {"$limit": limit},
+                         {"$lookup": {"from": PublicDatasetStatsModel._get_collection_name(),
+                                      "localField": "_id", "foreignField": "_id", "as": "_stats"}}],
+            }},
+        ]))
+        rows = _result["data"]
+        missing = [_["_id"] for _ in rows if not _["_stats"]]
+        refreshed = cls.refresh(missing) if missing else dict()
+        data = list()
+        for _row in rows:
+            _stats = _row.pop("_stats")
+            data.append((PublicDatasetModel._from_son(_row), _stats[0] if _stats else refreshed[_row["_id"]]))
+        return data, _result["total"][0]["count"] if _result["total"] else 0
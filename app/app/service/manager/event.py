@@ -8,15 +8,15 @@
 import sys
 from aioredis import Redis
 sys.path.append('/Users/wuzhaochen/Desktop/workspace/datalab/app')
-import requests
 from datetime import datetime
 from pydantic import BaseModel
 from typing import Any, Optional, Union, List
 from mongoengine.errors import MongoEngineException
 from app.core.config import settings
 from app.service.manager.task import ComputeTaskManager
+from app.service.manager.tasklog import append_log, log_stream
 from app.utils.common import generate_uuid
-from app.utils.middleware_util import get_redis_con
+from app.utils.http_util import async_post
 from app.models.mongo.public_data import PublicDatasetModel, PublicDataFileModel
 from app.models.mongo import UserModel, TaskQueueModel, XmlToolSourceModel, DataFileSystem, ComponentInstance, ToolTaskModel
 from app.models.mongo import AnalysisModel2
@@ -362,16 +362,16 @@ class EventManager:
             _event = ToolTaskModel.objects(id=self._id).first()
             if _event is None:
                 _event = AnalysisModel2.objects(id=self._parent_id).first()
-            _task_queue_id = ComputeTaskManager.add_task(_event, self._operator.id)
+            _task_queue_id = ComputeTaskManager.add_task(_event, self._operator.id, compute_task_id=self._id)
             print(self.function_params)
-            res = requests.post(self.asynchronous_uri,
-                                json=self.function_params,
-                                headers={"X-Callback-Url": f"http://{settings.SERVER_HOST}/api/components/callback/{_task_queue_id}"}
-                                )
-            keys = [self._id, f"{self._id}-task", f"{self._id}-resource"]
+            res = await async_post(self.asynchronous_uri,
+                                   json=self.function_params,
+                                   headers={"X-Callback-Url": f"http://{settings.SERVER_HOST}/api/components/callback/{_task_queue_id}"}
+                                   )
+            keys = [self._id, log_stream(self._id), f"{self._id}-task", f"{self._id}-resource"]
             await conn.delete(*keys)
             await conn.set(self._id + '-task', "Start")
-            await conn.lpush(self._id, "==== DataLab Start Function ====")
+            await append_log(conn, self._id, "==== DataLab Start Function ====")
             print(res.status_code, self.asynchronous_uri)
             if res.status_code != 202:
                 raise ModuleNotFoundError(f"|{self._model.folder_name}| is not found")
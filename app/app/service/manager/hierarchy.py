@@ -0,0 +1,177 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:hierarchy
+@time:2023/06/14
+
+Subtree operations of DataFileSystem on the materialized ancestors: one indexed query
+and at most one bulk write per operation, whatever the depth of the tree.
+The calculated output data is registered by the function runtime without ancestors,
+below a directory of that kind the rows of the same task are matched by an anchored path prefix as well.
+"""
+import re
+from functools import reduce
+from typing import Dict, Iterable, List, Optional, Union
+from mongoengine import Q
+from pymongo import UpdateMany, UpdateOne
+from app.models.mongo import DataFileSystem
+from app.utils.common import generate_uuid
+
+BATCH_SIZE = 1000
+
+
+def _ids(ids: Union[str, Iterable[str]]) -> List[str]:
+    return [ids] if isinstance(ids, str) else list(ids)
+
+
+def path_prefix(data_path: str):
+    """
+    data_path and the paths below it, not its siblings sharing the prefix: /out/res and not /out/res2
+    """
+    return re.compile(f"^{re.escape(data_path.rstrip('/'))}(/|$)")
+
+
+def subtree(ids: Union[str, Iterable[str]], **filters):
+    """
+    Rows of ids and of everything below them
+    """
+    ids = _ids(ids)
+    matchers = [Q(id__in=ids), Q(ancestors__in=ids)]
+    for _root in DataFileSystem.objects(id__in=ids, data_type__ne="myData").only(
+            "lab_id", "task_id", "data_path").as_pymongo():
+        if _root.get("data_path"):
+            matchers.append(Q(lab_id=_root.get("lab_id"), task_id=_root.get("task_id"),
+                              data_path=path_prefix(_root["data_path"])))
+    return DataFileSystem.objects(reduce(lambda a, b: a | b, matchers), **filters)
+
+
+def subtree_ids(ids: Union[str, Iterable[str]], **filters) -> List[str]:
+    return [_["_id"] for _ in subtree(ids, **filters).only("id").as_pymongo()]
+
+
+def delete_subtree(ids: Union[str, Iterable[str]], soft: bool = True, **filters) -> int:
+    """
+    :param soft: flag the rows as deleted instead of removing them
+    :return: rows deleted
+    """
+    if soft:
+        return subtree(ids, **filters).update(deleted=True)
+    return subtree(ids, **filters).delete()
+
+
+def subtree_size(ids: Union[str, Iterable[str]], **filters) -> int:
+    """
+    Total size of the files below ids, computed by the database
+    """
+    _result = list(subtree(ids, is_file=True, **filters).aggregate([
+        {"$group": {"_id": None, "size": {"$sum": "$data_size"}}}
+    ]))
+    return _result[0]["size"] if _result else 0
+
+
+def copy_subtree(model: DataFileSystem, parent: Optional[str] = None, origin_field: Optional[str] = None,
+                 **fields) -> Dict[str, str]:
+    """
+    Copy model and everything below it with new ids, fields override the copied values.
+    :param parent: parent of the copied root, the parent of model when None
+    :param origin_field: field receiving the id of the original row
+    :return: {original id: copy id}
+    """
+    rows = list(subtree(model.id, deleted=False).as_pymongo())
+    old2new = {_["_id"]: generate_uuid() for _ in rows}
+    parents = {_["_id"]: _.get("parent") for _ in rows}
+
+    def _below(pk: str) -> List[str]:
+        # Copied ancestors of a row, from its parent links: rows of the runtime have no ancestors
+        chain, _parent = list(), parents.get(pk)
+        while _parent in parents and _parent != model.id and _parent not in chain:
+            chain.append(_parent)
+            _parent = parents.get(_parent)
+        return [model.id] + list(reversed(chain))
+    # Ancestors above the copied root are not part of the copy
+    if parent is None:
+        parent, _prefix = model.parent, list(model.ancestors)
+    elif parent == "root":
+        _prefix = []
+    else:
+        _prefix = DataFileSystem.objects(id=parent).only("ancestors").as_pymongo().first().get("ancestors", []) + \
+            [parent]
+    copies = list()
+    for _row in rows:
+        if _row["_id"] == model.id:
+            _row["parent"], _row["ancestors"] = parent, _prefix
+        else:
+            _ancestors = _below(_row["_id"])
+            # A row whose parent is not part of the copy hangs from the copied root
+            _row["parent"] = old2new[_ancestors[-1]]
+            _row["ancestors"] = _prefix + [old2new[_] for _ in _ancestors]
+        if origin_field is not None:
+            _row[origin_field] = _row["_id"]
+        _row["_id"] = old2new[_row["_id"]]
+        _row.update(fields)
+        copies.append(_row)
+    collection = DataFileSystem._get_collection()
+    for i in range(0, len(copies), BATCH_SIZE):
+        collection.insert_many(copies[i:i + BATCH_SIZE], ordered=False)
+    return old2new
+
+
+def move_subtree(model: DataFileSystem, parent: str, data_path: Optional[str] = None):
+    """
+    Attach model to another parent, its descendants follow in the same bulk write.
+    Moving the files themselves is up to the caller.
+    :param data_path: new data_path of model, the data_path of the descendants is rebased on it
+    """
+    _prefix = [] if parent == "root" else \
+        DataFileSystem.objects(id=parent).only("ancestors").as_pymongo().first().get("ancestors", []) + [parent]
+    _old = list(model.ancestors)
+    _deps = len(_prefix) - len(_old)
+    _set_descendants = {
+        # Descendants keep what lies below model in their ancestors: the last size - len(_old) ids
+        "ancestors": {"$concatArrays": [_prefix, {"$slice": ["$ancestors",
+                                                             {"$subtract": [len(_old), {"$size": "$ancestors"}]}]}]},
+        "deps": {"$add": ["$deps", _deps]},
+    }
+    _set_model = {"parent": parent, "ancestors": _prefix, "deps": model.deps + _deps}
+    if data_path is not None:
+        _set_model.update(data_path=data_path, store_name=data_path)
+        _rebased = {"$concat": [data_path, {"$substrCP": ["$data_path", len(model.data_path),
+                                                          {"$strLenCP": "$data_path"}]}]}
+        _set_descendants.update(data_path=_rebased, store_name=_rebased)
+    DataFileSystem._get_collection().bulk_write([
+        UpdateOne({"_id": model.id}, {"$set": _set_model}),
+        UpdateMany({"ancestors": model.id}, [{"$set": _set_descendants}]),
+    ], ordered=True)
+
+
+def rebuild_ancestors(batch_size: int = BATCH_SIZE, **filters) -> int:
+    """
+    Recompute the ancestors of every row from the parent links, rows written before ancestors existed
+    :return: rows updated
+    """
+    parents = {_["_id"]: _.get("parent") for _ in DataFileSystem.objects(**filters).only("id", "parent").as_pymongo()}
+    ancestors = dict()
+
+    def _ancestors(pk: str) -> List[str]:
+        # Iterative: a corrupted parent chain must neither recurse without end nor loop
+        chain, seen = list(), {pk}
+        _parent = parents.get(pk)
+        while _parent not in (None, "root") and _parent not in seen:
+            if _parent in ancestors:
+                chain.extend(reversed(ancestors[_parent] + [_parent]))
+                break
+            seen.add(_parent)
+            chain.append(_parent)
+            _parent = parents.get(_parent) if _parent in parents else \
+                (DataFileSystem.objects(id=_parent).only("parent").as_pymongo().first() or {}).get("parent")
+        return list(reversed(chain))
+
+    operations = list()
+    for pk in parents:
+        ancestors[pk] = _ancestors(pk)
+        operations.append(UpdateOne({"_id": pk}, {"$set": {"ancestors": ancestors[pk]}}))
+    collection = DataFileSystem._get_collection()
+    for i in range(0, len(operations), batch_size):
+        collection.bulk_write(operations[i:i + batch_size], ordered=False)
+    return len(operations)
@@ -0,0 +1,162 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:ingest
+@time:2023/06/13
+
+Bulk ingestion of a directory tree into DataFileSystem: one os.scandir walk, parent links, depths and
+directory sizes computed in memory, existing rows looked up by data_path in batches and every row written
+with bulk upserts. Ingesting the same tree again updates the same rows.
+"""
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from pymongo import UpdateOne
+from app.models.mongo import DataFileSystem
+from app.utils.common import generate_uuid
+
+BATCH_SIZE = 1000
+
+
+def scan_tree(root: str) -> List[dict]:
+    """
+    Every entry of the tree, root first and every directory before its content.
+    Directory sizes are the sum of the files below them, symbolic links are not followed.
+    """
+    root = os.path.normpath(str(root))
+    root_entry = {"path": root, "name": os.path.basename(root.rstrip('/')), "is_dir": os.path.isdir(root),
+                  "size": 0, "parent": None}
+    if not root_entry["is_dir"]:
+        root_entry["size"] = os.path.getsize(root)
+        return [root_entry]
+    entries = [root_entry]
+    stack = [root_entry]
+    while stack:
+        _dir = stack.pop()
+        with os.scandir(_dir["path"]) as it:
+            for _entry in it:
+                is_dir = _entry.is_dir(follow_symlinks=False)
+                item = {"path": _entry.path, "name": _entry.name, "is_dir": is_dir,
+                        "size": 0 if is_dir else _entry.stat(follow_symlinks=False).st_size, "parent": _dir}
+                entries.append(item)
+                if is_dir:
+                    stack.append(item)
+    # Children always come after their parent: one reversed pass aggregates the sizes bottom-up
+    for item in reversed(entries):
+        if item["parent"] is not None:
+            item["parent"]["size"] += item["size"]
+    return entries
+
+
+def existing_ids(data_paths: Iterable[str], user_id: str, batch_size: int = BATCH_SIZE) -> Dict[str, str]:
+    """
+    data_path -> id of the latest row of the user, one query per batch of paths
+    """
+    ids = dict()
+    data_paths = list(data_paths)
+    for i in range(0, len(data_paths), batch_size):
+        _rows = DataFileSystem.objects(data_path__in=data_paths[i:i + batch_size], user=user_id) \
+            .order_by("-updated_at").only("id", "data_path").as_pymongo()
+        for _row in _rows:
+            ids.setdefault(_row["data_path"], _row["_id"])
+    return ids
+
+
+class TreeIngestor:
+    """
+    Rows of the files and directories below standard_prefix, deps and parent follow StorageManager.save_file:
+    the entries directly under standard_prefix have deps 0 and parent "root".
+    """
+
+    def __init__(self, standard_prefix: str, user_id: str, from_source: str = "UPLOADED", data_type: str = "myData",
+                 storage_service: str = "ext4", batch_size: int = BATCH_SIZE):
+        self.standard_prefix = Path(standard_prefix)
+        self.user_id = user_id
+        self.from_source = from_source
+        self.data_type = data_type
+        self.storage_service = storage_service
+        self.batch_size = batch_size
+
+    def _deps(self, path: str) -> int:
+        return len(Path(path).relative_to(self.standard_prefix).parts) - 1
+
+    def _row(self, path: str, name: str, is_dir: bool, size: int, ancestors: List[str], now: datetime) -> dict:
+        return {
+            "name": name,
+            "is_file": not is_dir,
+            "is_dir": is_dir,
+            "store_name": path,
+            "data_size": size,
+            "data_path": path,
+            "user": self.user_id,
+            "from_source": self.from_source,
+            "deleted": False,
+            "updated_at": now,
+            "data_type": self.data_type,
+            "storage_service": self.storage_service,
+            "file_extension": "" if is_dir else Path(name).suffix[1:],
+            "deps": self._deps(path),
+            "parent": ancestors[-1] if ancestors else "root",
+            "ancestors": ancestors,
+        }
+
+    def _write(self, operations: List[UpdateOne]):
+        collection = DataFileSystem._get_collection()
+        for i in range(0, len(operations), self.batch_size):
+            collection.bulk_write(operations[i:i + self.batch_size], ordered=False)
+
+    def ancestors(self, path: str) -> List[str]:
+        """
+        Directories between standard_prefix and path, outermost first
+        """
+        _relative = Path(path).relative_to(self.standard_prefix)
+        return [str(self.standard_prefix.joinpath(*_relative.parts[:i])) for i in range(1, len(_relative.parts))]
+
+    def ensure_ancestors(self, path: str, ids: Optional[Dict[str, str]] = None) -> List[str]:
+        """
+        Create the missing directory rows above path, restore the deleted ones.
+        :return: ids of the directories above path, outermost first
+        """
+        _ancestors = self.ancestors(path)
+        if ids is None:
+            ids = existing_ids(_ancestors, self.user_id, self.batch_size)
+        now = datetime.now()
+        chain = list()
+        operations = list()
+        for _path in _ancestors:
+            _id = ids.get(_path) or generate_uuid()
+            ids[_path] = _id
+            _row = self._row(_path, Path(_path).name, True, 0, list(chain), now)
+            _row["created_at"] = now
+            # The size of an existing directory is kept, only its place in the tree and its deleted flag change
+            _set = {k: _row.pop(k) for k in ("deleted", "parent", "ancestors")}
+            operations.append(UpdateOne({"_id": _id}, {"$set": _set, "$setOnInsert": _row}, upsert=True))
+            chain.append(_id)
+        if operations:
+            self._write(operations)
+        return chain
+
+    def ingest(self, root: str) -> dict:
+        """
+        Upsert the rows of root and of everything below it
+        :return: {"id": row id of root, "size": total size, "files": file count, "dirs": directory count}
+        """
+        entries = scan_tree(root)
+        _ancestors = self.ancestors(entries[0]["path"])
+        ids = existing_ids(_ancestors + [_["path"] for _ in entries], self.user_id, self.batch_size)
+        chain = self.ensure_ancestors(entries[0]["path"], ids)
+        now = datetime.now()
+        operations = list()
+        for _entry in entries:
+            _id = ids.get(_entry["path"]) or generate_uuid()
+            _entry["id"] = _id
+            _parent = _entry["parent"]
+            _entry["ancestors"] = chain if _parent is None else _parent["ancestors"] + [_parent["id"]]
+            _row = self._row(_entry["path"], _entry["name"], _entry["is_dir"], _entry["size"], _entry["ancestors"], now)
+            operations.append(UpdateOne({"_id": _id}, {"$set": _row, "$setOnInsert": {"created_at": now}},
+                                        upsert=True))
+        self._write(operations)
+        files = sum(1 for _ in entries if not _["is_dir"])
+        return {"id": entries[0]["id"], "size": entries[0]["size"], "files": files, "dirs": len(entries) - files}
@@ -7,26 +7,45 @@
 """
 import sys
 sys.path.append('/Users/wuzhaochen/Desktop/workspace/datalab/app')
-import zipfile
-from io import BytesIO
-from typing import Optional
+import os
+import time
+import threading
+from functools import partial
+from typing import Dict, Optional, Tuple
 from urllib.parse import quote
 from app.core.config import settings
 from app.models.mongo import UserModel, ExperimentModel, AnalysisModel2, TaskQueueModel, DataFileSystem
+from app.storage.compress_file import CHUNK_SIZE, iter_zip
 from datetime import datetime
+from minio import Minio
 from lakefs_client import models, Configuration
 from lakefs_client.client import LakeFSClient
 from lakefs_client.exceptions import NotFoundException, ApiException, ServiceException
 
 
 class DataLakeManager:
+    # One client and connection pool for the process, the managers are created per call
+    _client: Optional[LakeFSClient] = None
+    _client_lock = threading.Lock()
+    # repository -> time its existence was last confirmed
+    _repositories: Dict[str, float] = dict()
+
     def __init__(self):
         self._repository = None
-        self.configuration = Configuration()
-        self.configuration.username = settings.LAKE_ADMIN_USERNAME
-        self.configuration.password = settings.LAKE_ADMIN_TOKEN
-        self.configuration.host = settings.LAKE_ADMIN_URL
-        self.client = LakeFSClient(self.configuration)
+        self.client = self.shared_client()
+        self.configuration = self.client._api.configuration
+
+    @classmethod
+    def shared_client(cls) -> LakeFSClient:
+        with cls._client_lock:
+            if cls._client is None:
+                configuration = Configuration()
+                configuration.username = settings.LAKE_ADMIN_USERNAME
+                configuration.password = settings.LAKE_ADMIN_TOKEN
+                configuration.host = settings.LAKE_ADMIN_URL
+                configuration.connection_pool_maxsize = settings.LAKE_CONNECTION_POOL_SIZE
+                cls._client = LakeFSClient(configuration)
+            return cls._client
 
     def list_branches(self, branches: str = "quickstart", results: bool = True):
         try:
@@ -46,17 +65,36 @@ class DataLakeManager:
                                                source=source)
                                            )
 
-    def put(self, abstract_path: str, storage_path: str, repository: str, branch: str = "main"):
+    def put(self, abstract_path: str, storage_path: str, repository: str, branch: str = "main", commit: bool = True):
         print(abstract_path)
         print(repository)
-        if not self.repository_exits(repository):
-            self.create_repo(repository)
         with open(abstract_path, 'rb') as f:
+            return self.put_stream(f, os.path.getsize(abstract_path), storage_path, repository, branch, commit=commit)
+
+    def put_stream(self, stream, length: int, storage_path: str, repository: str, branch: str = "main",
+                   commit: bool = True):
+        """
+        Upload from a readable stream: through the S3 gateway in parts when LAKE_S3_GATEWAY is set,
+        otherwise through the API which reads the whole stream first
+        :param commit: commit right after the upload, otherwise the object stays staged on the branch
+                       until lake_committer commits the batch it belongs to
+        """
+        self.ensure_repository(repository)
+        if settings.LAKE_S3_GATEWAY:
+            gateway = Minio(settings.LAKE_S3_GATEWAY,
+                            access_key=settings.LAKE_ADMIN_USERNAME,
+                            secret_key=settings.LAKE_ADMIN_TOKEN,
+                            secure=settings.LAKE_ADMIN_URL.startswith("https"))
+            gateway.put_object(repository, f"{branch}/{storage_path}", stream, length,
+                               part_size=settings.UPLOAD_PART_SIZE, num_parallel_uploads=settings.UPLOAD_PARALLEL_PARTS)
+        else:
             self.client.objects.upload_object(
                 repository=repository,
                 branch=branch,
                 path=storage_path,
-                content=f)
+                content=stream)
+        if not commit:
+            return True, None
         try:
             commit_id = self.commit(repository, branch, msg=f"{str(datetime.utcnow())}", metadata={"lab": "test_insert"})
             # TODO Put into storage
@@ -146,17 +184,58 @@ class DataLakeManager:
                                          storage_namespace=storage_namespace,
                                          default_branch=default_branch)
         self.client.repositories.create_repository(repo)
+        self._repositories[name] = time.time()
 
     def repository_exits(self, repository: str) -> bool:
+        if repository is None:
+            raise ValueError("The repository prohibits the use of illegal characters")
+        checked_at = self._repositories.get(repository)
+        if checked_at is not None and time.time() - checked_at < settings.LAKE_REPOSITORY_CACHE_TTL:
+            return True
         try:
-            if repository is None:
-                raise ValueError("The repository prohibits the use of illegal characters")
             self.client.repositories.get_repository(repository)
         except NotFoundException:
+            self._repositories.pop(repository, None)
             return False
         else:
+            self._repositories[repository] = time.time()
             return True
 
+    def ensure_repository(self, repository: str):
+        if self.repository_exits(repository):
+            return
+        try:
+            self.create_repo(repository)
+        except ApiException as e:
+            # Created meanwhile by a parallel upload to the same repository
+            if e.status != 409:
+                raise
+            self._repositories[repository] = time.time()
+
+    def stream(self, repository: str, path: str, branch: str = "main", chunk_size: int = CHUNK_SIZE):
+        """
+        Object content chunk by chunk, get_object would first spool the whole object into a temporary file
+        """
+        response = self.client.objects.get_object(repository, branch, path, _preload_content=False)
+        try:
+            yield from response.stream(chunk_size)
+        finally:
+            response.release_conn()
+
+    def iter_objects(self, repository: str, branch: str = "main", prefix=None):
+        """
+        Every object under the prefix, all pages and all levels
+        """
+        after = ""
+        while True:
+            _page = self.client.objects.list_objects(repository, branch, prefix=prefix, after=after, delimiter="")
+            for _ in _page.results:
+                if _['path_type'] == "object":
+                    yield _
+            if not _page.pagination.has_more:
+                break
+            after = _page.pagination.next_offset
+
     def download(self, model: DataFileSystem):
         if model.from_source == "UPLOADED":
             repository = model.user.id
@@ -164,21 +243,18 @@ class DataLakeManager:
             repository = model.lab_id
         if model.is_dir:
             response_file_name = f"{model.name}.zip"
-            file_objects = list()
-            for i in self.list_objects(repository=repository, prefix=model.data_path):
-                file_objects.append({"name": i['path'].rsplit('/')[-1], "stream": self.get(repository, i['path'])})
-            file_object = BytesIO()
-            with zipfile.ZipFile(file_object, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for _ in file_objects:
-                    zip_file.writestr(_['name'], _['stream'].read())
-                zip_file.close()
-                "application/x-zip-compressed"
-            streaming = iter([file_object.getvalue()])
-
+            prefix = model.data_path if model.data_path.endswith('/') else f"{model.data_path}/"
+            file_objects = ({"name": i['path'][len(prefix):],
+                             "chunks": partial(self.stream, repository, i['path']),
+                             "size": i['size_bytes'],
+                             "mtime": i['mtime']}
+                            for i in self.iter_objects(repository=repository, prefix=prefix))
+            streaming = iter_zip(file_objects)
         else:
             response_file_name = model.name
-            streaming = self.get(repository, path=model.data_path)
+            streaming = self.stream(repository, path=model.data_path)
         return quote(response_file_name), streaming
+
     # @property
     # def repository_exits(self) -> bool:
     #     try:
@@ -205,6 +281,114 @@ class DataLakeManager:
     #     self._repository = value
 
 
+
+class LakeCommitBatcher:
+    """
+    Uploads staged per repository and branch, committed together instead of one commit per file.
+    A batch is committed once its uploads are over and it is finished by the caller,
+    LAKE_COMMIT_BATCH_FILES or LAKE_COMMIT_BATCH_BYTES are reached, no upload came for LAKE_COMMIT_IDLE seconds
+    or its first upload is older than LAKE_COMMIT_MAX_DELAY.
+    """
+
+    def __init__(self):
+        self._batches: Dict[Tuple[str, str], dict] = dict()
+        self._lock = threading.Lock()
+        # lakeFS commits everything staged on the branch, two commits of one branch must not overlap
+        self._commit_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _batch(self, key: Tuple[str, str]) -> dict:
+        if key not in self._batches:
+            self._batches[key] = {"active": 0, "files": 0, "bytes": 0, "first_at": None, "last_at": None,
+                                  "finished": False}
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="datalab-lake-commit", daemon=True)
+            self._thread.start()
+        return self._batches[key]
+
+    def begin(self, repository: str, branch: str = "main"):
+        """
+        An upload of the batch started, the batch is not committed as finished before it is done
+        """
+        with self._lock:
+            self._batch((repository, branch))["active"] += 1
+
+    def done(self, repository: str, branch: str = "main", size: int = 0, staged: bool = True):
+        with self._lock:
+            batch = self._batch((repository, branch))
+            batch["active"] -= 1
+            if staged:
+                now = time.time()
+                batch["files"] += 1
+                batch["bytes"] += size
+                batch["first_at"] = batch["first_at"] or now
+                batch["last_at"] = now
+            due = self._due(batch, time.time())
+        if due:
+            self.flush(repository, branch)
+
+    def finish(self, repository: str, branch: str = "main"):
+        """
+        End of a logical operation (a folder upload...): commit as soon as its running uploads are done
+        """
+        with self._lock:
+            batch = self._batch((repository, branch))
+            batch["finished"] = True
+            due = self._due(batch, time.time())
+        if due:
+            self.flush(repository, branch)
+
+    @staticmethod
+    def _due(batch: dict, now: float) -> bool:
+        if batch["files"] == 0:
+            return False
+        if batch["files"] >= settings.LAKE_COMMIT_BATCH_FILES or batch["bytes"] >= settings.LAKE_COMMIT_BATCH_BYTES:
+            return True
+        if now - batch["first_at"] >= settings.LAKE_COMMIT_MAX_DELAY:
+            return True
+        return batch["active"] == 0 and (batch["finished"] or now - batch["last_at"] >= settings.LAKE_COMMIT_IDLE)
+
+    def flush(self, repository: Optional[str] = None, branch: Optional[str] = None):
+        """
+        Commit the staged uploads now, of every batch when no repository is given
+        """
+        with self._lock:
+            keys = [k for k, v in self._batches.items()
+                    if v["files"] and repository in (None, k[0]) and branch in (None, k[1])]
+            batches = dict()
+            for key in keys:
+                batch = self._batches[key]
+                batches[key] = dict(batch)
+                # Uploads still running belong to the next batch
+                batch.update(files=0, bytes=0, first_at=None, last_at=None, finished=False)
+        for (_repository, _branch), batch in batches.items():
+            with self._commit_lock:
+                _ok, _result = DataLakeManager().commit(
+                    _repository, _branch, msg=f"{batch['files']} files {str(datetime.utcnow())}",
+                    metadata={"files": str(batch["files"]), "bytes": str(batch["bytes"])})
+            if _ok is False:
+                # "no changes": the objects were already taken by an earlier commit of the branch
+                print(f"lakeFS commit {_repository}/{_branch}: {_result}")
+
+    def _run(self):
+        while True:
+            time.sleep(1)
+            now = time.time()
+            with self._lock:
+                due = [k for k, v in self._batches.items() if self._due(v, now)]
+                # Forget the idle batches
+                for k in [k for k, v in self._batches.items() if not v["files"] and not v["active"]]:
+                    self._batches.pop(k)
+            for _repository, _branch in due:
+                try:
+                    self.flush(_repository, _branch)
+                except Exception as e:
+                    print(f"lakeFS commit {_repository}/{_branch}: {e}")
+
+
+lake_committer = LakeCommitBatcher()
+
+
 if __name__ == '__main__':
     print(quote("02-Experiment-Experiment-Level 1 data state.jpg"))
     # from app.utils.middleware_util import get_s3_client
@@ -0,0 +1,75 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:permission
+@time:2023/06/07
+"""
+import time
+import threading
+from datetime import datetime
+from typing import FrozenSet, Optional
+from app.core.config import settings
+from app.models.mongo import RoleModel
+from app.usecases.roles_usecase import flatten_role_permissions
+from app.utils.constants import PERMISSION_MAP
+
+# Request paths under permission control, every other path is let through
+LIMITED_PATHS: FrozenSet[str] = frozenset(v.get("uri") for v in PERMISSION_MAP.values() if v.get("uri") not in ["", None])
+
+
+class RolePermissionIndex:
+    """
+    Checked permission uris of each role, flattened once per role version.
+    An index is trusted for PERMISSION_INDEX_TTL seconds, after that only the role updated_at is read again
+    and the permissions are flattened again when it changed.
+    None as index: the role does not exist or has no permissions, nothing is restricted for it.
+    """
+
+    def __init__(self, ttl: Optional[int] = None):
+        self.ttl = settings.PERMISSION_INDEX_TTL if ttl is None else ttl
+        self._entries = dict()   # role_id -> (expires_at, updated_at, index)
+        self._lock = threading.Lock()
+
+    def cached(self, role_id: str) -> (bool, Optional[FrozenSet[str]]):
+        """
+        Index of the role without touching mongo, (False, None) when it must be loaded
+        """
+        entry = self._entries.get(role_id)
+        if entry is None or entry[0] <= time.monotonic():
+            return False, None
+        return True, entry[2]
+
+    @staticmethod
+    def compile(role: Optional[RoleModel]) -> Optional[FrozenSet[str]]:
+        if role is None:
+            return None
+        flat_permissions = flatten_role_permissions(role.permissions)
+        if flat_permissions is None:
+            return None
+        return frozenset(p.get("uri") for p in flat_permissions if p.get("checked") is True)
+
+    def load(self, role_id: str) -> Optional[FrozenSet[str]]:
+        entry = self._entries.get(role_id)
+        if entry is not None:
+            _role = RoleModel.objects(id=role_id).only("updated_at").first()
+            if _role is not None and _role.updated_at == entry[1]:
+                with self._lock:
+                    self._entries[role_id] = (time.monotonic() + self.ttl, entry[1], entry[2])
+                return entry[2]
+        role = RoleModel.objects(id=role_id).first()
+        index = self.compile(role)
+        updated_at: Optional[datetime] = None if role is None else role.updated_at
+        with self._lock:
+            self._entries[role_id] = (time.monotonic() + self.ttl, updated_at, index)
+        return index
+
+    def invalidate(self, role_id: Optional[str] = None):
+        with self._lock:
+            if role_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(role_id, None)
+
+
+permission_index = RolePermissionIndex()
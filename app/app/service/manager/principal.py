@@ -0,0 +1,73 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:principal
+@time:2023/06/07
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+from app.core.config import settings
+from app.models.mongo import UserModel
+
+
+class PrincipalCache:
+    """
+    Users resolved from the email of an access token, kept in the worker for PRINCIPAL_CACHE_TTL seconds.
+    Entries hold the raw document: every read builds its own UserModel, a request may modify and save it freely.
+    Changes of role, activation or verification must call invalidate, other workers see them once the entry expired.
+    """
+
+    def __init__(self, ttl: Optional[int] = None, maxsize: Optional[int] = None):
+        self.ttl = settings.PRINCIPAL_CACHE_TTL if ttl is None else ttl
+        self.maxsize = settings.PRINCIPAL_CACHE_SIZE if maxsize is None else maxsize
+        self._entries = OrderedDict()   # email -> (expires_at, son)
+        self._lock = threading.Lock()
+        # Increased by every invalidation, a lookup started before it must not write its stale result
+        self._generation = 0
+
+    def get(self, email: str) -> Optional[UserModel]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(email)
+                return UserModel._from_son(entry[1])
+            generation = self._generation
+        user = UserModel.objects(email=email).first()
+        if user is not None and self.ttl > 0:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[email] = (now + self.ttl, user.to_mongo().to_dict())
+                    self._entries.move_to_end(email)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+        return user
+
+    def _drop(self, match) -> int:
+        with self._lock:
+            self._generation += 1
+            emails = [_email for _email, (_, son) in self._entries.items() if match(_email, son)]
+            for _email in emails:
+                del self._entries[_email]
+        return len(emails)
+
+    def invalidate(self, user_id: Optional[str] = None, email: Optional[str] = None) -> int:
+        """
+        Forget a user, by id or by email
+        """
+        return self._drop(lambda _email, son: _email == email or son.get('_id') == user_id)
+
+    def invalidate_role(self, role_id: str) -> int:
+        """
+        Forget every user holding the role
+        """
+        return self._drop(lambda _email, son: son.get('role') == role_id)
+
+    def clear(self):
+        self._drop(lambda _email, son: True)
+
+
+principal_cache = PrincipalCache()
@@ -7,11 +7,14 @@
 """
 
 import sys
+import time
+import threading
+import numpy as np
 from fastapi import status
 from fastapi.responses import JSONResponse
 from aioredis import Redis
 from datetime import datetime
-from typing import Optional, Union
+from typing import Iterable, Optional, Tuple, Union
 from decimal import Decimal, ROUND_UP, ROUND_CEILING
 sys.path.append('/Users/wuzhaochen/Desktop/workspace/datalab/app')
 from app.models.mongo import (
@@ -29,6 +32,7 @@ from app.models.mongo import (
     ComputingQuotaRuleModel,
     StorageQuotaRuleModel
 )
+from app.core.config import settings
 from app.utils.statement import create_serial_number
 from app.utils.common import generate_uuid
 from app.errors.resource import ResourceRuleUnitException, ResourceTransgressionException, \
@@ -46,6 +50,40 @@ def accuracy_correction(num: float):
     return float(Decimal(num).quantize(Decimal('.0000'), rounding=ROUND_UP))
 
 
+def _two_product_error(a: np.ndarray, b: float) -> np.ndarray:
+    """
+    a * b - fl(a * b), exact (Dekker), the rounding error of the float products
+    """
+    def _split(x):
+        c = 134217729.0 * x
+        hi = c - (c - x)
+        return hi, x - hi
+    p = a * b
+    a_hi, a_lo = _split(a)
+    b_hi, b_lo = _split(np.float64(b))
+    return ((a_hi * b_hi - p) + a_hi * b_lo + a_lo * b_hi) + a_lo * b_lo
+
+
+def accuracy_corrections(nums: np.ndarray) -> np.ndarray:
+    """
+    accuracy_correction of every value, same results without one Decimal per value:
+    the value is rounded away from zero to 4 decimals, then converted back to float
+    """
+    nums = np.asarray(nums, dtype=np.float64)
+    _abs = np.abs(nums)
+    scaled = _abs * 10000
+    steps = np.ceil(scaled)
+    # A product rounded onto an integer may hide a remainder of the exact value: one more step then
+    _exact = scaled < 2 ** 52
+    _integral = (steps == scaled) & _exact
+    steps[_integral] += _two_product_error(_abs[_integral], 10000) > 0
+    result = np.copysign(steps / 10000, nums)
+    # Out of the exact float range of the steps: the Decimal way
+    for i in np.flatnonzero(~_exact):
+        result[i] = accuracy_correction(float(nums[i]))
+    return result
+
+
 def resource_id(model) -> str:
     return f"{model.id}-resource"
 
@@ -75,11 +113,47 @@ class Quantity:
         return self._quantity
 
 
+class QuotaRuleCache:
+    """
+    Latest computing and storage quota conversion rules, read once per QUOTA_RULE_CACHE_TTL seconds by a worker.
+    The documents are shared: read them, never modify them.
+    The admin rule updates call invalidate, other workers see the change once their rules expired.
+    """
+
+    def __init__(self, ttl: Optional[int] = None):
+        self.ttl = settings.QUOTA_RULE_CACHE_TTL if ttl is None else ttl
+        self._entry = None   # (expires_at, computing rule, storage rule)
+        self._lock = threading.Lock()
+        # Increased by every invalidation, a read started before it must not write its stale result
+        self._generation = 0
+
+    def get(self) -> Tuple[Optional[ComputingQuotaRuleModel], Optional[StorageQuotaRuleModel]]:
+        with self._lock:
+            entry = self._entry
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1], entry[2]
+            generation = self._generation
+        computing = ComputingQuotaRuleModel.objects.order_by("-update_at").first()
+        storage = StorageQuotaRuleModel.objects.order_by("-update_at").first()
+        if self.ttl > 0:
+            with self._lock:
+                if generation == self._generation:
+                    self._entry = (time.monotonic() + self.ttl, computing, storage)
+        return computing, storage
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entry = None
+
+
+quota_rules = QuotaRuleCache()
+
+
 class Cashier:
 
     def __init__(self):
-        self.computing_cash_rule = ComputingQuotaRuleModel.objects.order_by("-update_at").first()
-        self.storage_cash_rule = StorageQuotaRuleModel.objects.order_by("-update_at").first()
+        self.computing_cash_rule, self.storage_cash_rule = quota_rules.get()
         self.unit_rate_map = {
             "STORAGE": {"TB": 1024**4, "GB": 1024**3, "MB": 1024**2, "KB": 1024, "B": 1, "b": 0.1},
             "CPU": {"CORE": 1},
@@ -123,8 +197,8 @@ class Cashier:
         _use_quota = _to_bytes * self.storage_bytes_rate
         return accuracy_correction(_use_quota)
 
-    def exchange_rate_computing(self, quantity: Union[float, int], units: str,
-                                resource_type: str, use_time: float, time_unit: str) -> float:
+    @staticmethod
+    def _check_computing_units(units: str, resource_type: str, time_unit: str):
         if resource_type == "CPU" and units not in AVAILABLE_CPU_RESOURCES_UNITS_TYPES:
             raise ResourceRuleUnitException(f"CPUAbnormal resource conversion unit: {units}")
         elif resource_type == "GPU" and units not in AVAILABLE_GPU_RESOURCES_UNITS_TYPES:
@@ -133,6 +207,10 @@ class Cashier:
             raise ResourceRuleUnitException(f"Abnormal resource conversion unit: {units}")
         elif time_unit not in AVAILABLE_TIME_UNITS_TYPES:
             raise ResourceRuleUnitException(f"Resource conversion time unit is abnormal: {units}")
+
+    def exchange_rate_computing(self, quantity: Union[float, int], units: str,
+                                resource_type: str, use_time: float, time_unit: str) -> float:
+        self._check_computing_units(units, resource_type, time_unit)
         _time_rate = use_time * self.unit_rate_map['TIME'][time_unit]
         computing_resource_rate = self.unit_rate_map[resource_type][units]
         _need_quantity = quantity * (computing_resource_rate * _time_rate)
@@ -149,6 +227,34 @@ class Cashier:
                 _use_quota = self.computing_memory_rate
         return accuracy_correction(_use_quota)
 
+    def exchange_rate_computing_many(self, quantities: Iterable[Union[float, int]], units: str,
+                                     resource_type: str, use_time: float, time_unit: str) -> np.ndarray:
+        """
+        exchange_rate_computing of every quantity in one vectorized computation, same results
+        """
+        quantities = np.asarray(quantities if isinstance(quantities, np.ndarray) else list(quantities),
+                                dtype=np.float64)
+        if not np.isfinite(quantities).all():
+            # Missing or invalid samples fail as they always did
+            return np.array([self.exchange_rate_computing(_, units, resource_type, use_time, time_unit)
+                             for _ in quantities.tolist()], dtype=np.float64)
+        self._check_computing_units(units, resource_type, time_unit)
+        _time_rate = use_time * self.unit_rate_map['TIME'][time_unit]
+        computing_resource_rate = self.unit_rate_map[resource_type][units]
+        _need_quantity = quantities * (computing_resource_rate * _time_rate)
+        _use_quota = np.zeros_like(_need_quantity)
+        if resource_type == "CPU":
+            _rate = self.computing_cpu_rate
+            _use_quota = _need_quantity * _rate
+            _use_quota[np.trunc(_use_quota) == 0] = _rate
+        elif resource_type == "GPU":
+            _use_quota = _need_quantity * self.computing_gpu_rate
+        elif resource_type == "MEMORY":
+            _rate = self.computing_memory_rate
+            _use_quota = _need_quantity * _rate
+            _use_quota[np.trunc(_use_quota) == 0] = _rate
+        return accuracy_corrections(_use_quota)
+
     def minimum_consumption(self, resource_type: str):
         if resource_type == "CPU":
             _use_quota = self.computing_cpu_rate
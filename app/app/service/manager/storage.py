@@ -12,12 +12,12 @@ from app.models.mongo import DataFileSystem, UserModel
 from app.models.mongo.public_data import PublicDatasetModel, PublicDataFileModel
 from app.core.config import settings
 from app.utils.common import generate_uuid
-from app.utils.middleware_util import get_s3_client
-from app.utils.uploads3_util import main as minio_uploader
 import uuid
 import os
 from typing import Optional
-from .lake import DataLakeManager
+from .ingest import TreeIngestor, existing_ids, scan_tree
+from .upload import upload_pipeline
+from .datasets import PublicDatasetStats
 
 
 class FileTreeNode:
@@ -28,9 +28,13 @@ class FileTreeNode:
     model = None
 
     def __init__(self, absolute_path: str, user: UserModel, name: Optional[str] = None,
-                 file_id: Optional[str] = None, parent: Optional[str] = None, root: bool = False):
+                 file_id: Optional[str] = None, parent: Optional[str] = None, root: bool = False,
+                 lookup: bool = True):
+        """
+        :param lookup: query the row of absolute_path, False when file_id was already looked up by the tree
+        """
         _parent, _name = absolute_path.rsplit('/', maxsplit=1)
-        _model = DataFileSystem.objects(data_path=absolute_path).first()
+        _model = DataFileSystem.objects(data_path=absolute_path).first() if lookup else None
         if parent is not None:
             _parent = parent
         if _model is not None:
@@ -114,27 +118,28 @@ class FileTree:
         self.user = user
 
     def create(self):
-        for root, dirs, files in os.walk(self.root.absolute_path):
-            for _dir in dirs:
-                _absolute_path = os.path.join(root, _dir)
-                self.create_dir_node(_absolute_path)
-                print("CREATE", _absolute_path)
-            for _file in files:
-                _absolute_path = os.path.join(root, _file)
-                self.create_file_node(_absolute_path)
-                print("CREATE", _absolute_path)
+        # One scan of the tree and one query per batch of paths instead of one query per node
+        _entries = scan_tree(self.root.absolute_path)[1:]
+        _ids = existing_ids([_["path"] for _ in _entries], self.user.id)
+        for _entry in _entries:
+            if _entry["is_dir"]:
+                self.create_dir_node(_entry["path"], _ids.get(_entry["path"]))
+            else:
+                self.create_file_node(_entry["path"], _ids.get(_entry["path"]))
 
-    def create_dir_node(self, absolute_path: str):
+    def create_dir_node(self, absolute_path: str, file_id: Optional[str] = None):
         _parent_path = absolute_path.rsplit('/', maxsplit=1)[0]
-        _node = FileTreeNode(absolute_path, user=self.user, parent=self.file_index.get(_parent_path))
+        _node = FileTreeNode(absolute_path, user=self.user, parent=self.file_index.get(_parent_path),
+                             file_id=file_id, lookup=False)
         if self.file_index.get(_node.absolute_path) is None:
             self.file_index[_node.absolute_path] = _node.id
         self.map[_parent_path].child.append(_node)
         self.map[_node.absolute_path] = _node
 
-    def create_file_node(self, absolute_path: str):
+    def create_file_node(self, absolute_path: str, file_id: Optional[str] = None):
         _parent_path = absolute_path.rsplit('/', maxsplit=1)[0]
-        _node = FileTreeNode(absolute_path, user=self.user,  parent=self.file_index.get(_parent_path))
+        _node = FileTreeNode(absolute_path, user=self.user, parent=self.file_index.get(_parent_path),
+                             file_id=file_id, lookup=False)
         if self.file_index.get(_node.absolute_path) is None:
             self.file_index[_node.absolute_path] = _node.id
         self.map[_parent_path].child.append(_node)
@@ -174,12 +179,16 @@ class StorageManager:
         _size = os.path.getsize(absolute_path)
         _model = PublicDataFileModel.objects(data_path=absolute_path).order_by('-updated_at').first()
         if _model is not None and _model.deleted is False:  # File already exists，This is an update.
+            _old_size = _model.data_size or 0
             _model.updated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             _model.name = Path(file_name).name
             _model.data_path = absolute_path
+            _model.data_size = _size
             _model.save()
+            PublicDatasetStats.record(datasets_id, 0, _size - _old_size)
         else:
             upload_path = Path(absolute_path.replace(str(standard_prefix), ""))
+            _created = 0
             for _p in upload_path.parents:
                 if str(_p) != "/":  # non-directory
                     _dir_absolute_path = Path(standard_prefix, str(_p)[1:]).absolute()
@@ -205,6 +214,7 @@ class StorageManager:
                             deps=len(str(_p.absolute()).split('/'))-2
                         )
                         _dir_model.save()
+                        _created += 1
                         # Whether the alignment size changes，The storage needs to be adjusted if there is a change
             _id = generate_uuid()
             _model = PublicDataFileModel(
@@ -226,8 +236,9 @@ class StorageManager:
                 deps=len(str(upload_path).split('/'))-2
             )
             _model.save()
-        minio_uploader(client, datasets_id, absolute_path, absolute_path, datasets_id)
-        DataLakeManager().put(absolute_path, absolute_path, datasets_id)
+            PublicDatasetStats.record(datasets_id, _created + 1, _size, datetime.now().replace(microsecond=0))
+        # MinIO and lakeFS are fed in the background from one read of the file, progress under the datasets id
+        upload_pipeline.submit(datasets_id, absolute_path, absolute_path, datasets_id, progress_key=datasets_id)
         # client.fput_object(datasets_id, absolute_path, absolute_path)
         # Whether the alignment size changes，The storage needs to be adjusted if there is a change
         return _model
@@ -247,48 +258,10 @@ class StorageManager:
             # Whether the alignment size changes，The storage needs to be adjusted if there is a change
         else:
             upload_path = Path(absolute_path.replace(str(standard_prefix), ""))
-            for _p in reversed(upload_path.parents):
-                if str(_p) != "/":  # non-directory, The root '/' Logo
-                    _dir_absolute_path = Path(standard_prefix, str(_p)[1:]).absolute()
-                    _dir_model = DataFileSystem.objects(data_path=str(_dir_absolute_path)).first()
-                    print(f"Directory： {str(_dir_absolute_path)} --> {_dir_model}")
-                    if _dir_model is None:
-                        _dir_id = generate_uuid()
-                        _parent = str(_p.parent)
-                        _parent_id: str = "root" if _parent == "/" else \
-                            DataFileSystem.objects(data_path=os.path.join(standard_prefix,
-                                                                          str(_p.parent)[1:])).first().id
-                        _dir_model = DataFileSystem(
-                            id=_dir_id,
-                            name=_p.name,
-                            is_file=False,
-                            is_dir=True,
-                            store_name=str(_dir_absolute_path),
-                            data_size=0,
-                            data_path=str(_dir_absolute_path),
-                            user=user,
-                            from_source="UPLOADED",
-                            deleted=0,
-                            created_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                            updated_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                            data_type="myData",
-                            storage_service="ext4",
-                            parent=_parent_id,
-                            deps=len(str(_p.absolute()).split('/'))-2
-                        )
-                        _dir_model.save()
-                    else:
-                        _dir_model.deleted = False
-                        _dir_model.save()
-                        # Whether the alignment size changes，The storage needs to be adjusted if there is a change
+            # Missing directories above the file: one lookup and one bulk write for all of them
+            _ancestors = TreeIngestor(str(standard_prefix), user.id).ensure_ancestors(absolute_path)
+            _parent_id = _ancestors[-1] if _ancestors else "root"
             datasets_id = generate_uuid()
-            _parent_id = os.path.join(standard_prefix, str(Path(file_name).parent)[1:])
-            try:
-                _parent_id = "root" if str(Path(file_name).parent) == "/" else \
-                                DataFileSystem.objects(data_path=absolute_path.rsplit('/', maxsplit=1)[0]).first().id
-            except Exception as e:
-                print(e)
-                _parent_id = "root"
             _model = DataFileSystem(
                 id=datasets_id,
                 name=Path(file_name).name,
@@ -306,13 +279,12 @@ class StorageManager:
                 storage_service="ext4",
                 file_extension=absolute_path_object.suffix[1:],
                 deps=len(str(upload_path).split('/'))-2,
-                parent=_parent_id
+                parent=_parent_id,
+                ancestors=_ancestors
             )
             _model.save()
-        client = get_s3_client()
         print(f"Push parameters {datasets_id} {absolute_path} {datasets_id}")
-        minio_uploader(client, user.id, absolute_path, absolute_path, datasets_id)
-        DataLakeManager().put(absolute_path, absolute_path, user.id)
+        upload_pipeline.submit(user.id, absolute_path, absolute_path, user.id, progress_key=datasets_id)
         # Whether the alignment size changes，The storage needs to be adjusted if there is a change
         return _model
 
@@ -325,10 +297,9 @@ class StorageManager:
 
     @staticmethod
     def from_dir(absolute_path: str, user: UserModel):
-        root_node = FileTreeNode(absolute_path=absolute_path,  user=user, root=True)
-        _tree = FileTree(root_node, user)
-        _tree.to_service()
-        _nodes, _total_size = _tree.to_service()
-        for i in _nodes:
-            print(i)
-        print(_total_size)
+        """
+        Rows of an uploaded directory and of everything below it, written in bulk
+        :return: {"id": row id of the directory, "size": total size, "files": file count, "dirs": directory count}
+        """
+        standard_prefix = Path(settings.BASE_DIR, settings.DATA_PATH, user.id, "uploads/")
+        return TreeIngestor(str(standard_prefix), user.id).ingest(absolute_path)
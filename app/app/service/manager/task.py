@@ -8,6 +8,7 @@
 import sys
 sys.path.append('/Users/wuzhaochen/Desktop/workspace/datalab/app')
 import json
+import asyncio
 from app.models.mongo import (
     UserModel,
     ToolTaskModel,
@@ -18,6 +19,7 @@ from app.models.mongo import (
     UserQuotaModel,
 )
 from typing import Optional
+from aioredis import Redis
 from app.core.config import settings
 from app.utils.common import generate_uuid
 from app.service.manager.quota import UserQuotaManager, Cashier
@@ -28,6 +30,60 @@ class ComputeResourceException(Exception):
         msg = "Resource exception"
 
 
+TASK_FINISHED_CHANNEL = "datalab-task-finished"
+
+
+class TaskNotifier:
+    """
+    Fan out the task completion events published by the callback to the coroutines waiting for them,
+    a single pub/sub subscription is shared by the whole worker
+    """
+
+    def __init__(self):
+        self._waiters = dict()
+        self._listener: Optional[asyncio.Task] = None
+
+    def subscribe(self, task_id: str, publisher: Redis) -> asyncio.Future:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen(publisher))
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(task_id, set()).add(future)
+        return future
+
+    def unsubscribe(self, task_id: str, future: asyncio.Future):
+        _futures = self._waiters.get(task_id)
+        if _futures is not None:
+            _futures.discard(future)
+            if not _futures:
+                self._waiters.pop(task_id, None)
+
+    async def _listen(self, publisher: Redis):
+        while True:
+            try:
+                pubsub = publisher.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(TASK_FINISHED_CHANNEL)
+                async for message in pubsub.listen():
+                    if message is None or message.get('type') != 'message':
+                        continue
+                    event = json.loads(message['data'])
+                    for future in self._waiters.get(event['task_id'], set()):
+                        if not future.done():
+                            future.set_result(event['status'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Task notifier subscription exception: {e}")
+                await asyncio.sleep(1)
+
+    @staticmethod
+    async def publish(task_id: str, publisher: Redis):
+        status = await publisher.get(f"{task_id}-task")
+        await publisher.publish(TASK_FINISHED_CHANNEL, json.dumps({"task_id": task_id, "status": status}))
+
+
+task_notifier = TaskNotifier()
+
+
 class ComputeTaskManager:
 
     @staticmethod
@@ -44,14 +100,15 @@ class ComputeTaskManager:
             raise ComputeResourceException()
 
     @staticmethod
-    def add_task(event, user_id):
+    def add_task(event, user_id, compute_task_id: Optional[str] = None):
         task_queue_id = generate_uuid()
         user = UserModel.objects(id=user_id).first()
         task = TaskQueueModel(
             id=task_queue_id,
             user=user,
             event=event,
-            task_id=event.id
+            task_id=event.id,
+            compute_task_id=compute_task_id
         )
         try:
             task.save()
@@ -91,6 +148,8 @@ class ComputeTaskManager:
             _model.status = settings.COMPUTING_FAILED
             _model.msg = str(e)
             _model.save()
+        await TaskNotifier.publish(_model.compute_task_id or _base_event_id, publisher)
+        return _model
 
     @staticmethod
     def run(task_id):
@@ -108,14 +167,13 @@ class ComputeTaskManager:
         quota_list = list()
         _cpu_overhead = overhead['cpu_used_list']
         _memory_overhead = overhead['vms_list']
+        # One vectorized conversion per series, summed in sample order like the per sample conversion was
         if _cpu_overhead:
-            for i in _cpu_overhead:
-                quota_list.append(_cashier.exchange_rate_computing(i, "CORE", "CPU", 1, "s"))
+            quota_list.extend(_cashier.exchange_rate_computing_many(_cpu_overhead, "CORE", "CPU", 1, "s").tolist())
         else:
             quota_list.append(_cashier.minimum_consumption("CPU"))
         if _memory_overhead:
-            for i in _memory_overhead:
-                quota_list.append(_cashier.exchange_rate_computing(i, "B", "MEMORY", 1, "s"))
+            quota_list.extend(_cashier.exchange_rate_computing_many(_memory_overhead, "B", "MEMORY", 1, "s").tolist())
         else:
             quota_list.append(_cashier.minimum_consumption("MEMORY"))
         UserQuotaManager().deduct(task_model, sum(quota_list))
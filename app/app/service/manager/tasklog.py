@@ -0,0 +1,311 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:tasklog
+@time:2023/06/19
+
+Task logs on Redis Streams, TASK_PUBLISHER_DB: the lines of a task are the entries of the stream "<task id>-log".
+The function runtime still appends its output to the list "<task id>", both are read as one log:
+the stream lines first, then the list lines.
+"""
+import asyncio
+import json
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+import redis
+from aioredis import Redis
+from app.core.config import settings
+
+LINE_FIELD = "line"
+
+
+def log_stream(task_id: str) -> str:
+    return f"{task_id}-log"
+
+
+async def append_log(conn: Redis, task_id: str, *lines: str):
+    """
+    Append lines to the log of a task, conn on TASK_PUBLISHER_DB
+    """
+    if not lines:
+        return
+    pipe = conn.pipeline(transaction=False)
+    for line in lines:
+        pipe.xadd(log_stream(task_id), {LINE_FIELD: line}, maxlen=settings.TASK_LOG_MAXLEN, approximate=True)
+    await pipe.execute()
+
+
+def append_log_sync(con: redis.Redis, task_id: str, *lines: str):
+    if not lines:
+        return
+    with con.pipeline(transaction=False) as pipe:
+        for line in lines:
+            pipe.xadd(log_stream(task_id), {LINE_FIELD: line}, maxlen=settings.TASK_LOG_MAXLEN, approximate=True)
+        pipe.execute()
+
+
+def resource_key(task_id: str) -> str:
+    return f"{task_id}-resource"
+
+
+def _after(stream_id: str) -> str:
+    """
+    Smallest stream id after stream_id: XRANGE start excluding stream_id
+    """
+    _ms, _seq = stream_id.split("-")
+    return f"{_ms}-{int(_seq) + 1}"
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _line(fields: dict) -> str:
+    return _decode(fields.get(LINE_FIELD) or fields.get(LINE_FIELD.encode()) or "")
+
+
+def read_log_sync(con: redis.Redis, task_id: str, start_index: int = 0) -> List[str]:
+    """
+    Whole log of a task from start_index, for the readers outside the event loop
+    """
+    with con.pipeline(transaction=False) as pipe:
+        pipe.xrange(log_stream(task_id))
+        pipe.lrange(task_id, 0, -1)
+        _entries, _lines = pipe.execute()
+    return ([_line(_fields) for _, _fields in _entries] + [_decode(_) for _ in _lines])[start_index:]
+
+
+class TaskLogUpdate(NamedTuple):
+    status: Optional[str]
+    # Only what is new since the previous update
+    lines: List[str]
+    tasks: List[str]
+    # task id -> [last stream id, list lines] read, the log up to there has been delivered
+    positions: Dict[str, list]
+    # task id -> {"status": <task id>-task, "resource": <task id>-resource}, subscriptions with details only
+    details: Dict[str, dict]
+
+
+class TaskLogSubscription:
+    """
+    Log lines and status of tasks followed by one socket, filled by the TaskLogHub of the worker.
+    Every round of the hub puts one TaskLogUpdate.
+    """
+
+    def __init__(self, hub: "TaskLogHub", tasks: Iterable[str], status_key: str, members_key: Optional[str] = None,
+                 positions: Optional[Dict[str, list]] = None, details: bool = False):
+        self.hub = hub
+        self.tasks: List[str] = list(dict.fromkeys(tasks))
+        self.status_key = status_key
+        # JSON list of task ids, tasks added to it are followed as well
+        self.members_key = members_key
+        # Resume: the first update only holds the lines after these positions
+        self.positions = positions or dict()
+        self.details = details
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.TASK_LOG_SUBSCRIBER_QUEUE)
+
+    def put(self, item: TaskLogUpdate):
+        if self.queue.full():
+            # A socket too slow to keep up gets every pending round as one, never loses or reorders lines:
+            # their lines in order, then the newest status, tasks, positions and details
+            _lines = list()
+            while not self.queue.empty():
+                _lines.extend(self.queue.get_nowait().lines)
+            item = item._replace(lines=_lines + item.lines)
+        self.queue.put_nowait(item)
+
+    async def get(self) -> TaskLogUpdate:
+        return await self.queue.get()
+
+    async def __aenter__(self):
+        await self.hub.subscribe(self)
+        return self
+
+    async def __aexit__(self, *args):
+        await self.hub.unsubscribe(self)
+
+
+class TaskLogHub:
+    """
+    One reader per worker for every task log socket: each round is one XREAD BLOCK on the streams of all the
+    followed tasks from their last seen ids, then one pipeline for the new list lines, the statuses and the members.
+    A new subscriber gets the log written so far once, then only the new lines.
+    """
+
+    def __init__(self):
+        self._subscriptions: Set[TaskLogSubscription] = set()
+        self._stream_ids: Dict[str, str] = dict()   # task id -> last stream id read
+        self._list_offsets: Dict[str, int] = dict()   # task id -> list lines read
+        self._conn: Optional[Redis] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+
+    def start(self, conn: Redis):
+        """
+        :param conn: TASK_PUBLISHER_DB connection, decode_responses=True
+        """
+        self._conn = conn
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def subscription(self, tasks: Iterable[str], status_key: str, members_key: Optional[str] = None,
+                     positions: Optional[Dict[str, list]] = None, details: bool = False) -> TaskLogSubscription:
+        return TaskLogSubscription(self, tasks, status_key, members_key, positions, details)
+
+    def _followed(self) -> Set[str]:
+        return {_task for _sub in self._subscriptions for _task in _sub.tasks}
+
+    def _positions(self, tasks: Iterable[str]) -> Dict[str, list]:
+        return {_task: [self._stream_ids[_task], self._list_offsets[_task]] for _task in tasks
+                if _task in self._stream_ids}
+
+    async def _backlog(self, tasks: List[str], positions: Optional[Dict[str, list]] = None) -> List[str]:
+        """
+        Lines of tasks after positions up to where the hub is, follow the tasks nobody follows yet from their end
+        """
+        positions = positions or dict()
+        pipe = self._conn.pipeline(transaction=False)
+        for _task in tasks:
+            _stream_id, _offset = positions.get(_task) or ("0-0", 0)
+            pipe.xrange(log_stream(_task), _after(_stream_id), self._stream_ids.get(_task, "+"))
+            # The hub has read the list up to the offset: 0 means nothing yet, not "up to the end"
+            pipe.lrange(_task, _offset, self._list_offsets[_task] - 1 if _task in self._list_offsets else -1)
+        _results = await pipe.execute()
+        lines = list()
+        for i, _task in enumerate(tasks):
+            _entries, _lines = _results[2 * i], _results[2 * i + 1]
+            if self._list_offsets.get(_task) == 0:
+                _lines = list()
+            lines.extend(_line(_fields) for _, _fields in _entries)
+            lines.extend(_decode(_) for _ in _lines)
+            if _task not in self._stream_ids:
+                _stream_id, _offset = positions.get(_task) or ("0-0", 0)
+                self._stream_ids[_task] = _entries[-1][0] if _entries else _stream_id
+                self._list_offsets[_task] = _offset + len(_lines)
+        return lines
+
+    async def _details(self, tasks: List[str]) -> Dict[str, dict]:
+        if not tasks:
+            return dict()
+        _values = await self._conn.mget([_key for _task in tasks for _key in (f"{_task}-task", resource_key(_task))])
+        return {_task: {"status": _values[2 * i], "resource": _values[2 * i + 1]} for i, _task in enumerate(tasks)}
+
+    async def subscribe(self, subscription: TaskLogSubscription):
+        if self._conn is None:
+            raise RuntimeError("TaskLogHub is not started")
+        async with self._lock:
+            backlog = await self._backlog(subscription.tasks, subscription.positions)
+            _status = await self._conn.get(subscription.status_key)
+            _details = await self._details(subscription.tasks) if subscription.details else dict()
+            self._subscriptions.add(subscription)
+            _positions = self._positions(subscription.tasks)
+        subscription.put(TaskLogUpdate(_status, backlog, list(subscription.tasks), _positions, _details))
+        self._wakeup.set()
+
+    async def unsubscribe(self, subscription: TaskLogSubscription):
+        # Under the lock: a round reading the positions of a task must not see it dropped halfway
+        async with self._lock:
+            self._subscriptions.discard(subscription)
+            followed = self._followed()
+            for _task in list(self._stream_ids):
+                if _task not in followed:
+                    self._stream_ids.pop(_task, None)
+                    self._list_offsets.pop(_task, None)
+
+    async def _round(self):
+        streams = {log_stream(_task): self._stream_ids[_task] for _task in self._followed()
+                   if _task in self._stream_ids}
+        if streams:
+            # Waits for new lines at most TASK_LOG_BLOCK_MS: statuses and list lines are read at least as often
+            _read = await self._conn.xread(streams, block=settings.TASK_LOG_BLOCK_MS, count=settings.TASK_LOG_BATCH)
+        else:
+            await asyncio.sleep(settings.TASK_LOG_BLOCK_MS / 1000)
+            _read = list()
+        async with self._lock:
+            new_lines: Dict[str, List[str]] = dict()
+            # Positions reached by this round, only moved once its updates are put: a failed round is read again
+            read_ids: Dict[str, str] = dict()
+            for _stream, _entries in _read or []:
+                _stream = _decode(_stream)
+                _task = _stream[:-len("-log")]
+                # Followed again meanwhile: the new subscriber read its backlog from another position
+                if self._stream_ids.get(_task) != streams.get(_stream) or not _entries:
+                    continue
+                read_ids[_task] = _entries[-1][0]
+                new_lines.setdefault(_task, []).extend(_line(_fields) for _, _fields in _entries)
+            subscriptions = list(self._subscriptions)
+            tasks = [_task for _task in self._followed() if _task in self._list_offsets]
+            status_keys = list({_sub.status_key for _sub in subscriptions})
+            members_keys = list({_sub.members_key for _sub in subscriptions if _sub.members_key})
+            detail_tasks = list({_task for _sub in subscriptions if _sub.details for _task in _sub.tasks})
+            pipe = self._conn.pipeline(transaction=False)
+            for _task in tasks:
+                pipe.lrange(_task, self._list_offsets[_task], -1)
+            if status_keys:
+                pipe.mget(status_keys)
+            if members_keys:
+                pipe.mget(members_keys)
+            if detail_tasks:
+                pipe.mget([_key for _task in detail_tasks for _key in (f"{_task}-task", resource_key(_task))])
+            _results = await pipe.execute()
+            read_offsets: Dict[str, int] = dict()
+            for _task, _lines in zip(tasks, _results):
+                if _lines:
+                    read_offsets[_task] = self._list_offsets[_task] + len(_lines)
+                    new_lines.setdefault(_task, []).extend(_decode(_) for _ in _lines)
+            _rest = _results[len(tasks):]
+            statuses = dict(zip(status_keys, _rest.pop(0))) if status_keys else dict()
+            members = dict(zip(members_keys, _rest.pop(0))) if members_keys else dict()
+            details = dict()
+            if detail_tasks:
+                _values = _rest.pop(0)
+                details = {_task: {"status": _values[2 * i], "resource": _values[2 * i + 1]}
+                           for i, _task in enumerate(detail_tasks)}
+            for _sub in subscriptions:
+                _joined = list()
+                if _sub.members_key and members.get(_sub.members_key):
+                    try:
+                        _joined = [_ for _ in json.loads(members[_sub.members_key]) if _ not in _sub.tasks]
+                    except (TypeError, ValueError):
+                        _joined = list()
+                _lines = [_line for _task in _sub.tasks for _line in new_lines.get(_task, ())]
+                _details = {_task: details[_task] for _task in _sub.tasks if _task in details}
+                if _joined:
+                    # The backlog of a task already followed stops where this round started
+                    _followed = [_task for _task in _joined if _task in self._stream_ids]
+                    _sub.tasks.extend(_joined)
+                    _lines.extend(await self._backlog(_joined))
+                    _lines.extend(_line for _task in _followed for _line in new_lines.get(_task, ()))
+                _positions = self._positions(_sub.tasks)
+                for _task in _positions:
+                    _positions[_task] = [read_ids.get(_task, _positions[_task][0]),
+                                         read_offsets.get(_task, _positions[_task][1])]
+                _sub.put(TaskLogUpdate(statuses.get(_sub.status_key), _lines, list(_sub.tasks), _positions, _details))
+            self._stream_ids.update(read_ids)
+            self._list_offsets.update(read_offsets)
+
+    async def _run(self):
+        while True:
+            try:
+                if not self._subscriptions:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                await self._round()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"TaskLogHub: {e}")
+                await asyncio.sleep(1)
+
+
+task_log_hub = TaskLogHub()
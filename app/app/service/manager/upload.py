@@ -0,0 +1,287 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:upload
+@time:2023/06/12
+"""
+import io
+import os
+import json
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+import redis
+from app.core.config import settings
+from app.db.redis_util import redis_registry
+from app.utils.middleware_util import get_s3_client
+from app.utils.minio_util import ensure_bucket
+from app.utils.uploads3_util import format_string
+from .lake import DataLakeManager, lake_committer
+
+# Blocks waiting between the file read and the lakeFS upload, bounds the memory of one upload
+PIPE_BLOCKS = 8
+
+
+class ProgressReporter:
+    """
+    Upload progress of every file of the worker, written to redis by one thread in one pipeline per interval.
+    Values keep the format of uploads3_util.Progress, read by the public data websocket.
+    """
+
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = settings.UPLOAD_PROGRESS_INTERVAL if interval is None else interval
+        self._states: Dict[str, dict] = dict()
+        self._lock = threading.Lock()
+        # One flush at a time, an older snapshot must not overwrite the final status
+        self._flush_lock = threading.Lock()
+        self._con: Optional[redis.Redis] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._con = self._con or redis_registry.sync(settings.FILE_UPLOAD_PROGRESS_DB)
+            self._thread = threading.Thread(target=self._run, name="datalab-upload-progress", daemon=True)
+            self._thread.start()
+
+    def start(self, key: str, total: int):
+        with self._lock:
+            self._states[key] = {"current": 0, "total": total, "start": time.time(), "status": "Loading",
+                                 "dirty": True}
+            self._ensure_started()
+
+    def update(self, key: str, size: int):
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                state["current"] += size
+                state["dirty"] = True
+
+    def finish(self, key: str, status: str = "Success"):
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                state["status"] = status
+                state["dirty"] = True
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                dirty = {k: dict(v) for k, v in self._states.items() if v["dirty"]}
+                for k, v in dirty.items():
+                    self._states[k]["dirty"] = False
+                    if v["status"] != "Loading":
+                        self._states.pop(k)
+            if not dirty:
+                return
+            with self._con.pipeline(transaction=False) as pipe:
+                for k, v in dirty.items():
+                    _data = format_string(v["current"], v["total"] or 1, time.time() - v["start"])
+                    _data["status"] = v["status"]
+                    pipe.set(k, json.dumps(_data, ensure_ascii=False))
+                pipe.execute()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"ProgressReporter: {e}")
+
+
+class _Progress:
+    """
+    Progress hook of minio put_object
+    """
+
+    def __init__(self, reporter: ProgressReporter, key: str):
+        self.reporter = reporter
+        self.key = key
+
+    def set_meta(self, object_name: str, total_length: int):
+        pass
+
+    def update(self, size: int):
+        self.reporter.update(self.key, size)
+
+
+class _PipeReader(io.RawIOBase):
+    """
+    Readable end of the blocks read for MinIO, the lakeFS upload consumes the same bytes
+    """
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.name = name
+        self._blocks = queue.Queue(maxsize=PIPE_BLOCKS)
+        # Appended in place and consumed from the front: no copy of what is already buffered per block
+        self._buffer = bytearray()
+        self._eof = False
+        self._error: Optional[BaseException] = None
+        self.abandoned = False
+
+    def readable(self) -> bool:
+        return True
+
+    def feed(self, data: Optional[bytes]):
+        # None marks the end of the file, nothing is queued once the consumer gave up
+        while not self.abandoned:
+            try:
+                self._blocks.put(data, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            block = self._blocks.get()
+            if block is None:
+                if self._error is not None:
+                    # Never hand a truncated file to lakeFS as a complete one
+                    raise IOError(f"{self.name}: source upload failed: {self._error}")
+                self._eof = True
+            else:
+                self._buffer += block
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def fail(self, error: BaseException):
+        self._error = error
+        self.feed(None)
+
+    def abandon(self):
+        self.abandoned = True
+        while True:
+            try:
+                self._blocks.get_nowait()
+            except queue.Empty:
+                break
+
+
+class _TeeReader:
+    """
+    File reader handing every block read for MinIO to the lakeFS pipe as well
+    """
+
+    def __init__(self, f, pipe: _PipeReader):
+        self._f = f
+        self._pipe = pipe
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        if data:
+            self._pipe.feed(data)
+        return data
+
+
+class UploadPipeline:
+    """
+    Push local files to MinIO and lakeFS in the background, at most UPLOAD_WORKERS files at a time.
+    Each file is read once: MinIO gets it in UPLOAD_PARALLEL_PARTS parallel multipart parts
+    and the lakeFS upload consumes the same blocks.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = settings.UPLOAD_WORKERS if workers is None else workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lake_executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.progress = ProgressReporter()
+
+    def _executors(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="datalab-upload")
+                # The lakeFS side of every running upload needs its own thread, or the uploads wait for each other
+                self._lake_executor = ThreadPoolExecutor(self.workers, thread_name_prefix="datalab-upload-lake")
+            return self._executor, self._lake_executor
+
+    def shutdown(self):
+        """
+        Wait for the uploads submitted so far, their lakeFS side included, blocking
+        """
+        with self._lock:
+            executor, lake_executor = self._executor, self._lake_executor
+            self._executor = self._lake_executor = None
+        # An upload waits for its lakeFS side unless MinIO failed: those are drained with the lakeFS executor
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if lake_executor is not None:
+            lake_executor.shutdown(wait=True)
+        try:
+            self.progress.flush()
+        except Exception as e:
+            print(f"ProgressReporter: {e}")
+
+    def submit(self, bucket: str, object_name: str, file_path: str, repository: Optional[str] = None,
+               progress_key: Optional[str] = None) -> Future:
+        """
+        :param bucket: MinIO bucket, created when missing
+        :param object_name: object name in the bucket and path in the lakeFS repository
+        :param file_path: local file
+        :param repository: lakeFS repository, no lakeFS upload when None
+        :param progress_key: redis key of the progress, FILE_UPLOAD_PROGRESS_DB
+        """
+        if progress_key is not None:
+            # Written before returning: the websocket polling the key may start right after the response
+            self.progress.start(progress_key, os.path.getsize(file_path))
+            try:
+                self.progress.flush()
+            except Exception as e:
+                print(f"ProgressReporter: {e}")
+        if repository is not None:
+            # Counted from now on: a batch finished while this upload waits in the queue is not committed without it
+            lake_committer.begin(repository)
+        executor, _ = self._executors()
+        future = executor.submit(self._upload, bucket, object_name, file_path, repository, progress_key)
+        future.add_done_callback(lambda _: self._done(_, file_path, repository, progress_key))
+        return future
+
+    def _done(self, future: Future, file_path: str, repository: Optional[str], progress_key: Optional[str]):
+        error = future.exception()
+        if error is not None:
+            print(f"File push failed {file_path}: {error}")
+        if progress_key is not None:
+            self.progress.finish(progress_key, "Failed" if error is not None else "Success")
+        if repository is not None:
+            lake_committer.done(repository, size=future.result() if error is None else 0, staged=error is None)
+
+    def _upload(self, bucket: str, object_name: str, file_path: str, repository: Optional[str],
+                progress_key: Optional[str]):
+        client = get_s3_client()
+        ensure_bucket(bucket, client)
+        length = os.path.getsize(file_path)
+        progress = None if progress_key is None else _Progress(self.progress, progress_key)
+        lake_future = None
+        with open(file_path, 'rb') as f:
+            reader = f
+            if repository is not None:
+                pipe = _PipeReader(os.path.basename(file_path))
+                reader = _TeeReader(f, pipe)
+                _, lake_executor = self._executors()
+                lake_future = lake_executor.submit(DataLakeManager().put_stream, pipe, length, object_name, repository,
+                                                   commit=False)
+                # A failed lakeFS upload stops consuming, the MinIO side must not block on the full pipe
+                lake_future.add_done_callback(lambda _: pipe.abandon())
+            try:
+                client.put_object(bucket, object_name, reader, length, progress=progress,
+                                  part_size=settings.UPLOAD_PART_SIZE,
+                                  num_parallel_uploads=settings.UPLOAD_PARALLEL_PARTS)
+            except Exception as e:
+                if lake_future is not None:
+                    pipe.fail(e)
+                raise
+            if lake_future is not None:
+                pipe.feed(None)
+        if lake_future is not None:
+            lake_future.result()
+        return length
+
+
+upload_pipeline = UploadPipeline()
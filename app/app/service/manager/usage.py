@@ -0,0 +1,85 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:usage
+@time:2023/06/15
+"""
+import asyncio
+from typing import Dict, Optional
+from aioredis import Redis
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.models.mongo import DataFileSystem, StorageResourceAllocatedModel
+from app.utils.resource_util import reconcile_storage_usage
+
+RECONCILE_LOCK = "storage-usage-reconcile"
+
+
+class StorageUsageReconciler:
+    """
+    The user storage counters are moved atomically by the uploads and deletes, this recounts them from
+    DataFileSystem with one aggregation every STORAGE_USAGE_RECONCILE_INTERVAL seconds and fixes any drift.
+    Only one worker recounts per interval.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, redis_conn: Redis):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(redis_conn))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @staticmethod
+    def users() -> list:
+        return [_["allocated_user"] for _ in StorageResourceAllocatedModel.objects().only("allocated_user").as_pymongo()
+                if _.get("allocated_user")]
+
+    @staticmethod
+    def recount() -> Dict[str, int]:
+        """
+        Storage used per user, counted like the storage listing: files not deleted and not public
+        """
+        _usage = DataFileSystem.objects(is_dir=False, deleted=False, public=None).aggregate([
+            {"$group": {"_id": "$user", "size": {"$sum": "$data_size"}}}
+        ])
+        return {_["_id"]: _["size"] for _ in _usage if _["_id"] is not None}
+
+    async def reconcile(self, redis_conn: Redis) -> int:
+        """
+        :return: counters corrected
+        """
+        users = await run_in_threadpool(self.users)
+        if not users:
+            return 0
+        # Read before the recount: a counter moved meanwhile is left for the next round
+        before = dict(zip(users, await redis_conn.mget(users)))
+        recounted = await run_in_threadpool(self.recount)
+        usage = {_user: recounted.get(_user, 0) for _user in users}
+        return await reconcile_storage_usage(usage, before, redis_conn)
+
+    async def _run(self, redis_conn: Redis):
+        interval = settings.STORAGE_USAGE_RECONCILE_INTERVAL
+        while True:
+            try:
+                if await redis_conn.set(RECONCILE_LOCK, 1, nx=True, ex=max(1, interval - 1)):
+                    fixed = await self.reconcile(redis_conn)
+                    if fixed:
+                        print(f"Storage usage reconciled: {fixed} counters corrected")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Storage usage reconcile exception: {e}")
+            await asyncio.sleep(interval)
+
+
+storage_usage_reconciler = StorageUsageReconciler()
@@ -14,6 +14,7 @@ from app.schemas.visualization import VisualizationDataInCrate, VisualizationCom
 from app.models.mongo import VisualizationComponentModel, DataFileSystem, UserModel
 from app.models.mongo.fair import FairMarketComponentsModel
 from app.utils.middleware_util import get_s3_client
+from app.utils.minio_util import ensure_bucket
 from app.models.mongo.public_data import PublicDataFileModel
 fileUrl = "fileUrl"
 background = "background"
@@ -59,9 +60,7 @@ class VisualizationManager:
                 self.object_storage_bucket = source_data.user.id
                 self.object_storage_name = source_data.data_path
                 client = get_s3_client()
-                from minio import Minio
-                if not client.bucket_exists(self.object_storage_bucket):
-                    client.make_bucket(self.object_storage_bucket)
+                ensure_bucket(self.object_storage_bucket, client)
                 try:
                     client.stat_object(self.object_storage_bucket, self.object_storage_name)
                 except Exception:
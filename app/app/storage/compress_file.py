@@ -5,27 +5,108 @@
 @module:compress_file
 @time:2022/09/05
 """
+import time
 import zipfile
+from collections import deque
 from urllib.parse import quote
-from io import BytesIO
-from typing import List, Dict
+from typing import Callable, Dict, Iterable, Iterator
 from fastapi.responses import StreamingResponse
 
+CHUNK_SIZE = 1024 * 1024
+# Deflating these again costs cpu for nothing, they are stored as is
+COMPRESSED_EXTENSIONS = frozenset({
+    "zip", "gz", "tgz", "bz2", "xz", "zst", "7z", "rar", "jar", "whl",
+    "jpg", "jpeg", "png", "gif", "webp", "mp3", "mp4", "avi", "mkv", "mov",
+    "h5", "hdf5", "nc", "parquet", "tif", "tiff", "docx", "xlsx", "pptx", "pdf"
+})
 
-async def compress_files2zip(dir_name: str, file_objects: List[Dict]):
-    zip_file_name = "%s.zip" % dir_name
-    file_object = BytesIO()
-    with zipfile.ZipFile(file_object, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+
+class _ZipOutput:
+    """
+    Write only sink of the zip writer, the written bytes are drained by the response generator.
+    No seek: zipfile writes data descriptors instead of rewriting the local headers.
+    """
+
+    def __init__(self):
+        self._chunks = deque()
+        self._offset = 0
+        self.buffered = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._offset += len(data)
+        self.buffered += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.buffered = 0
+        return data
+
+
+def is_compressed(name: str) -> bool:
+    return name.rsplit('.', maxsplit=1)[-1].lower() in COMPRESSED_EXTENSIONS
+
+
+def iter_file_chunks(file_path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def iter_zip(file_objects: Iterable[Dict], store_compressed: bool = True,
+             chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Zip archive produced while the members are read, memory stays around chunk_size whatever the archive size.
+    ZIP64 records are written as soon as a member or the archive needs them.
+    :param file_objects: {"name": member name, "chunks": callable returning the member bytes chunk by chunk,
+                          "size": member size when known, "mtime": modification timestamp when known}
+    :param store_compressed: store the already compressed formats without deflating them again
+    :param chunk_size: bytes buffered before they are emitted
+    """
+    output = _ZipOutput()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zip_file:
         for _ in file_objects:
-            zip_file.writestr(_['name'], _['data'])
-        zip_file.close()
-        ""
-        "application/x-zip-compressed"
+            mtime = _.get('mtime')
+            zinfo = zipfile.ZipInfo(_['name'], date_time=time.localtime(mtime or time.time())[:6])
+            zinfo.compress_type = zipfile.ZIP_STORED if store_compressed and is_compressed(_['name']) \
+                else zipfile.ZIP_DEFLATED
+            size = _.get('size')
+            if size is not None:
+                zinfo.file_size = size
+            # Without a known size the member may outgrow 4GiB, its ZIP64 extra must be reserved up front
+            with zip_file.open(zinfo, 'w', force_zip64=size is None) as member:
+                chunks: Callable[[], Iterable[bytes]] = _['chunks']
+                for chunk in chunks():
+                    member.write(chunk)
+                    if output.buffered >= chunk_size:
+                        yield output.drain()
+            if output.buffered >= chunk_size:
+                yield output.drain()
+    # Remaining member data and the central directory
+    yield output.drain()
+
+
+def compress_files2zip(dir_name: str, file_objects: Iterable[Dict], store_compressed: bool = True):
+    zip_file_name = "%s.zip" % dir_name
+    # A sync generator: starlette pulls it in the threadpool, the blocking reads do not stall the event loop
     return StreamingResponse(
-        iter([file_object.getvalue()]),
+        iter_zip(file_objects, store_compressed=store_compressed),
         media_type="application/octet-stream",
         headers={"Content-Disposition": f"attachment;filename={quote(zip_file_name)}"}
     )
 
+
 if __name__ == '__main__':
     ...
@@ -5,21 +5,27 @@
 @module:file_system
 @time:2022/09/05
 """
-import asyncio
+import os
 import pathlib
 from urllib.parse import quote
 from fastapi import status
 from fastapi.responses import JSONResponse, StreamingResponse
-from app.storage.compress_file import compress_files2zip
+from app.storage.compress_file import compress_files2zip, iter_file_chunks
 
 
-async def file_stream(file_path, data_path):
-    with open(file_path, 'rb') as f:
-        _data = f.read()
+def file_stream(file_path: str, data_path: str) -> dict:
     if data_path and data_path[-1] != '/':
         data_path += '/'
-    relative_paths = file_path.replace(data_path, '')
-    return {"data": _data, "name": relative_paths}
+    relative_paths = file_path.replace(data_path, '', 1)
+    _stat = os.stat(file_path)
+    return {"name": relative_paths, "chunks": lambda: iter_file_chunks(file_path),
+            "size": _stat.st_size, "mtime": _stat.st_mtime}
+
+
+def dir_file_streams(data_path: str):
+    for root, _, files in os.walk(data_path):
+        for _ in sorted(files):
+            yield file_stream(os.path.join(root, _), data_path)
 
 
 async def file_storage_stream(data_path, file_name=None):
@@ -28,17 +34,11 @@ async def file_storage_stream(data_path, file_name=None):
         return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
                             content={'msg': "File does not exist！"})
     if _file_path.is_dir():
-        tasks = list()
-        for _ in _file_path.iterdir():
-            _ = _.__str__()
-            tasks.append(asyncio.create_task(file_stream(_, data_path)))
-        await asyncio.wait(tasks)
-        result_response = await compress_files2zip(_file_path.name, [_.result() for _ in tasks])
-        return result_response
+        # Members are read chunk by chunk while the archive is sent
+        return compress_files2zip(_file_path.name, dir_file_streams(data_path))
 
     def singe_file(file_path):
-        with open(file_path, 'rb') as f:
-            yield from f
+        yield from iter_file_chunks(file_path)
     if file_name is None:
         file_name = data_path.rsplit('/',maxsplit=1)[-1]
     return StreamingResponse(
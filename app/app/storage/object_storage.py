@@ -7,36 +7,46 @@
 """
 import pathlib
 from urllib.parse import quote
-import asyncio
 from minio import Minio
 from fastapi import status
 from fastapi.responses import StreamingResponse, JSONResponse
-from app.utils.middleware_util import get_s3_client, s32dir_tree
-from app.storage.compress_file import compress_files2zip
+from app.utils.middleware_util import get_s3_client
+from app.utils.minio_util import async_list_objects
+from app.storage.compress_file import CHUNK_SIZE, compress_files2zip
 
 
-async def oss_file_stream(bucket: str, object_name: str, client: Minio, base_dir: str):
-    _data = client.get_object(bucket, object_name).read()
-    return {"data": _data, "name": object_name.replace(base_dir, '')}
+def oss_file_chunks(bucket: str, object_name: str, client: Minio, chunk_size: int = CHUNK_SIZE):
+    response = client.get_object(bucket, object_name)
+    try:
+        yield from response.stream(chunk_size)
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def oss_file_stream(bucket: str, obj, client: Minio, base_dir: str) -> dict:
+    return {"name": obj.object_name.replace(base_dir, '', 1).lstrip('/'),
+            "chunks": lambda: oss_file_chunks(bucket, obj.object_name, client),
+            "size": obj.size,
+            "mtime": obj.last_modified.timestamp() if obj.last_modified else None}
 
 
 async def object_storage_stream(lab_id, object_name):
     client = get_s3_client()
     object_name = object_name[:-1] if object_name[-1] == "/" else object_name
-    lis_obj = list(client.list_objects(lab_id, prefix=object_name))
-    if list(lis_obj) and lis_obj[0].is_dir:
-        tasks = list()
-        _d = s32dir_tree(lab_id, object_name, client=client, recursive=True)
-        for _ in _d:
-            tasks.append(asyncio.create_task(oss_file_stream(lab_id, _['data_path'], client, object_name)))
-        await asyncio.wait(tasks)
-        result_response = await compress_files2zip(object_name.rsplit('/')[-1], [_.result() for _ in tasks])
+    lis_obj = await async_list_objects(lab_id, prefix=object_name)
+    if lis_obj and lis_obj[0].is_dir:
+        # Listed and read lazily while the archive is sent
+        _objects = client.list_objects(lab_id, prefix=f"{object_name}/", recursive=True)
+        result_response = compress_files2zip(object_name.rsplit('/')[-1],
+                                             (oss_file_stream(lab_id, _, client, object_name) for _ in _objects
+                                              if not _.is_dir))
     else:
         def singe_file(lab_id, file_path):
             try:
-                yield from client.get_object(lab_id, file_path)
+                yield from oss_file_chunks(lab_id, file_path, client)
             except:
-                yield from client.get_object(lab_id, '/'.join(file_path[1:].split('/')[1:]))
+                yield from oss_file_chunks(lab_id, '/'.join(file_path[1:].split('/')[1:]), client)
         try:
             file_name = quote(object_name.rsplit('/', maxsplit=1)[-1])
             "decoding"
@@ -0,0 +1,21 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:conftest
+@time:2023/06/26
+
+Placeholder values for the settings without default, the unit tests reach no external service
+"""
+import os
+
+for _name in ("MONGODB_SERVER", "MONGODB_DB", "FaaS_GATEWAY", "FaaS_USER", "FaaS_PASSWORD", "ASYNC_FUNCTION_DOMAIN",
+              "FUNCTION_DOMAIN", "BUILD_DIR", "TEMPLATE_DIR", "STANDALONE_FUNCTION_DOMAIN", "MINIO_URL",
+              "MINIO__ACCESS_KEY", "MINIO_SECRET_KEY", "REDIS_HOST", "HARBOR_URL", "HARBOR_PROJECTS",
+              "HARBOR_ROBOT_NAME", "HARBOR_USER", "HARBOR_PASSWORD", "MARKET_API", "NOTEBOOK_GATEWAY_ADMIN",
+              "NOTEBOOK_GATEWAY_ADMIN_UPSTREAM", "NOTEBOOK_GATEWAY_ADMIN_ROUTER", "NOTEBOOK_GATEWAY_URI",
+              "LAKE_ADMIN_URL", "LAKE_ADMIN_USERNAME", "LAKE_ADMIN_TOKEN"):
+    os.environ.setdefault(_name, "test")
+os.environ.setdefault("REDIS_PORT", "6379")
+os.environ.setdefault("MINIO_SECURE", "false")
+os.environ.setdefault("STANDALONE_MODEL", "false")
@@ -0,0 +1,68 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:test_dag_queries
+@time:2023/06/26
+"""
+import datetime
+import mongomock
+import pytest
+from mongoengine import connect, disconnect
+from app.models.mongo import ToolTaskModel, XmlToolSourceModel, DataFileSystem
+from app.core.flow.flow import DAG
+
+EXPERIMENT = "experiment"
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    """
+    Queries sent to the database, counted on the mongomock collections
+    """
+    connect("datalab_test", host="mongomock://localhost", alias="default")
+    counter = {"n": 0}
+    for _method in ("find", "find_one", "aggregate", "count_documents"):
+        _original = getattr(mongomock.collection.Collection, _method)
+
+        def _counted(self, *args, __original=_original, **kwargs):
+            counter["n"] += 1
+            return __original(self, *args, **kwargs)
+        monkeypatch.setattr(mongomock.collection.Collection, _method, _counted)
+    yield counter
+    disconnect(alias="default")
+
+
+def _experiment(tasks: int):
+    """
+    A chain of tasks, each one reading the output file of the previous one
+    """
+    for _model in (ToolTaskModel, XmlToolSourceModel, DataFileSystem):
+        _model.drop_collection()
+    _start = datetime.datetime(2023, 1, 1)
+    for k in range(tasks):
+        XmlToolSourceModel._get_collection().insert_one({"_id": f"tool{k}", "name": f"tool{k}",
+                                                         "folder_name": f"tool{k}"})
+        DataFileSystem._get_collection().insert_one({
+            "_id": f"file{k}", "name": f"out{k}", "lab_id": EXPERIMENT, "task_id": f"task{k}", "data_path": "/out",
+            "is_file": True, "is_dir": False, "store_name": EXPERIMENT, "data_size": 1, "from_source": "task",
+            "deps": 0})
+        _inputs = [{"name": "in", "type": "file", "data": {"id": f"file{k - 1}", "is_file": True}}] if k else \
+            [{"name": "in", "type": "text", "data": "text"}]
+        ToolTaskModel._get_collection().insert_one({
+            "_id": f"task{k}", "name": f"task{k}", "tool": f"tool{k}", "experiment": EXPERIMENT, "status": "Success",
+            "created_at": _start + datetime.timedelta(minutes=k), "inputs": _inputs,
+            "outputs": [{"name": "out", "type": "file", "data": {"id": f"file{k}", "name": f"out{k}"}}]})
+
+
+@pytest.mark.parametrize("tasks", [5, 40, 200])
+def test_from_experiments_queries_do_not_grow_with_tasks(queries, tasks):
+    _experiment(tasks)
+    queries["n"] = 0
+    dag = DAG(EXPERIMENT)
+    dag.from_experiments()
+    graph = dag.front_graph()
+    # One query for the tasks, then one per kind of metadata, whatever the number of tasks
+    assert queries["n"] == 3
+    assert len(dag.task_nodes) == tasks
+    assert len(graph) == 2 * tasks + 1
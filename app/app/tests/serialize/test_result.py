@@ -0,0 +1,113 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:test_result
+@time:2023/06/26
+"""
+import io
+import pickle
+import asyncio
+import numpy as np
+import pytest
+from fastapi.responses import JSONResponse
+from minio.error import S3Error
+from app.core.serialize import result
+
+
+class _Stat:
+    def __init__(self, etag):
+        self.etag = etag
+
+
+class _Object:
+    def __init__(self, object_name):
+        self.object_name = object_name
+        self.is_dir = True
+
+
+class MemoryStorage:
+    """
+    The calls of MinIO used by the result store, on a dict
+    """
+
+    def __init__(self):
+        self.objects = dict()
+        # Objects failing with something else than S3Error
+        self.broken = set()
+
+    def _get(self, bucket, name):
+        if (bucket, name) in self.broken:
+            raise OSError("connection reset")
+        if (bucket, name) not in self.objects:
+            raise S3Error("NoSuchKey", "no such key", name, "", "", None)
+        return self.objects[(bucket, name)]
+
+    def stat_object(self, bucket, name):
+        return _Stat(str(hash(self._get(bucket, name))))
+
+    def put_object(self, bucket, name, data, length, content_type=None):
+        self.objects[(bucket, name)] = data.read()
+
+    def list_objects(self, bucket, prefix=None, recursive=False):
+        return [_Object(_) for _ in sorted({n.split("/")[0] + "/" for b, n in self.objects if b == bucket})]
+
+    def read_object(self, bucket, name, offset=0, length=0):
+        _data = self._get(bucket, name)
+        return _data[offset:offset + length] if length else _data[offset:]
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    _storage = MemoryStorage()
+    monkeypatch.setattr(result, "minio_client", lambda: _storage)
+    monkeypatch.setattr(result, "read_object", _storage.read_object)
+    monkeypatch.setattr("app.utils.minio_util.minio_client", lambda: _storage)
+    return _storage
+
+
+def _store(storage, task_id, data):
+    storage.objects[("lab", f"{task_id}/{result.RESULT_OBJECT}")] = pickle.dumps(data)
+
+
+def test_non_finite_floats_are_rendered_as_null(storage):
+    _store(storage, "array", np.array([[1.0, np.nan], [np.inf, -np.inf]]))
+    _store(storage, "list", [1.5, float("nan"), {"x": float("inf")}, np.float32("nan")])
+
+    async def _read():
+        return (await result.async_result_previews("lab"),
+                await result.async_result_page("lab", "array/", 0),
+                await result.async_result_page("lab", "list/", 0))
+
+    previews, (_, array_page), (_, list_page) = asyncio.run(_read())
+    assert [_["data"] for _ in previews] == [[[1.0, None], [None, None]], [1.5, None, {"x": None}, None]]
+    assert array_page == [[1.0, None], [None, None]]
+    assert list_page == [1.5, None, {"x": None}, None]
+    # The listing and the pages go through JSONResponse, which refuses NaN
+    JSONResponse(content={"data": previews})
+    JSONResponse(content={"data": [array_page, list_page]})
+
+
+def test_keys_json_can_not_encode_are_stringified(storage):
+    _store(storage, "tuple", {(1, 2): 3, "a": 1})
+    _store(storage, "numpy", {np.int64(1): 2, np.float64("nan"): 3})
+    assert result.describe({(1, 2): 3})["preview"] == {"(1, 2)": 3}
+
+    async def _read():
+        return (await result.async_result_previews("lab"),
+                await result.async_result_page("lab", "tuple/", 0),
+                await result.async_result_page("lab", "numpy/", 0))
+
+    previews, (_, tuple_page), (_, numpy_page) = asyncio.run(_read())
+    assert [_["data"] for _ in previews] == [{"1": 2, "nan": 3}, {"(1, 2)": 3, "a": 1}]
+    assert tuple_page == {"(1, 2)": 3, "a": 1}
+    assert numpy_page == {"1": 2, "nan": 3}
+    JSONResponse(content={"data": previews})
+
+
+def test_one_failing_result_does_not_fail_the_listing(storage):
+    _store(storage, "good", [1, 2])
+    _store(storage, "bad", [3])
+    storage.broken.add(("lab", f"bad/{result.RESULT_OBJECT}"))
+    previews = asyncio.run(result.async_result_previews("lab"))
+    assert [_["id"] for _ in previews] == ["lab_good"]
@@ -2,11 +2,11 @@ import asyncio
 from datetime import datetime
 from typing import Optional, Dict, List, Tuple, Union
 
-import aioredis
 from fastapi import status, BackgroundTasks
 from mongoengine.queryset.visitor import Q
 
 from app.core.config import settings
+from app.db.redis_util import redis_registry
 from app.models.mongo import (
     AnalysisModel2,
     ExperimentModel,
@@ -418,11 +418,7 @@ async def _update_skeletons_cache(
     # t1 = time.time()
 
     try:
-        redis_conn = await aioredis.StrictRedis(host=settings.REDIS_HOST,
-                                                port=settings.REDIS_PORT,
-                                                db=settings.SKELETON_DATA_CACHE_DB,  # note
-                                                encoding="utf-8",
-                                                decode_responses=True)  # Set to True，Return dict is str，is bytes
+        redis_conn = redis_registry.connection(settings.SKELETON_DATA_CACHE_DB)
 
         if redis_conn:
             # for skeletonModel in skeletonModels:
@@ -459,8 +455,6 @@ async def _update_skeletons_cache(
                     # New/Overlay cache
                     if redis_conn:
                         await redis_conn.hset(name=cache_key, mapping=skeleton_data)
-                        # Shut down
-                        await redis_conn.close()
                 except Exception as e:
                     print(f'e: {e}')
                     continue
@@ -593,11 +587,7 @@ async def read_skeletons(
 
     # Establishing a cache link
     try:
-        redis_conn = await aioredis.StrictRedis(host=settings.REDIS_HOST,
-                                                port=settings.REDIS_PORT,
-                                                db=settings.SKELETON_DATA_CACHE_DB,  # note
-                                                encoding="utf-8",
-                                                decode_responses=True)  # Set to True，Return dict is str，is bytes
+        redis_conn = redis_registry.connection(settings.SKELETON_DATA_CACHE_DB)
     except Exception as e:
         print(f'e: {e}')
         redis_conn = None
@@ -623,13 +613,6 @@ async def read_skeletons(
     # t3 = time.time()
     # print(f'read_skeletons: t3 - t2: {t3 - t2}')
 
-    # Shut down
-    try:
-        if redis_conn:
-            await redis_conn.close()
-    except Exception as e:
-        print(f'e: {e}')
-
     # # refresh skeletonModels right
     background_tasks.add_task(_update_skeletons_cache, menu=menu, skeleton_ids=skeleton_ids)
 
@@ -1,10 +1,15 @@
 import uuid
-from typing import Dict, Optional
+from copy import deepcopy
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional
 from datetime import datetime, timedelta
 import hashlib
 import pytz
 from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON
 from mongoengine import Document
+from app.utils.pagination_util import reference_key, reference_names
 
 
 def generate_uuid(length=26) -> str:
@@ -85,6 +90,134 @@ def convert_mongo_document_to_schema(document: Document,
     #         k, v in schema_instance.dict().items()}
 
 
+def _to_str(v):
+    if isinstance(v, str):
+        return v
+    if isinstance(v, (int, float, Decimal)) and not isinstance(v, bool):
+        return str(v)
+    raise TypeError
+
+
+def _to_int(v):
+    if isinstance(v, int) and not isinstance(v, bool):
+        return v
+    if isinstance(v, (bool, float, str, Decimal)):
+        return int(v)
+    raise TypeError
+
+
+def _to_float(v):
+    if isinstance(v, (int, float, str, Decimal)) and not isinstance(v, bool):
+        return float(v)
+    raise TypeError
+
+
+def _to_bool(v):
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, int) and v in (0, 1):
+        return bool(v)
+    if isinstance(v, str) and v.lower() in _BOOL_STRINGS:
+        return _BOOL_STRINGS[v.lower()]
+    raise TypeError
+
+
+_BOOL_STRINGS = {"0": False, "off": False, "f": False, "false": False, "n": False, "no": False,
+                 "1": True, "on": True, "t": True, "true": True, "y": True, "yes": True}
+_CONVERTERS = {str: _to_str, int: _to_int, float: _to_float, bool: _to_bool}
+_PASS_THROUGH = (Any, list, dict, tuple, set)
+
+
+@lru_cache(maxsize=None)
+def _schema_plan(schema_cls) -> Optional[tuple]:
+    """
+    (name, converter, required, allow_none, default factory) of every field of schema_cls,
+    None when the schema has validators, aliases, fields of other models or containers of typed elements:
+    pydantic builds those rows
+    """
+    if schema_cls.__validators__ or schema_cls.__pre_root_validators__ or schema_cls.__post_root_validators__:
+        return None
+    plan = list()
+    for name, field in schema_cls.__fields__.items():
+        if field.alias != name:
+            return None
+        if field.shape == SHAPE_SINGLETON and field.type_ in _CONVERTERS:
+            converter = _CONVERTERS[field.type_]
+        elif field.shape == SHAPE_SINGLETON and field.type_ in _PASS_THROUGH or \
+                field.shape != SHAPE_SINGLETON and field.type_ is Any:
+            # Containers of typed elements are coerced element by element by pydantic
+            converter = None
+        else:
+            return None
+        _default = field.default
+        plan.append((name, converter, field.required, field.allow_none,
+                     field.default_factory or (lambda _=_default: deepcopy(_))))
+    return tuple(plan)
+
+
+def _serialize(data: Dict, schema_cls, plan: Optional[tuple]) -> Dict:
+    if plan is None:
+        return schema_cls(**data).dict()
+    result = dict()
+    try:
+        for name, converter, required, allow_none, default in plan:
+            if name not in data:
+                if required:
+                    raise TypeError
+                result[name] = default()
+                continue
+            v = data[name]
+            if v is None:
+                if not allow_none:
+                    raise TypeError
+                result[name] = None
+            else:
+                result[name] = v if converter is None else converter(v)
+    except (TypeError, ValueError):
+        # Let pydantic coerce what the plan does not know, or raise its usual ValidationError
+        return schema_cls(**data).dict()
+    return result
+
+
+def convert_mongo_documents_to_schema(documents: Iterable[Document],
+                                      schema_cls: BaseModel,
+                                      user: bool = False,
+                                      revers_map: list = None,
+                                      revers_id: bool = False
+                                      ) -> List[Dict]:
+    """
+    Batch version of convert_mongo_document_to_schema, same result for every document:
+    the references of all the documents are fetched with one query per referenced collection,
+    rows are serialized from to_mongo() and only go through the pydantic model when a value needs it.
+    :param documents: queryset or list of documents of one model
+    """
+    documents = list(documents)
+    revers_map = list(revers_map or [])
+    _fields = [k for k in revers_map if not revers_id]
+    if user and 'user' not in _fields:
+        _fields.append('user')
+    names = reference_names(documents, _fields) if _fields else dict()
+    plan = _schema_plan(schema_cls)
+    result = list()
+    for document in documents:
+        _data = document.to_mongo().to_dict()
+        _data["id"] = str(_data.pop("_id"))
+        if user:
+            _data['user'] = names['user'].get(_data.get('user'), _data.get('user'))
+        for k in revers_map:
+            if k not in _data:
+                continue
+            _key = reference_key(_data[k])
+            if revers_id:
+                _data[k] = _key
+            elif _key in names.get(k, ()):
+                # A missing reference keeps its raw value, as the row by row conversion does
+                _data[k] = names[k][_key]
+        result.append(_serialize({k: v.strftime('%Y/%m/%d %H:%M:%S') if isinstance(v, datetime) else v
+                                  for k, v in _data.items()}, schema_cls, plan))
+    return result
+
+
 def get_md5(s):
     m = hashlib.md5()
     m.update(s.encode())
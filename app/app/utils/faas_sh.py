@@ -9,7 +9,7 @@ import time
 import pathlib
 import subprocess
 from app.core.config import settings
-from app.utils.middleware_util import get_redis_con
+from app.db.redis_util import redis_registry
 from app.utils.k8s_util.cluster import CloudCluster
 
 
@@ -21,7 +21,7 @@ class FunctionsCli:
         self.gateway = gateway
         self.user = user
         self.password = password
-        self.publisher = get_redis_con(1)
+        self.publisher = redis_registry.sync(settings.FUNCTION_BUILD_DB)
 
     @classmethod
     def create_client(cls):
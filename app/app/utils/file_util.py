@@ -12,6 +12,10 @@ from app.models.mongo import DataFileSystem, UserModel
 from app.utils.common import generate_uuid
 from app.models.mongo.public_data import PublicDataFileModel, PublicDatasetModel
 from app.utils.middleware_util import get_s3_client
+from app.service.manager.ingest import TreeIngestor
+from app.service.manager.hierarchy import copy_subtree, delete_subtree, subtree_ids
+from app.service.manager.datasets import PublicDatasetStats
+from starlette.concurrency import run_in_threadpool
 import datetime
 import base64
 
@@ -80,23 +84,6 @@ def clean_after_fail_parse_tool_zip(zipfile_name: str,
         logging.info(f"deleted dir: {unzipped_path}")
 
 
-def insert_one(user_id, data: dict):
-    his = DataFileSystem.objects(name=data['name'], user=user_id)
-    if his.first():
-        his.update_one(data_size=data['size'])
-    else:
-        DataFileSystem(id=generate_uuid(), name=data['name'], is_file=not data['is_dir'], store_name=data['name'],
-                       data_size=data['size'],
-                       data_path=data['name'], from_source="UPLOADED", deleted=0,
-                       created_at=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                       updated_at=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                       data_type="myData", alias_name=data['alias_name'],
-                       parent=data['parent'], child=data['child'], is_dir=data['is_dir'],
-                       deps=data['deps'], file_extension=data['format'] if data.get('format') else "",
-                       user=user_id
-                       ).save()
-
-
 def get_img_b64_stream(img_local_path: Union[str, Path]):
     """
     Get the local image stream
@@ -146,148 +133,31 @@ def convert_base64_str_to_bytes(img_str: str):
 
 
 async def generate_dir(source, data_type, deps=1, storage_path: str = "", inc_con=None, user_id=None):
-    _different = len(pathlib.Path(source).parents) - 1
-    storage_path = storage_path + '/'
-    if pathlib.Path(source).is_dir():
-        deps_map = dict()
-        deps_map[_different] = dict()
-        deps_map[_different][source] = {
-            "name": source,
-            "alias_name": 'root',
-            "parent": None,
-            "child": [],
-            "size": 0,
-            "is_dir": "True",
-            "data_type": data_type,
-            "deps": _different
-
-        }
-        file_list = list()
-        for root, dirs, files in os.walk(source):
-            for _dir in dirs:
-                sub_dir_name = os.path.join(root, _dir)
-                sub_dir_path = pathlib.Path(sub_dir_name)
-                parent_name = sub_dir_path.parent.__fspath__()
-                inner_deps = len(sub_dir_path.parents) - deps
-                if deps_map.get(inner_deps) is None:
-                    deps_map[inner_deps] = dict()
-                deps_map[inner_deps][sub_dir_name] = {"name": sub_dir_name,
-                                                      "alias_name": sub_dir_name[1:],
-                                                      "parent": parent_name,
-                                                      "child": [],
-                                                      "size": 0,
-                                                      "is_dir": "true",
-                                                      "data_type": data_type,
-                                                      "deps": inner_deps}
-            for name in files:
-                sub_file_name = os.path.join(root, name)
-                sub_path = pathlib.Path(sub_file_name)
-                parent_name = sub_path.parent.__fspath__()
-                child = list()
-                file_list.append({"name": sub_file_name, "alias_name": sub_file_name.replace(source, '')[1:],
-                                  "parent": parent_name, "child": child, "size": sub_path.stat().st_size,
-                                  "is_dir": "false",
-                                  "data_type": data_type, "deps": len(sub_path.parents) - deps,
-                                  "format": sub_path.suffix.rsplit('.', maxsplit=1)[-1]})
-
-        def inner_add(base, size, add_child=None):
-            base['size'] += size
-            if base['deps'] > _different:
-                parent = deps_map[base['deps'] - 1][base['parent']]
-                parent["size"] += size
-                if add_child:
-                    parent["child"].append(base["name"])
-                if parent['parent'] is not None and parent['deps'] > 0:
-                    inner_add(deps_map[parent['deps'] - 1][parent['parent']], size)
-
-        file_list.sort(key=lambda x: x['deps'], reverse=True)
-        for _ in file_list:
-            parent_dir_deps = _['deps'] - 1
-            # Bottom-up aggregationsize
-            parend_dir = deps_map[parent_dir_deps][_['parent']]
-            inner_add(parend_dir, _['size'])
-            parend_dir['child'].append(_['name'])
-        deps_map[_different][source]['parent'] = "root"
-        for _ in file_list:
-            _['child'] = _['child']
-            _['name'] = _['name'].replace(storage_path, "")
-            _['parent'] = _['parent'].replace(storage_path, "")
-            _['deps'] = _['deps'] - _different
-            # DataFileSystem(**_).save()
-            insert_one(user_id, _)
-        for v in deps_map.values():
-            for _v in v.values():
-                _v['name'] = _v['name'].replace(storage_path, "")
-                _v['parent'] = _v['parent'].replace(storage_path, "")
-                _v['deps'] = _v['deps'] - _different
-                # print(_v)
-                # DataFileSystem(**_v).save()
-                insert_one(user_id, _v)
-
-        await cache_cumulative_sum(user_id, deps_map[_different][source]["size"],
-                                   f"{deps_map[_different][source]['name']}", inc_con)
-    else:
-        _size = pathlib.Path(source).stat().st_size
-        _ = {"name": source.replace(storage_path, ""),
-             "alias_name": source.replace(storage_path, ""),
-             "parent": "root",
-             "child": [],
-             "size": _size,
-             "is_dir": "false",
-             "data_type": data_type,
-             "deps": 0,
-             "format": pathlib.Path(source).suffix.rsplit('.', maxsplit=1)[-1]}
-        # DataFileSystem(**_).save()
-        insert_one(user_id, _)
-        await cache_cumulative_sum(user_id, _size,
-                                   _['name'], inc_con)
+    """
+    Rows of source and of everything below it, source lies under storage_path.
+    One scan of the tree and bulk upserts: uploading the same tree again updates the same rows.
+    """
+    _summary = await run_in_threadpool(TreeIngestor(storage_path, user_id, data_type=data_type).ingest, source)
+    await cache_cumulative_sum(user_id, _summary["size"], str(source), inc_con)
+    return _summary
 
 
 def generate_datasets_model(dataset_id, user_id, datasets_id=None):
+    """
+    Ids of dataset_id and of every row of the user below it
+    """
     if datasets_id is None:
         datasets_id = []
     datasets_id.append(dataset_id)
-    _d = DataFileSystem.objects(id=dataset_id).first()
-    if _d is not None:
-        deps = _d.deps + 1
-        name = _d.name
-        _dfs = DataFileSystem.objects(user=user_id, deps=deps).filter(
-            __raw__={'name': {'$regex': f'.*{name}*'}})
-        for _ in _dfs:
-            _p = DataFileSystem.objects(id=_.id).first()
-            generate_datasets_model(_p.id, user_id, datasets_id)
-
+    datasets_id.extend(_ for _ in subtree_ids(dataset_id, user=user_id) if _ != dataset_id)
     return datasets_id
 
 
 def share_util(data_model: DataFileSystem, to_user: UserModel, user: UserModel):
-    replica_data = list()
-    # if data_model.is_dir:
-    _dfs = DataFileSystem.objects(user=data_model.user.id).filter(
-        __raw__={'data_path': {'$regex': f'.*{data_model.data_path}*'}})
-    new2old = dict()
-    for i in _dfs:
-        item = i.to_mongo().to_dict()
-        key = item.pop('_id')
-        item['id'] = generate_uuid()
-        new2old[key] = item['id']
-        item['user'] = to_user
-        item['public'] = "PRIVATE"
-        item['from_user'] = user
-        item['from_source'] = i.id
-        item['lab_id'] = None
-        item['task_id'] = None
-        replica_data.append(item)
-    for i in replica_data:
-        if i.get("parent") != "root":
-            i['parent'] = new2old.get(i['parent'])
-
-        DataFileSystem(**i).save()
-
-
-
-
-
+    # One query for the whole subtree and one bulk insert of the copies, placed at the root of to_user
+    copy_subtree(data_model, parent="root", origin_field="from_source",
+                 user=getattr(to_user, "id", to_user), public="PRIVATE", from_user=user.id,
+                 lab_id=None, task_id=None)
 
 
 def stream_to_b64_stream(stream: BinaryIO):
@@ -319,8 +189,9 @@ async def file_upload_task(con, dataset_id, file, description, data_id, update,
     _new_name = file.filename.split('/')
     try:
         if update:
+            _old_size = _search.first().data_size or 0
             _search.update_one(updated_at=datetime.datetime.utcnow(), description=description, data_size=size)
-            _pd.update_one(data_size=abs(_pd.first().data_size - _search.first().data_size) + size)
+            PublicDatasetStats.record(dataset_id, 0, size - _old_size)
         else:
             public_ds = PublicDataFileModel(
                 id=data_id,
@@ -339,10 +210,7 @@ async def file_upload_task(con, dataset_id, file, description, data_id, update,
                 deps=len(_new_name) - 1
             )
             public_ds.save()
-            old_files = _pd.first().files
-            old_size = _pd.first().data_size
-            _pd.update_one(files=old_files + 1 if old_files else 1,
-                           data_size=size if old_size is None else old_size + size)
+            PublicDatasetStats.record(dataset_id, 1, size, public_ds.created_at)
     except Exception as e:
         await con.set(f"{data_id}-task", 'ERROR')
         await con.set(f"{data_id}", str(e))
@@ -352,29 +220,16 @@ async def file_upload_task(con, dataset_id, file, description, data_id, update,
 
 async def del_datasets(datasets_id: Union[list, str], user: UserModel, redis_con):
     if isinstance(datasets_id, list):
-        _files = DataFileSystem.objects(id__in=datasets_id, user=user)
-        update_set = list()
-        update_set.extend(datasets_id)
+        _files = DataFileSystem.objects(id__in=datasets_id, user=user).only("data_size").as_pymongo()
         cut_size = 0
         for _f in _files:
-            # Individual additions and uploads are impossible to duplicate
-            if _f.data_type == "myData":
-                all_subset = DataFileSystem.objects(user=user, data_path__contains=_f.data_path)
-                for subset in all_subset:
-                    update_set.append(subset.id)
-            # The calculated output data may be duplicated
-            else:
-                all_subset = DataFileSystem.objects(user=user, lab_id=_f.lab_id, task_id=_f.task_id,
-                                                    data_path__contains=_f.data_path)
-                for subset in all_subset:
-                    update_set.append(subset.id)
             try:
-                cut_size += _f.data_size
+                cut_size += _f["data_size"]
             except Exception as e:
                 print(e)
                 pass
-        # 1. Cut down on personal resources, 2.Delete
-        DataFileSystem.objects(id__in=update_set).update(deleted=True)
+        # 1. Cut down on personal resources, 2.Delete: the selected rows and their subtrees in one update
+        delete_subtree(datasets_id, user=user)
     else:
         _files = DataFileSystem.objects(id=datasets_id, user=user).first()
         cut_size = 0
@@ -0,0 +1,72 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:http_util
+@time:2023/06/02
+"""
+import asyncio
+from typing import Optional
+
+import httpx
+
+from app.core.config import settings
+
+# Failures where the request provably never reached the gateway: always safe to send again
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Gateway responses retried for the callers that opt in, the function may have been accepted already
+RETRY_STATUS_CODES = {502, 503, 504}
+
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=settings.FAAS_HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=settings.FAAS_HTTP_MAX_CONNECTIONS)
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(settings.FAAS_HTTP_TIMEOUT, connect=settings.FAAS_HTTP_CONNECT_TIMEOUT)
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Connection pooled client shared by the whole worker
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(limits=_limits(), timeout=_timeout())
+    return _async_client
+
+
+async def close_async_http_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def async_post(url: str, json: Optional[dict] = None, headers: Optional[dict] = None,
+                     retries: Optional[int] = None, retry_gateway_errors: bool = False) -> httpx.Response:
+    """
+    POST without blocking the event loop, retried with exponential backoff only when the request never left:
+    a POST timing out or dropped after being sent may have been dispatched, sending it again would run it twice
+    :param url: request address
+    :param json: request body
+    :param headers: request headers
+    :param retries: attempts after the first one, FAAS_HTTP_RETRIES by default
+    :param retry_gateway_errors: retry the 502, 503 and 504 responses as well, for idempotent requests only
+    :return: httpx.Response of the last attempt
+    """
+    retries = settings.FAAS_HTTP_RETRIES if retries is None else retries
+    client = get_async_http_client()
+    for attempt in range(retries + 1):
+        try:
+            res = await client.post(url, json=json, headers=headers)
+        except NOT_SENT_ERRORS:
+            if attempt == retries:
+                raise
+        else:
+            if not retry_gateway_errors or res.status_code not in RETRY_STATUS_CODES or attempt == retries:
+                return res
+        await asyncio.sleep(settings.FAAS_HTTP_BACKOFF * 2 ** attempt)
@@ -7,10 +7,8 @@
 """
 import hashlib
 
-import redis
-from minio import Minio
-
 from app.core.config import settings
+from app.utils.minio_util import minio_client, buckets
 
 
 def get_parent_dir(file_path):
@@ -22,15 +20,11 @@ def get_parent_dir(file_path):
     return None
 
 
-def get_redis_con(db):
-    return redis.Redis(host=settings.REDIS_HOST, db=db)
-
-
 def get_s3_client():
-    return Minio(settings.MINIO_URL,
-                 access_key=settings.MINIO__ACCESS_KEY,
-                 secret_key=settings.MINIO_SECRET_KEY,
-                 secure=settings.MINIO_SECURE)
+    """
+    The MinIO client of the process, its connections are reused by every caller
+    """
+    return minio_client()
 
 
 def s32dir_tree(task_id, iter_dep=None, client=None, recursive=False):
@@ -39,7 +33,7 @@ def s32dir_tree(task_id, iter_dep=None, client=None, recursive=False):
         client = get_s3_client()
     if iter_dep is not None and iter_dep[-1] != '/':
         iter_dep += '/'
-    if not client.bucket_exists(task_id):
+    if not buckets.exists(task_id, client):
         return _d
     object_list = client.list_objects(task_id, prefix=iter_dep, recursive=recursive)
     for obj in object_list:
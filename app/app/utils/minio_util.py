@@ -0,0 +1,168 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:minio_util
+@time:2023/06/22
+
+One MinIO client for the whole process: a single urllib3 pool of MINIO_CONNECTION_POOL_SIZE connections
+reused by every request. The async_* helpers run the blocking calls on a bounded thread pool, off the event loop.
+Existing buckets are remembered for MINIO_BUCKET_CACHE_TTL seconds instead of being checked before every operation.
+"""
+import os
+import time
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import certifi
+import urllib3
+from minio import Minio
+from minio.error import S3Error
+from app.core.config import settings
+
+# make_bucket losing a race against another worker
+BUCKET_CREATED_CODES = {"BucketAlreadyOwnedByYou", "BucketAlreadyExists"}
+
+_client: Optional[Minio] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def _http_client() -> urllib3.PoolManager:
+    # Same timeouts, certificates and retries as the default client of Minio, with a larger pool
+    timeout = settings.MINIO_TIMEOUT
+    return urllib3.PoolManager(
+        timeout=urllib3.util.Timeout(connect=timeout, read=timeout),
+        maxsize=settings.MINIO_CONNECTION_POOL_SIZE,
+        cert_reqs='CERT_REQUIRED',
+        ca_certs=os.environ.get('SSL_CERT_FILE') or certifi.where(),
+        retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+    )
+
+
+def minio_client() -> Minio:
+    """
+    Client shared by the whole process, thread safe
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = Minio(settings.MINIO_URL,
+                                access_key=settings.MINIO__ACCESS_KEY,
+                                secret_key=settings.MINIO_SECRET_KEY,
+                                secure=settings.MINIO_SECURE,
+                                http_client=_http_client())
+    return _client
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.MINIO_THREAD_POOL_SIZE,
+                                               thread_name_prefix="datalab-minio")
+    return _executor
+
+
+class BucketCache:
+    """
+    Buckets known to exist. Only the positive answers are kept: a missing bucket is checked again next time.
+    """
+
+    def __init__(self):
+        self._seen: Dict[str, float] = dict()
+        self._lock = threading.Lock()
+
+    def known(self, bucket: str) -> bool:
+        with self._lock:
+            _at = self._seen.get(bucket)
+            return _at is not None and time.monotonic() - _at < settings.MINIO_BUCKET_CACHE_TTL
+
+    def remember(self, bucket: str):
+        with self._lock:
+            self._seen[bucket] = time.monotonic()
+
+    def forget(self, bucket: str):
+        with self._lock:
+            self._seen.pop(bucket, None)
+
+    def exists(self, bucket: str, client: Optional[Minio] = None) -> bool:
+        if self.known(bucket):
+            return True
+        if (client or minio_client()).bucket_exists(bucket):
+            self.remember(bucket)
+            return True
+        return False
+
+    def ensure(self, bucket: str, client: Optional[Minio] = None):
+        """
+        Create bucket when it does not exist
+        """
+        if self.exists(bucket, client):
+            return
+        try:
+            (client or minio_client()).make_bucket(bucket)
+        except S3Error as e:
+            if e.code not in BUCKET_CREATED_CODES:
+                raise
+        self.remember(bucket)
+
+
+buckets = BucketCache()
+
+
+def ensure_bucket(bucket: str, client: Optional[Minio] = None):
+    buckets.ensure(bucket, client)
+
+
+def read_object(bucket: str, object_name: str, **kwargs) -> bytes:
+    """
+    Whole content of an object, its connection goes back to the pool
+    """
+    response = minio_client().get_object(bucket, object_name, **kwargs)
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+
+async def run_in_minio_pool(func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(),
+                                                            functools.partial(func, *args, **kwargs))
+
+
+async def async_bucket_exists(bucket: str) -> bool:
+    if buckets.known(bucket):
+        return True
+    return await run_in_minio_pool(buckets.exists, bucket)
+
+
+async def async_ensure_bucket(bucket: str):
+    if not buckets.known(bucket):
+        await run_in_minio_pool(buckets.ensure, bucket)
+
+
+async def async_get_object(bucket: str, object_name: str, **kwargs) -> bytes:
+    return await run_in_minio_pool(read_object, bucket, object_name, **kwargs)
+
+
+async def async_list_objects(bucket: str, prefix: Optional[str] = None, recursive: bool = False, **kwargs) -> List:
+    """
+    Objects listed in the pool: the listing pages are fetched there, not while iterating on the event loop
+    """
+    return await run_in_minio_pool(lambda: list(minio_client().list_objects(bucket, prefix=prefix,
+                                                                           recursive=recursive, **kwargs)))
+
+
+async def async_stat_object(bucket: str, object_name: str, **kwargs):
+    return await run_in_minio_pool(minio_client().stat_object, bucket, object_name, **kwargs)
+
+
+async def async_fput_object(bucket: str, object_name: str, file_path: str, **kwargs):
+    await async_ensure_bucket(bucket)
+    return await run_in_minio_pool(minio_client().fput_object, bucket, object_name, file_path, **kwargs)
@@ -0,0 +1,121 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:pagination_util
+@time:2023/06/17
+
+Pagination done by Mongo: skip, limit, sort and count are part of the query, only one page is read.
+References of the page are resolved with one id__in query per referenced collection.
+"""
+import json
+import base64
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from bson import DBRef
+from mongoengine import Document, Q
+from mongoengine.connection import get_db
+from mongoengine.queryset import QuerySet
+from mongoengine.fields import ReferenceField
+
+
+def paginate(queryset: QuerySet, skip: int = 0, limit: int = 10, *order_by: str) -> Tuple[List[Document], int]:
+    """
+    :param skip: rows skipped, not the page number
+    :param order_by: mongoengine order keys, "-created_at"
+    :return: documents of the page, total of the query
+    """
+    total = queryset.count()
+    if order_by:
+        queryset = queryset.order_by(*order_by)
+    return list(queryset.skip(max(skip, 0)).limit(limit)), total
+
+
+def _encode_cursor(value: Any, pk: Any) -> str:
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    return base64.urlsafe_b64encode(json.dumps([value, pk]).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[Any, Any]:
+    value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if isinstance(value, dict) and "$date" in value:
+        value = datetime.fromisoformat(value["$date"])
+    return value, pk
+
+
+def paginate_after(queryset: QuerySet, field: str, cursor: Optional[str] = None, limit: int = 10,
+                   descending: bool = True) -> Tuple[List[Document], Optional[str]]:
+    """
+    Keyset pagination on field then id: the cost of a page does not grow with its position
+    and rows inserted meanwhile neither shift nor repeat the next pages.
+    :param cursor: next of the previous page, None for the first page
+    :return: documents of the page, cursor of the next page or None after the last one
+    """
+    if cursor:
+        value, pk = _decode_cursor(cursor)
+        _op = "lt" if descending else "gt"
+        queryset = queryset.filter(Q(**{f"{field}__{_op}": value}) | Q(**{field: value, f"id__{_op}": pk}))
+    _sign = "-" if descending else "+"
+    documents = list(queryset.order_by(f"{_sign}{field}", f"{_sign}id").limit(limit + 1))
+    if len(documents) <= limit:
+        return documents, None
+    documents = documents[:limit]
+    return documents, page_cursor(documents[-1], field)
+
+
+def page_cursor(document: Document, field: str) -> str:
+    """
+    Cursor of the page following document, for paginate_after
+    """
+    return _encode_cursor(getattr(document, field), document.pk)
+
+
+def reference_names(documents: Iterable[Document], fields: Iterable[str],
+                    attribute: str = "name") -> Dict[str, Dict[Any, Any]]:
+    """
+    attribute of the documents referenced by fields, one query per referenced collection
+    whatever the number of documents. ReferenceField and GenericReferenceField are supported.
+    :return: {field: {referenced id: attribute}}
+    """
+    documents = list(documents)
+    fields = list(fields)
+    if not documents:
+        return {k: dict() for k in fields}
+    document_cls = type(documents[0])
+    wanted: Dict[str, set] = dict()
+    refs: Dict[str, List[Tuple[Any, Optional[str]]]] = {k: list() for k in fields}
+    for _doc in documents:
+        _raw = _doc.to_mongo()
+        for k in fields:
+            _value = _raw.get(k)
+            if _value is None:
+                continue
+            _field = document_cls._fields.get(k)
+            if isinstance(_value, dict) and "_ref" in _value:
+                # GenericReferenceField: {"_cls": ..., "_ref": DBRef(collection, id)}
+                _value = _value["_ref"]
+            if isinstance(_value, DBRef):
+                _collection, _id = _value.collection, _value.id
+            elif isinstance(_field, ReferenceField):
+                _collection, _id = _field.document_type._get_collection_name(), _value
+            else:
+                continue
+            wanted.setdefault(_collection, set()).add(_id)
+            refs[k].append((_id, _collection))
+    found: Dict[str, Dict[Any, Any]] = dict()
+    db = get_db()
+    for _collection, _ids in wanted.items():
+        found[_collection] = {_["_id"]: _.get(attribute) for _ in
+                              db[_collection].find({"_id": {"$in": list(_ids)}}, {attribute: 1})}
+    return {k: {_id: found[_collection][_id] for _id, _collection in v if _id in found[_collection]}
+            for k, v in refs.items()}
+
+
+def reference_key(value: Any) -> Any:
+    """
+    Id stored in the raw to_mongo value of a ReferenceField or GenericReferenceField
+    """
+    if isinstance(value, dict) and "_ref" in value:
+        value = value["_ref"]
+    return value.id if isinstance(value, DBRef) else value
@@ -7,6 +7,8 @@
 """
 import time
 import datetime
+from typing import Dict, Optional
+from aioredis.client import Script
 from fastapi import Request
 from app.models.mongo import UserQuotaModel, StorageResourceAllocatedModel
 
@@ -22,27 +24,35 @@ def quota_full(user_id: str) -> bool:
     return True
 
 
+# KEYS: user counter, size of the dataset; ARGV: new size of the dataset.
+# Replacing the dataset size and moving the user counter by the difference is one atomic step
+_CUMULATIVE_SUM = Script(None, b"""
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0') or 0
+redis.call('SET', KEYS[2], ARGV[1])
+-- Formatted as an integer: large Lua numbers would otherwise be sent in exponent notation
+return redis.call('INCRBY', KEYS[1], string.format('%d', tonumber(ARGV[1]) - previous))
+""")
+# KEYS: user counter; ARGV: counter value read before the recount, recounted value.
+# Only applied when no upload or delete moved the counter meanwhile
+_RECONCILE = Script(None, b"""
+if (redis.call('GET', KEYS[1]) or '') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+""")
+
+
 async def cache_cumulative_sum(key: str, value: int, base_dataset_name: str, redis_conn):
     """
     Cache accumulation counter
     :param key: Unique identification
     :param value: Accumulating numbers
-    :param base_dataset_name: Filtering parameters
+    :param base_dataset_name: Filtering parameters, uploading the same dataset again replaces its previous size
     :param redis_conn: redisConnection
     """
-    count = await redis_conn.get(key)
-    _file_key = f"{key}:{base_dataset_name}"
-
-    if not count:
-        count = 0
-        await redis_conn.set(key, value=count)
     try:
-        _his_size = await redis_conn.get(_file_key)
-        if _his_size:
-            count = int(count) - int(_his_size)
-        await redis_conn.set(_file_key, value)
-        incr_value = int(count) + value
-        await redis_conn.set(key, incr_value)
+        await _CUMULATIVE_SUM(keys=[key, f"{key}:{base_dataset_name}"], args=[int(value)], client=redis_conn)
         return True
     except Exception as e:
         print(e)
@@ -51,18 +61,30 @@ async def cache_cumulative_sum(key: str, value: int, base_dataset_name: str, red
 
 async def cut_user_storage_size(user_id: str, value: int, redis_conn):
     try:
-        print(f"cut_user_storage_size -> {user_id}| {value}| {redis_conn}")
-        count = await redis_conn.get(user_id)
-        print(f"cut_user_storage_size COUNT -> {count}")
-        incr_value = int(count) - value
-        print(f"cut_user_storage_size incr_value -> {incr_value}")
-        await redis_conn.set(user_id, incr_value)
+        await redis_conn.decrby(user_id, int(value))
         return True
     except Exception as e:
         print(f"Failed to subtract user storage usage：{e}")
         return False
 
 
+async def reconcile_storage_usage(usage: Dict[str, int], before: Dict[str, Optional[bytes]], redis_conn) -> int:
+    """
+    Fix the drift of the user counters against the usage recounted from the database
+    :param usage: user id -> recounted size
+    :param before: user id -> counter value read before the recount
+    :return: counters corrected
+    """
+    fixed = 0
+    for user_id, size in usage.items():
+        _before = before.get(user_id)
+        if _before is not None and int(_before) == size:
+            continue
+        _before = "" if _before is None else _before
+        fixed += await _RECONCILE(keys=[user_id], args=[_before, int(size)], client=redis_conn)
+    return fixed
+
+
 async def get_cache_cumulative_num(user_id, redis_conn):
     _num = await redis_conn.get(user_id)
     if _num is None:
@@ -4,21 +4,125 @@
 @project:datalab
 @module:sse
 @time:2023/07/21
+
+Server-Sent Events for the clients that can't hold a websocket: frames of the text/event-stream format
+and the progress events of a task log subscription. The id of every event holds the log positions
+delivered so far, a client reconnecting with Last-Event-ID only gets what it has not seen.
 """
-from typing import Iterable, Iterator
+import json
+import time
+import base64
+import asyncio
+from typing import Any, AsyncIterator, Dict, Iterable, Optional
+from fastapi.responses import StreamingResponse
+from app.core.config import settings
+from app.service.manager.tasklog import TaskLogSubscription
+
+SSE_MEDIA_TYPE = "text/event-stream"
+# Proxies must neither cache nor buffer the stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_frame(data: Any, event: Optional[str] = None, event_id: Optional[str] = None,
+              retry: Optional[int] = None) -> str:
+    """
+    :param data: str sent as is, anything else as JSON
+    :param retry: reconnection delay of the client in milliseconds
+    """
+    frame = list()
+    if event_id is not None:
+        frame.append(f"id: {event_id}")
+    if event:
+        frame.append(f"event: {event}")
+    if retry is not None:
+        frame.append(f"retry: {retry}")
+    _data = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    frame.extend(f"data: {_}" for _ in _data.split("\n"))
+    return "\n".join(frame) + "\n\n"
+
+
+def sse_comment(text: str = "heartbeat") -> str:
+    """
+    Ignored by the clients, keeps the connection out of the idle timeouts
+    """
+    return f": {text}\n\n"
+
+
+def encode_event_id(positions: Dict[str, list]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(positions, separators=(",", ":")).encode()).decode()
+
+
+def decode_event_id(event_id: Optional[str]) -> Dict[str, list]:
+    """
+    Positions of a Last-Event-ID, nothing when missing or not one of ours: the whole log is sent
+    """
+    if not event_id:
+        return dict()
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(event_id.encode()))
+        return {str(k): [str(v[0]), int(v[1])] for k, v in positions.items()}
+    except (TypeError, ValueError, AttributeError, IndexError):
+        return dict()
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(events, media_type=SSE_MEDIA_TYPE, headers=SSE_HEADERS)
 
 
-async def event_generator(data):
-    index = 0
-    while True:
-        index += 1
-        if await request.is_disconnected():
-            break
-        # The test takes random data，Take one random number at a time
-        if count := new_count():
-            yield {'data': count}
+def _resource(value: Optional[str]) -> Any:
+    try:
+        return json.loads(value) if value else value
+    except ValueError:
+        return value
 
-        await asyncio.sleep(1)
 
-if __name__ == '__main__':
-    ...
+async def progress_events(subscription: TaskLogSubscription, terminal: Iterable[str],
+                          status_map: Optional[Dict[str, str]] = None) -> AsyncIterator[str]:
+    """
+    Events of a subscription: "log" for new lines, "status" when the status changes, "stage" when tasks join,
+    "task" and "resource" for the task statuses and resource samples of a subscription with details,
+    then "end" once the status is one of terminal.
+    """
+    terminal = set(terminal)
+    status_map = status_map or dict()
+    status, tasks, details = None, list(), dict()
+    last_sent = time.monotonic()
+    first = True
+    async with subscription:
+        while True:
+            try:
+                update = await asyncio.wait_for(subscription.get(), settings.SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield sse_comment()
+                last_sent = time.monotonic()
+                continue
+            event_id = encode_event_id(update.positions)
+            frames = list()
+            if update.tasks != tasks:
+                tasks = list(update.tasks)
+                frames.append(("stage", {"tasks": tasks}))
+            for _task, _detail in update.details.items():
+                _previous = details.get(_task, dict())
+                if _detail["status"] != _previous.get("status"):
+                    frames.append(("task", {"task": _task, "status": status_map.get(_detail["status"],
+                                                                                    _detail["status"])}))
+                if _detail["resource"] != _previous.get("resource"):
+                    frames.append(("resource", {"task": _task, "resource": _resource(_detail["resource"])}))
+                details[_task] = _detail
+            if update.lines:
+                frames.append(("log", {"lines": update.lines}))
+            _status = status_map.get(update.status, update.status)
+            if _status != status:
+                status = _status
+                frames.append(("status", {"status": status}))
+            for _event, _data in frames:
+                yield sse_frame(_data, _event, event_id, settings.SSE_RETRY_MS if first else None)
+                first = False
+            if frames:
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= settings.SSE_HEARTBEAT_INTERVAL:
+                yield sse_comment()
+                last_sent = time.monotonic()
+            if status in terminal:
+                yield sse_frame({"status": status}, "end", event_id)
+                return
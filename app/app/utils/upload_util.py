@@ -0,0 +1,142 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:upload_util
+@time:2023/06/09
+
+Resumable chunked uploads shared by the storage, public data and digital asset endpoints.
+Chunk <n> of <relative_path> is stored as <base_dir>/<relative_path><identifier><n>,
+the manifest of the upload as the hidden file .<file name><identifier>.manifest next to it.
+"""
+import os
+import json
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+from fastapi import UploadFile
+from app.utils.file_util import chunked_copy
+
+COPY_CHUNK_SIZE = 2 ** 20
+
+
+def _manifest_path(base_dir: str, relative_path: str, identifier: str) -> Path:
+    _path = Path(base_dir, f"{relative_path}{identifier}")
+    return _path.with_name(f".{_path.name}.manifest")
+
+
+def _chunk_numbers(directory: Path, prefix: str) -> Dict[int, Path]:
+    """
+    Completely written chunks of the file whose chunk names start with prefix
+    """
+    chunks = dict()
+    if not directory.is_dir():
+        return chunks
+    for _entry in os.scandir(directory):
+        _suffix = _entry.name[len(prefix):]
+        if _entry.name.startswith(prefix) and _suffix.isdigit() and _entry.is_file():
+            chunks[int(_suffix)] = Path(_entry.path)
+    return chunks
+
+
+def _writer() -> str:
+    """
+    Unique to the process and thread: threadpool threads of one worker may write the same chunk
+    """
+    return f"{os.getpid()}.{threading.get_ident()}"
+
+
+def save_chunk(file: UploadFile, base_dir: str, relative_path: str, identifier: str, chunk_number: str,
+               total_chunks: Optional[int] = None, total_size: Optional[int] = None) -> Path:
+    """
+    Copy an uploaded chunk with a fixed size buffer, blocking: run it in the threadpool.
+    The chunk is only visible under its final name once completely written, a resumed upload never sees half a chunk.
+    """
+    chunk_path = Path(base_dir, f"{relative_path}{identifier}{chunk_number}")
+    chunk_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest_path = _manifest_path(base_dir, relative_path, identifier)
+    if total_chunks is not None and not manifest_path.exists():
+        _tmp = manifest_path.with_name(f"{manifest_path.name}.{_writer()}")
+        _tmp.write_text(json.dumps({"relative_path": relative_path, "identifier": identifier,
+                                    "total_chunks": total_chunks, "total_size": total_size}))
+        os.replace(_tmp, manifest_path)
+    _tmp = chunk_path.with_name(f".{chunk_path.name}.{_writer()}.part")
+    try:
+        chunked_copy(file.file, _tmp, chunk_size=COPY_CHUNK_SIZE)
+        os.replace(_tmp, chunk_path)
+    finally:
+        if _tmp.exists():
+            os.remove(_tmp)
+    return chunk_path
+
+
+def uploaded_chunks(base_dir: str, relative_path: str, identifier: str) -> dict:
+    """
+    What a client resuming the upload still has to send
+    """
+    _path = Path(base_dir, f"{relative_path}{identifier}")
+    chunks = sorted(_chunk_numbers(_path.parent, _path.name))
+    manifest = dict()
+    manifest_path = _manifest_path(base_dir, relative_path, identifier)
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+    total_chunks = manifest.get("total_chunks")
+    missing = None if total_chunks is None else sorted(set(range(1, total_chunks + 1)).difference(chunks))
+    return {"identifier": identifier, "relative_path": relative_path, "total_chunks": total_chunks,
+            "total_size": manifest.get("total_size"), "uploaded": chunks, "missing": missing}
+
+
+def _append(source: Path, target, offset: int) -> int:
+    """
+    Append source to the open target without copying through user space when the kernel allows it
+    """
+    size = source.stat().st_size
+    with open(source, 'rb') as reader:
+        copied = 0
+        try:
+            while copied < size:
+                if hasattr(os, "copy_file_range"):
+                    _n = os.copy_file_range(reader.fileno(), target.fileno(), size - copied, offset_dst=offset + copied)
+                else:
+                    _n = os.sendfile(target.fileno(), reader.fileno(), copied, size - copied)
+                if _n == 0:
+                    break
+                copied += _n
+        except OSError:
+            # Cross device or unsupported file system: plain buffered copy of the rest
+            reader.seek(copied)
+            target.seek(offset + copied)
+            shutil.copyfileobj(reader, target, COPY_CHUNK_SIZE)
+            target.flush()
+            copied = size
+    return copied
+
+
+def merge_chunks(base_dir: str, file_name: str, identifier: str) -> List[str]:
+    """
+    Concatenate the chunks of every file named file_name under base_dir in chunk number order,
+    then remove the chunks and the manifest. Blocking: run it in the threadpool.
+    :return: merged file paths
+    """
+    _mode_base = f"{file_name}{identifier}*"
+    _mode_path = base_dir
+    if len(file_name.split('/')) > 1:
+        _mode_base = f"{file_name.rsplit('/', maxsplit=1)[-1]}{identifier}*"
+        _mode_path = f"{base_dir}/{file_name.rsplit('/', maxsplit=1)[0]}"
+    merge_task = dict()
+    for i in Path(_mode_path).rglob(_mode_base):
+        _relative_path, _suffix = i.__fspath__().rsplit(identifier, maxsplit=1)
+        if _suffix.isdigit():
+            merge_task.setdefault(_relative_path, dict())[int(_suffix)] = i
+    for k, v in merge_task.items():
+        with open(k, 'wb') as f:
+            offset = 0
+            for _number in sorted(v):
+                offset += _append(v[_number], f, offset)
+        for _chunk in v.values():
+            os.remove(_chunk)
+        _manifest = Path(k).with_name(f".{Path(k).name}{identifier}.manifest")
+        if _manifest.exists():
+            os.remove(_manifest)
+    return list(merge_task)
@@ -20,14 +20,13 @@ _HUMANINZED_FORMAT = '%0.2f'
 _DISPLAY_FORMAT = '|%s| %s/%s %s [elapsed: %s left: %s, %s MB/sec]'
 _REFRESH_CHAR = '\r'
 from app.core.config import settings
-import redis
+from app.db.redis_util import redis_registry
+from app.utils.minio_util import ensure_bucket
 
 
 def main(client, bucket_name, object_name, file_path, data_id):
-    con = redis.Redis(settings.REDIS_HOST, port=settings.REDIS_PORT, db=7)
-    found = client.bucket_exists(bucket_name)
-    if not found:
-        client.make_bucket(bucket_name)
+    con = redis_registry.sync(settings.FILE_UPLOAD_PROGRESS_DB)
+    ensure_bucket(bucket_name, client)
     print(bucket_name, object_name)
     result = client.fput_object(bucket_name, object_name, file_path, progress=Progress(
         con=con, data_id=data_id))
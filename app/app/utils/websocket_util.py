@@ -0,0 +1,48 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:websocket_util
+@time:2023/06/26
+
+Sockets that only push: starlette reports a disconnect on receive(), never on send(),
+so the client is watched by a receive loop running next to the sender.
+"""
+import asyncio
+from typing import Awaitable
+from fastapi.websockets import WebSocket, WebSocketDisconnect
+
+# Raised by send() on a closed socket, depending on the server
+SEND_CLOSED_ERRORS = (WebSocketDisconnect, RuntimeError, OSError)
+
+
+async def _disconnected(websocket: WebSocket):
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+async def run_until_disconnect(websocket: WebSocket, sender: Awaitable) -> bool:
+    """
+    Run sender until it is done or the client goes away, whichever comes first
+    :return: True when the client disconnected, the socket must not be closed then
+    """
+    watcher = asyncio.ensure_future(_disconnected(websocket))
+    sending = asyncio.ensure_future(sender)
+    done, pending = await asyncio.wait({watcher, sending}, return_when=asyncio.FIRST_COMPLETED)
+    for _task in pending:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        except SEND_CLOSED_ERRORS:
+            pass
+    if watcher in done:
+        return True
+    try:
+        sending.result()
+    except SEND_CLOSED_ERRORS:
+        return True
+    return False
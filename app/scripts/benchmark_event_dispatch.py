@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:benchmark_event_dispatch
+@time:2023/06/02
+
+Event loop latency while dispatching 200 concurrent component triggers to a slow FaaS gateway,
+blocking requests.post versus the pooled async client of app.utils.http_util.
+Run from the app directory with the same .env as the API: python scripts/benchmark_event_dispatch.py
+"""
+import sys
+import time
+import asyncio
+import threading
+import statistics
+sys.path.append('.')
+
+import requests
+
+from app.utils.http_util import async_post, close_async_http_client
+
+CONCURRENCY = 200
+GATEWAY_DELAY = 0.1
+PROBE_INTERVAL = 0.01
+
+
+async def gateway(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # Minimal HTTP/1.1 keep-alive server answering every request with 202 after GATEWAY_DELAY
+    try:
+        while True:
+            header = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in header.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+            await reader.readexactly(length)
+            await asyncio.sleep(GATEWAY_DELAY)
+            writer.write(b"HTTP/1.1 202 Accepted\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        writer.close()
+
+
+async def probe(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - start - PROBE_INTERVAL)
+
+
+async def blocking_trigger(url: str):
+    requests.post(url, json={"task_id": "benchmark"})
+
+
+async def async_trigger(url: str):
+    await async_post(url, json={"task_id": "benchmark"})
+
+
+async def measure(name: str, trigger, url: str):
+    lags = list()
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*[trigger(url) for _ in range(CONCURRENCY)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+    print(f"{name:<10} total {elapsed:7.2f}s  loop lag p50 {statistics.median(lags) * 1000:8.1f}ms  "
+          f"max {max(lags) * 1000:8.1f}ms")
+
+
+def serve_gateway(ready: threading.Event, address: list):
+    # The gateway gets its own loop, the blocking client would otherwise starve it
+    async def _serve():
+        server = await asyncio.start_server(gateway, '127.0.0.1', 0)
+        address.append(server.sockets[0].getsockname()[1])
+        ready.set()
+        async with server:
+            await server.serve_forever()
+    asyncio.run(_serve())
+
+
+async def main():
+    ready = threading.Event()
+    address = list()
+    threading.Thread(target=serve_gateway, args=(ready, address), daemon=True).start()
+    ready.wait()
+    url = f"http://127.0.0.1:{address[0]}/async-function/benchmark"
+    await measure("requests", blocking_trigger, url)
+    await measure("httpx", async_trigger, url)
+    await close_async_http_client()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,28 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:build_ancestors
+@time:2023/06/14
+
+Fill DataFileSystem.ancestors from the parent links for the rows written before it existed,
+run once after scripts/create_indexes.py: python scripts/build_ancestors.py [--user <user id>]
+"""
+import sys
+import argparse
+sys.path.append('.')
+
+from app.db.mongo_util import connect_mongodb, disconnect_mongodb
+from app.service.manager.hierarchy import rebuild_ancestors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuild the materialized ancestors of DataFileSystem")
+    parser.add_argument("--user", help="only the rows of this user")
+    args = parser.parse_args()
+    connect_mongodb()
+    try:
+        filters = {"user": args.user} if args.user else dict()
+        print(f"{rebuild_ancestors(**filters)} rows updated")
+    finally:
+        disconnect_mongodb()
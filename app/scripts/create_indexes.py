@@ -0,0 +1,109 @@
+# -*- coding: UTF-8 -*-
+"""
+@author:wuzhaochen
+@project:datalab
+@module:create_indexes
+@time:2023/06/08
+
+Build the indexes declared in the meta of the hot collections without blocking them,
+then explain the hot query shapes and report the ones still answered by a collection scan.
+Run from the app directory with the same .env as the API: python scripts/create_indexes.py [--check-only]
+"""
+import sys
+import argparse
+sys.path.append('.')
+
+from app.db.mongo_util import connect_mongodb, disconnect_mongodb
+from app.models.mongo import DataFileSystem, ToolTaskModel
+from app.models.mongo.audit_records_info import AuditRecordsModel
+from app.models.mongo.public_data import PublicDataFileModel
+from app.models.mongo.resources import UserQuotaStatementModel
+
+MODELS = [DataFileSystem, ToolTaskModel, UserQuotaStatementModel, AuditRecordsModel, PublicDataFileModel]
+
+# Query shapes of api/center/storage.py, api/component/*.py, utils/statement.py and the audit endpoints,
+# the values only need the right type
+_ID = "00000000000000000000000000"
+HOT_QUERIES = [
+    ("storage root listing",
+     lambda: DataFileSystem.objects(user=_ID, deps=0, deleted=False).order_by("-created_at")),
+    ("storage folder listing",
+     lambda: DataFileSystem.objects(parent=_ID, user=_ID, deleted=False)),
+    ("file by data_path",
+     lambda: DataFileSystem.objects(data_path="/").order_by("-updated_at")),
+    ("experiment data",
+     lambda: DataFileSystem.objects(lab_id=_ID, task_id=_ID, deps=0)),
+    ("analysis data",
+     lambda: DataFileSystem.objects(lab_id=_ID, deps=0)),
+    ("shared data",
+     lambda: DataFileSystem.objects(from_user=_ID, deps=0)),
+    ("subtree",
+     lambda: DataFileSystem.objects(ancestors=_ID)),
+    ("experiment tasks",
+     lambda: ToolTaskModel.objects(experiment=_ID, status="Success")),
+    ("user tasks",
+     lambda: ToolTaskModel.objects(user=_ID).order_by("-created_at")),
+    ("statements by type",
+     lambda: UserQuotaStatementModel.objects(statement_type="Storage and exchange").order_by("-occurrence_time")),
+    ("statements by user",
+     lambda: UserQuotaStatementModel.objects(user__in=[_ID]).order_by("-occurrence_time")),
+    ("statements",
+     lambda: UserQuotaStatementModel.objects().order_by("-occurrence_time")),
+    ("applicant audits",
+     lambda: AuditRecordsModel.objects(applicant=_ID, audit_status=False)),
+    ("pending audits",
+     lambda: AuditRecordsModel.objects(audit_type__in=["Components"], audit_status=False)),
+    ("dataset files",
+     lambda: PublicDataFileModel.objects(datasets=_ID, deps=0)),
+    ("public file by data_path",
+     lambda: PublicDataFileModel.objects(data_path="/").order_by("-updated_at")),
+]
+
+
+def plan_stages(plan: dict):
+    """
+    Every stage name of an explained plan tree
+    """
+    if not plan:
+        return
+    yield plan.get("stage")
+    if "inputStage" in plan:
+        yield from plan_stages(plan["inputStage"])
+    for _stage in plan.get("inputStages", []):
+        yield from plan_stages(_stage)
+
+
+def winning_plan(explain: dict) -> dict:
+    plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+    # Slot based engine (MongoDB 5+) nests the classic plan
+    return plan.get("queryPlan", plan)
+
+
+def create_indexes():
+    for model in MODELS:
+        model.ensure_indexes()
+        print(f"{model._get_collection_name():<32} {len(model._get_collection().index_information())} indexes")
+
+
+def check_plans() -> int:
+    collscans = 0
+    for name, query in HOT_QUERIES:
+        stages = list(plan_stages(winning_plan(query().explain())))
+        scanned = "COLLSCAN" in stages
+        collscans += scanned
+        print(f"{'COLLSCAN' if scanned else 'ok':<9} {name:<26} {' <- '.join(filter(None, stages))}")
+    return collscans
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the hot collection indexes and check the query plans")
+    parser.add_argument("--check-only", action="store_true", help="only explain the hot queries")
+    args = parser.parse_args()
+    connect_mongodb()
+    try:
+        if not args.check_only:
+            create_indexes()
+        failed = check_plans()
+    finally:
+        disconnect_mongodb()
+    sys.exit(1 if failed else 0)